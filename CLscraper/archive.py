@@ -0,0 +1,145 @@
+import glob
+import logging
+import mmap
+import os
+import sqlite3
+import zstandard
+
+# shards are closed and a new one started once they reach this size
+SHARD_SIZE=256 * 1024 * 1024
+
+class PostArchive:
+    """
+    Packed archive of post bodies. Bodies are appended as independent zstd frames to numbered shard files,
+    and an SQLite index maps each posting ID to its (shard, offset, length). Random reads go through a
+    memory map of the shard, so reading one post only touches the bytes of its frame
+    """
+    def __init__(self, path: str, level: int=9):
+        os.makedirs(path, exist_ok=True)
+        self.path=path
+        self.compressor=zstandard.ZstdCompressor(level=level)
+        self.decompressor=zstandard.ZstdDecompressor()
+        # used by one thread at a time, but not always the one that opened it (see pipeline.stream_listings())
+        self.index=sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self.index.execute('CREATE TABLE IF NOT EXISTS posts (posting_id INTEGER PRIMARY KEY, shard INTEGER, '
+                           'offset INTEGER, length INTEGER)')
+        self.index.commit()
+        self.maps={}
+
+    def shard_file(self, shard: int) -> str:
+        return(os.path.join(self.path, 'shard-%05d.zst' % (shard)))
+
+    def current_shard(self) -> int:
+        shards=sorted(glob.glob(os.path.join(self.path, 'shard-*.zst')))
+        if len(shards) == 0:
+            return(0)
+        shard=int(os.path.basename(shards[-1])[6:11])
+        if os.path.getsize(shards[-1]) >= SHARD_SIZE:
+            shard+=1
+        return(shard)
+
+    def append_many(self, posts: dict, replace: bool=False) -> int:
+        """
+        Append post bodies to the current shard. The frames are written and synced before the index is
+        committed, so a crash can leave unreferenced bytes at the end of a shard but never a broken entry
+
+        @param posts: dict with posting ID as key and post body as value
+        @param replace: store a new body for posting IDs already archived, the old frame is left unreferenced
+        @returns: number of posts added, posting IDs already archived are skipped unless replace is set
+        """
+        new=[(int(k), v) for k, v in posts.items() if k is not None and (replace or int(k) not in self)]
+        if len(new) == 0:
+            return(0)
+        shard=self.current_shard()
+        rows=[]
+        with open(self.shard_file(shard), 'ab') as f:
+            offset=f.tell()
+            for posting_id, body in new:
+                frame=self.compressor.compress(body.encode('utf-8'))
+                f.write(frame)
+                rows.append((posting_id, shard, offset, len(frame)))
+                offset+=len(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.index:
+            self.index.executemany('INSERT OR %s INTO posts VALUES (?, ?, ?, ?)' % ('REPLACE' if replace else 'IGNORE'), rows)
+        return(len(rows))
+
+    def append(self, posting_id, body: str) -> int:
+        return(self.append_many({posting_id : body}))
+
+    def __contains__(self, posting_id) -> bool:
+        row=self.index.execute('SELECT 1 FROM posts WHERE posting_id = ?', (int(posting_id),)).fetchone()
+        return(row is not None)
+
+    def __len__(self) -> int:
+        return(self.index.execute('SELECT COUNT(*) FROM posts').fetchone()[0])
+
+    def shard_map(self, shard: int, end: int) -> mmap.mmap:
+        # shards only grow, so a map is reopened when a read goes past its end
+        current=self.maps.get(shard)
+        if current is None or len(current) < end:
+            if current is not None:
+                current.close()
+            with open(self.shard_file(shard), 'rb') as f:
+                current=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[shard]=current
+        return(current)
+
+    def get(self, posting_id) -> str:
+        """
+        Read one post body
+
+        @param posting_id: craigslist posting ID
+        @returns: post body, or None if the post is not archived
+        """
+        row=self.index.execute('SELECT shard, offset, length FROM posts WHERE posting_id = ?', (int(posting_id),)).fetchone()
+        if row is None:
+            return(None)
+        shard, offset, length=row
+        frame=self.shard_map(shard, offset + length)[offset:offset + length]
+        return(self.decompressor.decompress(frame).decode('utf-8'))
+
+    def __iter__(self):
+        """
+        Stream every archived post in storage order, reading each shard sequentially
+
+        @returns: iterator of (posting ID, post body) tuples
+        """
+        rows=self.index.execute('SELECT posting_id, shard, offset, length FROM posts ORDER BY shard, offset')
+        for posting_id, shard, offset, length in rows:
+            frame=self.shard_map(shard, offset + length)[offset:offset + length]
+            yield((posting_id, self.decompressor.decompress(frame).decode('utf-8')))
+
+    def close(self) -> None:
+        for m in self.maps.values():
+            m.close()
+        self.maps={}
+        self.index.close()
+
+def pack_directory(archive: PostArchive, file_path: str, remove: bool=False, batch: int=1000) -> int:
+    """
+    Function that migrates a post_text directory of <posting_id>.txt files into the archive
+
+    @param archive: PostArchive to pack into
+    @param file_path: directory of <posting_id>.txt files
+    @param remove: delete each text file once it is archived
+    @param batch: number of files packed per index commit
+    @returns: number of posts added
+    """
+    paths=sorted(glob.glob(os.path.join(file_path, '*.txt')))
+    added=0
+    for i in range(0, len(paths), batch):
+        posts={}
+        for path in paths[i:i + batch]:
+            posting_id=os.path.basename(path)[:-4]
+            if not posting_id.isdigit():
+                continue
+            with open(path, 'r') as f:
+                posts[posting_id]=f.read()
+        added+=archive.append_many(posts)
+        if remove:
+            for posting_id in posts:
+                os.remove(os.path.join(file_path, posting_id + '.txt'))
+    logging.info('packed %s posts from %s' % (added, file_path))
+    return(added)
@@ -0,0 +1,523 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import pandas as pd
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from CLscraper import maps, media
+from CLscraper.archive import PostArchive
+from CLscraper.cache import configure_cache
+from CLscraper.email import LocalTransport, create_email, digest_messages, make_email_dict, send_messages
+from CLscraper.extract import check_parity, extract_html, parse_pages
+from CLscraper.fetch import configure_fetch, fetch_pages
+from CLscraper.geocache import GEOCODE_CONFIG, configure_geocode, reverse_lookup_batch
+from CLscraper.geoindex import index_listings
+from CLscraper.lib import extract_soup, scrape_data, search_links
+from CLscraper.maps import reverse_lookup
+from CLscraper.helpers import filter_spam
+from CLscraper.media import configure_media
+from CLscraper.metrics import STAGES, reset_metrics, stage
+from CLscraper.pipeline import stream_listings
+from CLscraper.query import find_listings, open_readonly
+from CLscraper.records import ListingRecord, listings_frame
+from CLscraper.seen import SeenIndex
+from CLscraper.session import configure_http
+from CLscraper.standin import FIXTURE_PATH, StandinServer
+from CLscraper.schema import normalize_listings
+from CLscraper.store import LISTING_COLUMNS, append_listings, open_store, sql_rows
+from CLscraper.textmetrics import *
+
+# words used to build synthetic post bodies when no real post text is available
+SYNTHETIC_WORDS=['spacious', 'HOUSE', 'with', 'a', 'fenced', 'yard', 'near', 'parks', 'and', 'shops.', 'NO', 'SMOKING',
+                 'pets', 'negotiable.', '1800', 'sq', 'ft', 'managed', 'by', 'Windermere', 'www.example.com', '3BR',
+                 '2BA', 'available', 'now!!', 'Dogs', 'welcome.', 'call', 'today', 'quiet', 'street', 'garage']
+# synthetic listings of the query benchmark are posted one every SYNTHETIC_INTERVAL from SYNTHETIC_START
+SYNTHETIC_START=datetime.datetime(2018, 1, 1)
+SYNTHETIC_INTERVAL=datetime.timedelta(minutes=5)
+
+def synthetic_bodies(n: int, seed: int=0) -> list:
+    """
+    Function that creates post bodies with the length and vocabulary of typical craigslist rentals
+
+    @param n: number of bodies
+    @param seed: random seed, so runs are comparable
+    @returns: list of strings
+    """
+    rng=random.Random(seed)
+    return([' '.join(rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randint(80, 400))) for _ in range(n)])
+
+def load_bodies(file_path: str, n: int) -> list:
+    """
+    Function that reads up to n post bodies from a post_text directory
+
+    @param file_path: directory of <posting_id>.txt files written by extract_soup()
+    @param n: maximum number of bodies
+    @returns: list of strings
+    """
+    bodies=[]
+    for path in sorted(glob.glob(os.path.join(file_path, '*.txt')))[:n]:
+        with open(path, 'r') as f:
+            bodies.append(f.read())
+    return(bodies)
+
+def timed(function, *args, repeat: int=3) -> float:
+    """
+    Function that returns the best wall time of several calls
+
+    @param function: function to time
+    @param args: arguments to the function
+    @param repeat: number of calls
+    @returns: seconds
+    """
+    best=None
+    for i in range(repeat):
+        start=time.perf_counter()
+        function(*args)
+        elapsed=time.perf_counter() - start
+        best=elapsed if best is None else min(best, elapsed)
+    return(best)
+
+def bench_text_metrics(bodies: list, repeat: int=3) -> dict:
+    """
+    Benchmark of the text metrics, one post at a time as parse_listing() computes them
+
+    @param bodies: list of post bodies
+    @param repeat: number of timed runs, the best is kept
+    @returns: dict with throughput in bodies/second
+    """
+    def per_post(bodies):
+        for body in bodies:
+            property_management(body)
+            count_caps_words(body)
+            len(body.split(" "))
+            dog_from_text(body)
+            sqft_from_text(body)
+    single=timed(per_post, bodies, repeat=repeat)
+    return({'bodies' : len(bodies),
+            'per_post_bodies_per_second' : len(bodies) / single})
+
+def synthetic_store(path: str, n: int, seed: int=0) -> None:
+    """
+    Function that writes a listing store of n synthetic listings spread over the Portland area
+
+    @param path: file path of the SQLite listing store to create
+    @param n: number of listings
+    @param seed: random seed
+    @returns: None
+    """
+    rng=random.Random(seed)
+    DB=open_store(path)
+    for first in range(0, n, 100000):
+        rows=[]
+        for posting_id in range(first, min(n, first + 100000)):
+            posted=(SYNTHETIC_START + SYNTHETIC_INTERVAL * posting_id).strftime('%Y-%m-%dT%H:%M:%S')
+            rows.append((posting_id, 'https://portland.craigslist.org/apa/d/%s.html' % (posting_id),
+                         rng.randrange(800, 6000), str(rng.randrange(97201, 97240)), posted,
+                         round(rng.uniform(45.3, 45.7), 6), round(rng.uniform(-122.9, -122.4), 6)))
+        with DB:
+            DB.executemany('INSERT INTO listings ("index", url, price, zipcode, date_posted, latitude, longitude) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            index_listings(DB, [x[0] for x in rows])
+    DB.close()
+
+def bench_query(listings: int, repeat: int=3) -> dict:
+    """
+    Benchmark of the query index: radius, bounding box and attribute queries over a synthetic store,
+    against the same radius query as a full scan of the listings table
+
+    @param listings: number of listings in the synthetic store
+    @param repeat: number of timed runs per query, the best is kept
+    @returns: dict with query name as key and dict of seconds and matching listings as value
+    """
+    tmp=tempfile.mkdtemp()
+    try:
+        path=os.path.join(tmp, 'query.sqlite')
+        start=time.perf_counter()
+        synthetic_store(path, listings)
+        results={'listings' : listings, 'build_seconds' : time.perf_counter() - start}
+        connection=open_readonly(path)
+        # the newest quarter of the synthetic listings, wherever their posting dates end
+        since=(SYNTHETIC_START + SYNTHETIC_INTERVAL * (listings * 3 // 4)).strftime('%Y-%m-%d')
+        queries={'radius' : {'near' : (45.52, -122.68, 2.0), 'max_price' : 3000},
+                 'bbox' : {'bbox' : (45.50, -122.70, 45.53, -122.65), 'min_price' : 2000},
+                 'zipcode_since' : {'zipcode' : ['97209'], 'since' : since, 'max_price' : 2500}}
+        for name, query in queries.items():
+            seconds=timed(lambda: find_listings(connection, **query), repeat=repeat)
+            results[name]={'seconds' : seconds, 'matches' : len(find_listings(connection, **query)[1])}
+        scan='SELECT * FROM listings WHERE distance_km(CAST(latitude AS REAL), CAST(longitude AS REAL), ?, ?) <= ?'
+        seconds=timed(lambda: connection.execute(scan, (45.52, -122.68, 2.0)).fetchall(), repeat=1)
+        results['radius_full_scan']={'seconds' : seconds}
+        connection.close()
+    finally:
+        shutil.rmtree(tmp)
+    return(results)
+
+def bench_schema(df: pd.DataFrame, n: int, repeat: int=3) -> dict:
+    """
+    Benchmark of the typed listing layout: normalize_listings() over a batch, memory of the frame as scraped
+    and typed, the spam filter over both, and the store bytes per listing as text columns and typed columns
+
+    @param df: listings as parsed, e.g. concatenated extract_html() rows with the posting ID in column 'index'
+    @param n: number of listings, the rows are repeated with new posting IDs to reach it
+    @param repeat: number of timed runs, the best is kept
+    @returns: dict of figures
+    """
+    raw=df.iloc[[i % len(df) for i in range(n)]].reset_index(drop=True)
+    raw['index']=[str(7000000000 + i) for i in range(n)]
+    typed=normalize_listings(raw)
+    results={'listings' : n,
+             'normalize_us_per_listing' : timed(normalize_listings, raw, repeat=repeat) / n * 1e6,
+             'text_bytes_per_listing' : raw.memory_usage(deep=True).sum() / n,
+             'typed_bytes_per_listing' : typed.memory_usage(deep=True).sum() / n,
+             'filter_text_seconds' : timed(filter_spam, raw, repeat=repeat),
+             'filter_typed_seconds' : timed(filter_spam, typed, repeat=repeat)}
+    tmp=tempfile.mkdtemp()
+    try:
+        path=os.path.join(tmp, 'text.sqlite')
+        connection=sqlite3.connect(path)
+        columns=', '.join(['"%s"' % (x) for x in raw.columns])
+        connection.execute('CREATE TABLE listings (%s)' % (columns))
+        connection.executemany('INSERT INTO listings VALUES (%s)' % (', '.join('?' * len(raw.columns))),
+                               sql_rows(raw))
+        connection.commit()
+        connection.execute('VACUUM')
+        connection.close()
+        results['text_disk_bytes_per_listing']=os.path.getsize(path) / n
+        path=os.path.join(tmp, 'typed.sqlite')
+        DB=open_store(path)
+        append_listings(DB, typed)
+        DB.execute('DROP TABLE listing_index')
+        DB.execute('VACUUM')
+        DB.close()
+        results['typed_disk_bytes_per_listing']=os.path.getsize(path) / n
+    finally:
+        shutil.rmtree(tmp)
+    return(results)
+
+def bench_parity(pages: dict, file_path: str) -> dict:
+    """
+    Check that the single-pass extract_html() and the BeautifulSoup based extract_soup() give the same row
+    for every post fixture the stand-in server rendered
+
+    @param pages: dict with URL as key and post HTML as value
+    @param file_path: directory to write body txt files
+    @returns: dict with the number of pages checked and the list of (URL, column, extract_soup value,
+    extract_html value) mismatches
+    """
+    mismatches=[]
+    for url, html in pages.items():
+        mismatches+=[(url,) + diff for diff in check_parity(html, url, file_path)]
+    return({'pages' : len(pages), 'mismatches' : mismatches})
+
+def bench_listing_rows(records: list, n: int, repeat: int=3) -> dict:
+    """
+    Benchmark of building the listings DataFrame: one single row DataFrame per post concatenated at the end,
+    as make_output() used to, against ListingRecord objects built into one frame by listings_frame()
+
+    @param records: parsed listings, output of parse_pages()
+    @param n: number of posts, the records are repeated to reach it
+    @param repeat: number of timed runs, the best is kept
+    @returns: dict with microseconds per post of both ways, and whether they build the same frame
+    """
+    fields=[{column : getattr(record, column) for column in LISTING_COLUMNS} for record in records]
+    fields=[(str(posting_id), fields[posting_id % len(fields)]) for posting_id in range(n)]
+    def row_frames(fields):
+        frames=[pd.DataFrame.from_dict({posting_id : values}, columns=list(values), orient='index')
+                for posting_id, values in fields]
+        return(pd.concat(frames))
+    def record_batch(fields):
+        return(listings_frame([ListingRecord(posting_id, **values) for posting_id, values in fields]))
+    before=timed(row_frames, fields, repeat=repeat)
+    after=timed(record_batch, fields, repeat=repeat)
+    return({'posts' : n,
+            'row_frames_us_per_post' : before / n * 1e6,
+            'records_us_per_post' : after / n * 1e6,
+            'same_frame' : row_frames(fields).equals(record_batch(fields))})
+
+# dependencies a CLscraper command line must not import before its subcommand is chosen
+HEAVY_MODULES=['pandas', 'numpy', 'bs4', 'emoji', 'PIL', 'googleapiclient']
+
+def import_times(stderr: str) -> dict:
+    """
+    @param stderr: standard error of a python -X importtime run
+    @returns: dict with module name as key and its own import time in microseconds as value
+    """
+    times={}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name=line[len('import time:'):].split('|')
+        times[name.strip()]=int(own)
+    return(times)
+
+def bench_startup(argv: list, repeat: int=3) -> dict:
+    """
+    Function that times the CLscraper command line in a fresh interpreter under -X importtime, to check that
+    startup stays cheap and that heavy dependencies are only imported by the subcommands that use them
+
+    @param argv: command line arguments, e.g. ['query', '--help']
+    @param repeat: number of runs, the fastest is reported
+    @returns: dict with seconds (whole process), import_seconds, modules and heavy_imports
+    """
+    best, times=(None, {})
+    for i in range(repeat):
+        start=time.perf_counter()
+        process=subprocess.run([sys.executable, '-X', 'importtime', '-m', 'CLscraper.start'] + argv,
+                               capture_output=True, text=True)
+        seconds=time.perf_counter() - start
+        if best is None or seconds < best:
+            best, times=(seconds, import_times(process.stderr))
+    return({'seconds' : best,
+            'import_seconds' : sum(times.values()) / 1e6,
+            'modules' : len(times),
+            'heavy_imports' : sorted({x.split('.')[0] for x in times} & set(HEAVY_MODULES))})
+
+def stage_result(seconds: float, items: int, **extra) -> dict:
+    """
+    @param seconds: wall time of the stage
+    @param items: number of items (pages, posts, locations...) processed
+    @param extra: any other figures to report
+    @returns: dict with seconds, items and items_per_second
+    """
+    result={'seconds' : seconds, 'items' : items, 'items_per_second' : items / seconds if seconds > 0 else None}
+    result.update(extra)
+    return(result)
+
+def configure_standin(base: str, concurrency: int) -> None:
+    """
+    Function that points every network call of the package at the stand-in server, with caches off
+
+    @param base: base URL of a running StandinServer
+    @param concurrency: number of requests in flight
+    @returns: None
+    """
+    maps.GEOCODE_URL=base + '/maps/api/geocode/json?latlng='
+    media.STATIC_MAP_URL=base + '/maps/api/staticmap?'
+    configure_fetch(concurrency=concurrency, host_concurrency=concurrency, rate=10000.0, burst=concurrency, retries=8,
+                    min_rate=1.0)
+    configure_http(pool_size=max(concurrency, 8))
+    configure_cache(path=None, replay=False)
+    configure_geocode(path=None)
+    configure_media(path=None)
+
+def run_stages(server: StandinServer, posts: int, workers: int, emails: int, repeat: int=3) -> dict:
+    """
+    Function that runs each pipeline stage against the stand-in server and times it
+
+    @param server: running StandinServer
+    @param posts: number of posts to fetch and parse
+    @param workers: parse processes for the parse_pages stage
+    @param emails: number of listings in the alert email stage
+    @param repeat: number of timed runs per micro benchmark
+    @returns: dict with stage name as key and stage_result() as value
+    """
+    results={}
+    tmp=tempfile.mkdtemp()
+    try:
+        stem=server.base + '/search/apa?hasPic=1&housing_type=6'
+        start=time.perf_counter()
+        urls=search_links(stem, SeenIndex())
+        results['search_links']=stage_result(time.perf_counter() - start, server.counts.get('search', 0), listings=len(urls))
+        urls=urls[:posts]
+
+        start=time.perf_counter()
+        pages=fetch_pages(urls)
+        results['fetch_pages']=stage_result(time.perf_counter() - start, len(pages))
+
+        start=time.perf_counter()
+        soups=scrape_data(urls)
+        results['scrape_data']=stage_result(time.perf_counter() - start, len(soups))
+
+        file_path=os.path.join(tmp, 'post_text')
+        os.makedirs(file_path)
+        start=time.perf_counter()
+        for url, soup in soups.items():
+            extract_soup(soup, url, file_path, None)
+        results['extract_soup']=stage_result(time.perf_counter() - start, len(soups))
+
+        start=time.perf_counter()
+        rows=[extract_html(html, url, file_path, None) for url, html in pages.items()]
+        results['extract_html']=stage_result(time.perf_counter() - start, len(pages))
+        results['parity']=bench_parity(pages, file_path)
+
+        start=time.perf_counter()
+        outlist, fails=parse_pages(pages, PostArchive(os.path.join(tmp, 'archive')), None, workers)
+        results['parse_pages']=stage_result(time.perf_counter() - start, len(pages), workers=workers, failed=fails)
+        results['listing_rows']=bench_listing_rows(outlist, max(len(outlist), 10000), repeat)
+
+        raw=pd.concat(rows).reset_index()
+        df=normalize_listings(raw)
+        coords=list(zip(raw['latitude'], raw['longitude']))
+        start=time.perf_counter()
+        for lat, long in coords:
+            reverse_lookup('standin', lat, long)
+        results['reverse_lookup']=stage_result(time.perf_counter() - start, len(coords))
+
+        start=time.perf_counter()
+        reverse_lookup_batch('standin', coords)
+        results['reverse_lookup_batch']=stage_result(time.perf_counter() - start, len(coords))
+
+        alert=df.head(emails)
+        start=time.perf_counter()
+        email_dict=make_email_dict(alert, pages, 'standin')
+        results['make_email_dict']=stage_result(time.perf_counter() - start, len(alert))
+
+        start=time.perf_counter()
+        message=create_email('me', 'you@example.com', 'Housing Email Alert', email_dict)
+        results['create_email']=stage_result(time.perf_counter() - start, len(alert), bytes=len(message['raw']))
+
+        start=time.perf_counter()
+        sent=send_messages(LocalTransport(os.path.join(tmp, 'mail')),
+                           digest_messages('me', 'you@example.com', 'Housing Email Alert', email_dict))
+        results['send_digests']=stage_result(time.perf_counter() - start, len(alert), messages=len(sent))
+
+        DB=open_store(os.path.join(tmp, 'bench.sqlite'))
+        start=time.perf_counter()
+        append_listings(DB, df)
+        results['database_write']=stage_result(time.perf_counter() - start, len(df))
+        DB.close()
+
+        for name, result in bench_pipeline(urls, workers).items():
+            results['pipeline_' + name]=result
+        results['schema']=bench_schema(raw, 20000, repeat)
+    finally:
+        shutil.rmtree(tmp)
+    return(results)
+
+def bench_pipeline(urls: list, workers: int) -> dict:
+    """
+    Benchmark of the new post scrape run phase by phase (fetch every page, parse them all, then fetch the
+    alert media) against the streaming pipeline of stream_listings(), in wall time and peak memory. Each run
+    gets an empty geocode cache, which is what dedups locations across the pipeline's micro-batches
+
+    @param urls: posting URLs on the stand-in server
+    @param workers: parse processes
+    @returns: dict with 'phased' and 'streaming' stage_result() values, with the peak memory in kilobytes of this
+    process only (Linux), which also runs the stand-in server, not of the parse pool processes
+    """
+    results={}
+    tmp=tempfile.mkdtemp()
+    try:
+        reset_metrics()
+        configure_geocode(path=os.path.join(tmp, 'phased.sqlite'))
+        start=time.perf_counter()
+        with stage('phased'):
+            pages=fetch_pages(urls)
+            outlist, fails=parse_pages(pages, PostArchive(os.path.join(tmp, 'phased')), 'standin', workers)
+            clean=filter_spam(listings_frame(outlist).reset_index())
+            make_email_dict(clean, pages, 'standin')
+            del pages
+        results['phased']=stage_result(time.perf_counter() - start, len(outlist), failed=fails,
+                                       peak_memory_kb=STAGES['phased']['peak_memory_kb'])
+        figures={}
+        configure_geocode(path=os.path.join(tmp, 'streaming.sqlite'))
+        start=time.perf_counter()
+        outlist, alerts=([], 0)
+        with stage('streaming'):
+            # images are dropped as they arrive, as scrape does when the media cache is on
+            for record, images in stream_listings(urls, PostArchive(os.path.join(tmp, 'streaming')), 'standin',
+                                                  workers, figures=figures):
+                outlist.append(record)
+                alerts+=images is not None
+        results['streaming']=stage_result(time.perf_counter() - start, len(outlist), failed=figures['failed'],
+                                          peak_memory_kb=STAGES['streaming']['peak_memory_kb'], alerts=alerts)
+    finally:
+        GEOCODE_CONFIG['path']=None
+        configure_geocode()
+        shutil.rmtree(tmp)
+    return(results)
+
+def compare_results(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Function that compares two benchmark runs stage by stage
+
+    @param results: benchmark output of this run
+    @param baseline: benchmark output of an earlier run
+    @param tolerance: allowed slowdown as a fraction, e.g. 0.1 for 10%
+    @returns: list of (stage, baseline seconds, seconds) for every stage that got slower than the tolerance
+    """
+    regressions=[]
+    for stage, result in results['stages'].items():
+        before=baseline.get('stages', {}).get(stage)
+        if before is None or not before.get('seconds') or not result.get('seconds'):
+            continue
+        if result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append((stage, before['seconds'], result['seconds']))
+    return(regressions)
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(description='CLscraper offline benchmarks, run against a local stand-in server')
+    parser.add_argument('--posts', type=int, default=200, help='number of posts fetched and parsed')
+    parser.add_argument('--emails', type=int, default=20, help='number of listings in the alert email stage')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parse processes for the parse_pages stage')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in server waits before answering')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--fixtures', type=str, default=FIXTURE_PATH, help='directory of recorded fixtures')
+    parser.add_argument('--post-text', type=str, default=None, help='post_text directory to benchmark text metrics on real posts')
+    parser.add_argument('-n', type=int, default=2000, help='number of posts for the text metrics benchmark')
+    parser.add_argument('--query-listings', type=int, default=200000, help='number of synthetic listings for the query benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per micro benchmark, the best is reported')
+    parser.add_argument('--output', type=str, default=None, help='write the JSON results to this file')
+    parser.add_argument('--compare', type=str, default=None, help='earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown per stage with --compare')
+    parser.add_argument('--startup-budget', type=float, default=0.25, help='seconds of imports allowed before a subcommand is chosen')
+    arguments=parser.parse_args(argv)
+
+    server=StandinServer(arguments.fixtures, total=arguments.posts, latency=arguments.latency,
+                         error_rate=arguments.error_rate)
+    configure_standin(server.start(), arguments.concurrency)
+    try:
+        stages=run_stages(server, arguments.posts, arguments.workers, arguments.emails, arguments.repeat)
+    finally:
+        server.stop()
+    if arguments.post_text is not None:
+        bodies=load_bodies(arguments.post_text, arguments.n)
+    else:
+        bodies=synthetic_bodies(arguments.n)
+    stages['text_metrics']=bench_text_metrics(bodies, arguments.repeat)
+    stages['query']=bench_query(arguments.query_listings, arguments.repeat)
+    stages['startup']=bench_startup(['--help'], arguments.repeat)
+    stages['startup_query']=bench_startup(['query', '--help'], arguments.repeat)
+    stages['startup_scrape']=bench_startup(['scrape', '--help'], arguments.repeat)
+
+    results={'meta' : {'time' : datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python' : platform.python_version(),
+                       'platform' : platform.platform(),
+                       'settings' : vars(arguments),
+                       'requests' : server.counts},
+             'stages' : stages}
+    text=json.dumps(results, indent=2, default=str)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as f:
+            f.write(text)
+    print(text)
+    failed=False
+    for url, column, expected, result in stages['parity']['mismatches']:
+        print('PARITY %s %s: extract_soup %r, extract_html %r' % (url, column, expected, result), file=sys.stderr)
+        failed=True
+    for stage in ('startup', 'startup_query'):
+        if stages[stage]['heavy_imports'] or stages[stage]['import_seconds'] > arguments.startup_budget:
+            print('STARTUP %s: %.3fs of imports, heavy imports %s' % (stage, stages[stage]['import_seconds'],
+                  ', '.join(stages[stage]['heavy_imports']) or 'none'), file=sys.stderr)
+            failed=True
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as f:
+            regressions=compare_results(results, json.load(f), arguments.tolerance)
+        for stage, before, after in regressions:
+            print('REGRESSION %s: %.3fs -> %.3fs' % (stage, before, after), file=sys.stderr)
+        failed=failed or len(regressions) > 0
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+import uuid
+
+# response cache settings, the cache is disabled until configure_cache() is given a path. Search pages are
+# revalidated on every fetch unless search_ttl is raised, new listings and edits only show up there
+CACHE_CONFIG={'path' : None,
+              'search_ttl' : 0,
+              'post_ttl' : 60 * 60 * 24 * 30,
+              'replay' : False}
+
+def configure_cache(**kwargs) -> None:
+    """
+    Function that updates the response cache settings
+
+    @param kwargs: any of path, search_ttl, post_ttl, replay
+    @returns: None
+    """
+    for key, value in kwargs.items():
+        if key not in CACHE_CONFIG:
+            raise KeyError('unknown cache setting %s' % (key))
+        if value is not None:
+            CACHE_CONFIG[key]=value
+
+def cache_enabled() -> bool:
+    """
+    @returns: True if a cache directory has been configured
+    """
+    return(CACHE_CONFIG['path'] is not None)
+
+def cache_file(url: str, suffix: str) -> str:
+    """
+    Function that maps a URL to its location in the cache, files are fanned out over 256
+    subdirectories by the first byte of the sha256 of the URL
+
+    @param url: URL of the cached page
+    @param suffix: file extension, .html.gz for page content or .json for metadata
+    @returns: file path
+    """
+    key=hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return(os.path.join(CACHE_CONFIG['path'], key[:2], key + suffix))
+
+def url_ttl(url: str) -> int:
+    """
+    Function that returns how long a cached page stays fresh, search result pages change
+    constantly while posts rarely change once published
+
+    @param url: craigslist URL
+    @returns: time to live in seconds
+    """
+    if '/search/' in url:
+        return(CACHE_CONFIG['search_ttl'])
+    return(CACHE_CONFIG['post_ttl'])
+
+def read_cache(url: str) -> dict:
+    """
+    Function that reads the cache metadata for a URL
+
+    @param url: URL of the cached page
+    @returns: dict with url, etag, last_modified and fetched (epoch seconds), or None if not cached
+    """
+    if not cache_enabled():
+        return(None)
+    try:
+        with open(cache_file(url, '.json'), 'r') as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return(None)
+
+def cached_text(url: str) -> str:
+    """
+    Function that reads and decompresses a cached page
+
+    @param url: URL of the cached page
+    @returns: page HTML, or None if the page is missing from the cache
+    """
+    try:
+        with gzip.open(cache_file(url, '.html.gz'), 'rt', encoding='utf-8') as f:
+            return(f.read())
+    except OSError:
+        return(None)
+
+def is_fresh(url: str, entry: dict) -> bool:
+    """
+    @param url: URL of the cached page
+    @param entry: output of read_cache()
+    @returns: True if the cached copy is younger than the TTL for its URL class
+    """
+    return(time.time() - entry['fetched'] < url_ttl(url))
+
+def conditional_headers(entry: dict) -> dict:
+    """
+    Function that builds revalidation headers from cached ETag/Last-Modified values
+
+    @param entry: output of read_cache(), or None
+    @returns: dict of request headers
+    """
+    headers={}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match']=entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since']=entry['last_modified']
+    return(headers)
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Function that writes a file through a temporary file so a crash never leaves a partial entry. Each
+    writer gets its own uniquely named temporary file, so concurrent writers of the same entry never collide
+
+    @param path: destination file path
+    @param data: file content
+    @returns: None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp='%s.%s.tmp' % (path, uuid.uuid4().hex)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def write_cache(url: str, response) -> None:
+    """
+    Function that stores a 200 response in the cache as gzip compressed HTML plus metadata
+
+    @param url: URL that was requested
+    @param response: requests.Response object
+    @returns: None
+    """
+    if not cache_enabled():
+        return
+    write_atomic(cache_file(url, '.html.gz'), gzip.compress(response.text.encode('utf-8')))
+    entry={'url' : url,
+           'etag' : response.headers.get('ETag'),
+           'last_modified' : response.headers.get('Last-Modified'),
+           'fetched' : time.time()}
+    write_atomic(cache_file(url, '.json'), json.dumps(entry).encode('utf-8'))
+
+def touch_cache(url: str, entry: dict) -> None:
+    """
+    Function that marks a cached page fresh again after a 304 Not Modified response
+
+    @param url: URL of the cached page
+    @param entry: output of read_cache()
+    @returns: None
+    """
+    entry['fetched']=time.time()
+    write_atomic(cache_file(url, '.json'), json.dumps(entry).encode('utf-8'))
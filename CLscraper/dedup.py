@@ -0,0 +1,143 @@
+import hashlib
+import numpy as np
+import os
+import re
+import sqlite3
+import zlib
+
+# MinHash permutations are (a * x + b) mod PRIME over 32 bit shingle hashes, which cannot overflow uint64
+PRIME=(1 << 31) - 1
+TOKEN_PATTERN=re.compile(r'\w+')
+
+class RepostIndex:
+    """
+    Persistent MinHash/LSH index of post bodies, used to recognize a listing reposted under a new posting ID.
+    Each body is reduced to a MinHash signature over its word shingles. The signature is cut into bands and
+    every band is hashed to one key, stored in an indexed SQLite table, so finding candidates is a few
+    B-tree lookups however many posts are indexed. Candidates are confirmed on the estimated Jaccard
+    similarity of the full signatures, and on distance when both posts have coordinates
+
+    With the defaults (128 permutations in 16 bands of 8 rows) a pair with a Jaccard similarity of 0.9 is
+    found as a candidate 99.99% of the time, at 0.8 95% of the time, and at 0.5 only 6% of the time
+    """
+    def __init__(self, path: str, num_perm: int=128, bands: int=16, shingle: int=5, threshold: float=0.8,
+                 distance: float=0.01, seed: int=1):
+        if num_perm % bands != 0:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.num_perm=num_perm
+        self.bands=bands
+        self.rows=num_perm // bands
+        self.shingle=shingle
+        self.threshold=threshold
+        self.distance=distance
+        rng=np.random.RandomState(seed)
+        self.a=rng.randint(1, PRIME, size=num_perm).astype(np.uint64)
+        self.b=rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+        dirname=os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # used by one thread at a time, but not always the one that opened it (see pipeline.stream_listings())
+        self.index=sqlite3.connect(path, check_same_thread=False)
+        self.index.execute('CREATE TABLE IF NOT EXISTS posts (posting_id INTEGER PRIMARY KEY, original INTEGER, '
+                           'latitude REAL, longitude REAL, signature BLOB)')
+        self.index.execute('CREATE TABLE IF NOT EXISTS bands (key INTEGER, posting_id INTEGER)')
+        self.index.execute('CREATE INDEX IF NOT EXISTS bands_key ON bands (key)')
+        self.index.commit()
+
+    def shingles(self, text: str) -> set:
+        """
+        @param text: post body
+        @returns: set of 32 bit hashes of the overlapping runs of self.shingle lowercase words
+        """
+        words=TOKEN_PATTERN.findall(text.lower())
+        if len(words) <= self.shingle:
+            return({zlib.crc32(' '.join(words).encode('utf-8'))})
+        return({zlib.crc32(' '.join(words[i:i + self.shingle]).encode('utf-8'))
+                for i in range(len(words) - self.shingle + 1)})
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        @param text: post body
+        @returns: MinHash signature, num_perm uint32 values
+        """
+        hashes=np.fromiter(self.shingles(text), dtype=np.uint64)
+        return(((np.outer(self.a, hashes) + self.b[:, None]) % PRIME).min(axis=1).astype(np.uint32))
+
+    def band_keys(self, signature: np.ndarray) -> list:
+        """
+        @param signature: output of signature()
+        @returns: one signed 64 bit key per band, the band number is part of the key
+        """
+        keys=[]
+        for band in range(self.bands):
+            digest=hashlib.blake2b(bytes([band]) + signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                                   digest_size=8).digest()
+            keys.append(int.from_bytes(digest, 'little', signed=True))
+        return(keys)
+
+    def near(self, lat, long, row: tuple) -> bool:
+        try:
+            lat, long=(float(lat), float(long))
+        except (TypeError, ValueError):
+            return(True)
+        if row[2] is None or row[3] is None:
+            return(True)
+        return(abs(lat - row[2]) <= self.distance and abs(long - row[3]) <= self.distance)
+
+    def match(self, signature: np.ndarray, keys: list, lat, long):
+        """
+        Find the most similar indexed post that passes the similarity and distance checks
+
+        @param signature: output of signature()
+        @param keys: output of band_keys()
+        @param lat: latitude of the post, or None
+        @param long: longitude of the post, or None
+        @returns: row (posting_id, original, latitude, longitude, signature) of the match, or None
+        """
+        candidates=self.index.execute('SELECT DISTINCT posting_id FROM bands WHERE key IN (%s)'
+                                      % (', '.join('?' * len(keys))), keys).fetchall()
+        best, best_similarity=(None, self.threshold)
+        for (posting_id,) in candidates:
+            row=self.index.execute('SELECT posting_id, original, latitude, longitude, signature FROM posts '
+                                   'WHERE posting_id = ?', (posting_id,)).fetchone()
+            similarity=float(np.mean(np.frombuffer(row[4], dtype=np.uint32) == signature))
+            if similarity >= best_similarity and self.near(lat, long, row):
+                best, best_similarity=(row, similarity)
+        return(best)
+
+    def check_many(self, posts: list) -> dict:
+        """
+        Look up a batch of posts and add them to the index, in one transaction. Posts are checked in order,
+        so a repost of a post earlier in the same batch is found too
+
+        @param posts: list of (posting ID, post body, latitude, longitude) tuples
+        @returns: dict with posting ID as key and the posting ID of the first post it reposts as value, or
+        None when the post is not a repost
+        """
+        found={}
+        with self.index:
+            for posting_id, text, lat, long in posts:
+                posting_id=int(posting_id)
+                known=self.index.execute('SELECT original FROM posts WHERE posting_id = ?', (posting_id,)).fetchone()
+                if known is not None:
+                    found[posting_id]=known[0]
+                    continue
+                signature=self.signature(text or '')
+                keys=self.band_keys(signature)
+                row=self.match(signature, keys, lat, long)
+                original=None if row is None else (row[1] if row[1] is not None else row[0])
+                found[posting_id]=original
+                try:
+                    lat, long=(float(lat), float(long))
+                except (TypeError, ValueError):
+                    lat, long=(None, None)
+                self.index.execute('INSERT INTO posts VALUES (?, ?, ?, ?, ?)',
+                                   (posting_id, original, lat, long, signature.tobytes()))
+                self.index.executemany('INSERT INTO bands VALUES (?, ?)', [(key, posting_id) for key in keys])
+        return(found)
+
+    def __len__(self) -> int:
+        return(self.index.execute('SELECT COUNT(*) FROM posts').fetchone()[0])
+
+    def close(self) -> None:
+        self.index.close()
@@ -1,16 +1,35 @@
-import io
+import argparse
 import base64
+import datetime
 import email 
 import io
+import logging
+import os
+import uuid
 
+from CLscraper.cache import configure_cache
+from CLscraper.extract import parse_post
+from CLscraper.fetch import fetch_pages
 from CLscraper.helpers import *
 from CLscraper.maps import *
+from CLscraper.media import configure_media, fetch_listing_media, get_thumbnail
+from CLscraper.query import find_listings
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
-from PIL import Image
+
+# alert email settings: size bound of one digest message (MIME bytes, before the base64 encoding of the
+# Gmail API) and number of messages sent per Gmail batch request
+EMAIL_CONFIG={'max_bytes' : 10 * 1024 * 1024,
+              'batch' : 10}
+
+# MIME headers and boundaries added per inline image, on top of its base64 payload
+IMAGE_OVERHEAD=300
+
+# one authenticated Gmail service per credentials file, built on first use
+_SERVICES={}
 
 def make_post_text(values: pd.DataFrame):
     """
@@ -21,52 +40,67 @@ def make_post_text(values: pd.DataFrame):
     
     """
     postid, price, location, snippet, link, lat, long, date_posted=values[['index','price','locality','snippet','url','latitude','longitude', 'date_posted']]
+    # typed listings hold the price as a number and the posting date as a datetime
+    if isinstance(price, (int, float, np.integer, np.floating)) and pd.notnull(price):
+        price='${:,}'.format(int(price))
+    if isinstance(date_posted, datetime.datetime):
+        date_posted=date_posted.strftime('%Y-%m-%d')
     body='<tr><td><b>price:</b></td><td>%s</td></tr><tr><td><b>location:</b></td><td>%s</td></tr>\
     <tr><td><b>date posted:</b></td><td>%s</td></tr><tr><td><b>snippet:</b></td><td>%s...</td></tr>\
     <tr><td><b>link:</b></td><td>%s</td></tr>' % (price, location, date_posted, snippet, link)
     return(body)
 
-def get_and_resize_image(soup):
+def get_and_resize_image(page):
     """
     Function that finds address to main image of craiglist post, and formats the image
     
-    @param soup: a Beautiful soup object of a craigslist post
+    @param page: a Beautiful soup object or the raw HTML of a craigslist post
     @returns: a MIMEImage object of a 200 x 200 image PNG
     """
     # get primary image URL from post 
-    first_image=get_first(soup.findAll('img', {'title' : 1}))
-    image_url=first_image['src']
-
-    # get raw encoding of image, first comvert to PNG, then to MIMEImage
-    r = requests.get(image_url, stream = True)
-    if r.status_code == 200:
-        img=Image.open(io.BytesIO(r.content))
-        small=img.resize((200, 200))
-        # convert to PNG encoding
-        buf = io.BytesIO()
-        small.save(buf, format='PNG')
-        return(MIMEImage(buf.getvalue()))
+    if isinstance(page, (str, bytes)):
+        image_url=parse_post(page)['image_url']
+    else:
+        first_image=get_first(page.findAll('img', {'title' : 1}))
+        image_url=first_image['src']
+
+    # get a cached or freshly resized PNG thumbnail, then convert to MIMEImage
+    thumbnail=get_thumbnail(image_url)
+    if thumbnail is not None:
+        return(MIMEImage(thumbnail))
     
 def make_email_dict(df: pd.DataFrame, CL_dict: dict, api: str) -> dict:
     """
     A function that assembles a dict describing the content of the altert email. The dict has one record per
     listing. The key is the text desired for the email notification. The value is a list of images to attach.
-    Email altert should have 2 images, a google MAP showing the location and one thumbnail from the post
+    Email altert should have 2 images, a google MAP showing the location and one thumbnail from the post.
+    Images for all listings are fetched concurrently, and served from the media cache when possible
     
+    @param df: pd.DataFrame of listings to include in the alert
+    @param CL_dict: dict with URL as key and raw post HTML as value
+    @param api: google maps API key
     @returns: email_dict
     """
-    email_dict={}
+    listings=[]
     for row in df.iterrows():
-        postid=row[0]
         values=row[1]
-        url=values['url']
-        lat=values['latitude']
-        long=values['longitude']
-        
-        body=make_post_text(values)
-        img1=get_map(lat, long, api)
-        img2=get_and_resize_image(CL_dict[url])
-        email_dict[body] = [img1, img2]
+        listings.append((values['latitude'], values['longitude'], parse_post(CL_dict[values['url']])['image_url']))
+    media=fetch_listing_media(listings, api)
+    return(media_email_dict(df, dict(zip(df['index'].astype(str), media))))
+
+def media_email_dict(df: pd.DataFrame, media: dict) -> dict:
+    """
+    Version of make_email_dict() for listings whose images were fetched already, e.g. by the media stage of
+    the streaming pipeline
+
+    @param df: pd.DataFrame of listings to include in the alert
+    @param media: dict with posting ID as key and (map PNG bytes, thumbnail PNG bytes) as value
+    @returns: email_dict
+    """
+    email_dict={}
+    for i, row in df.iterrows():
+        body=make_post_text(row)
+        email_dict[body]=[MIMEImage(x) for x in media.get(str(row['index']), ()) if x is not None]
     return(email_dict)
 
 def make_html(email_dict: dict):
@@ -107,7 +141,7 @@ def add_images(message, email_dict: dict):
             start=start+1
     return(message)
 
-def create_email(sender: str, to: str, subject: str, email_dict: dict):
+def create_email(sender: str, to: str, subject: str, email_dict: dict, message_id: str=None):
     """
     Function that assembles a MIMEMultipart email message with inline images
     
@@ -115,6 +149,7 @@ def create_email(sender: str, to: str, subject: str, email_dict: dict):
     @param to: recipient 
     @param subject: title of email
     @param email_dict: output of make_email_dict, a dict with the email body text as a key, the images to attach as values
+    @param message_id: Message-ID header, optional, used to find out later whether the message was sent
     @returns: base64 encoding of the email message in a dict format for gmail API
     """
     # initiate message
@@ -122,6 +157,8 @@ def create_email(sender: str, to: str, subject: str, email_dict: dict):
     message['Subject'] = subject
     message['From'] = sender
     message['To'] = to
+    if message_id is not None:
+        message['Message-ID'] = message_id
     
     # create alternative part for inline images
     msgAlternative = MIMEMultipart('alternative')
@@ -135,6 +172,208 @@ def create_email(sender: str, to: str, subject: str, email_dict: dict):
     message=add_images(message, email_dict)
     return({'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()})
 
+def listing_size(body: str, image_list: list) -> int:
+    """
+    Function that estimates how many bytes one listing adds to an alert email
+
+    @param body: email body text of the listing, a key of email_dict
+    @param image_list: MIMEImage objects of the listing, a value of email_dict
+    @returns: number of bytes
+    """
+    return(len(body) + 150 + sum(len(x.get_payload()) + IMAGE_OVERHEAD for x in image_list))
+
+def split_digest(email_dict: dict, max_bytes: int=None) -> list:
+    """
+    Function that splits the listings of an alert into digests that each fit in one email. A listing larger
+    than the bound on its own gets a digest of its own
+
+    @param email_dict: output of make_email_dict
+    @param max_bytes: size bound of one message, defaults to EMAIL_CONFIG['max_bytes']
+    @returns: list of email_dicts, in listing order
+    """
+    max_bytes=max_bytes or EMAIL_CONFIG['max_bytes']
+    digests=[]
+    current, size={}, 0
+    for body, image_list in email_dict.items():
+        item=listing_size(body, image_list)
+        if current and size + item > max_bytes:
+            digests.append(current)
+            current, size={}, 0
+        current[body]=image_list
+        size+=item
+    if current:
+        digests.append(current)
+    return(digests)
+
+def new_message_id() -> str:
+    return('<%s@clscraper>' % (uuid.uuid4().hex))
+
+def digest_messages(sender: str, to: str, subject: str, email_dict: dict, max_bytes: int=None):
+    """
+    Generator of size-bounded alert messages. Each message is only built when the previous one has been
+    consumed, so a large alert never holds more than one serialized message in memory
+
+    @param sender: sender of email, needs to have gmail API set up
+    @param to: recipient
+    @param subject: title of email, numbered when the alert takes several messages
+    @param email_dict: output of make_email_dict
+    @param max_bytes: size bound of one message, defaults to EMAIL_CONFIG['max_bytes']
+    @returns: iterator of create_email() outputs
+    """
+    digests=split_digest(email_dict, max_bytes)
+    for i, digest in enumerate(digests):
+        title=subject if len(digests) == 1 else '%s (%s/%s)' % (subject, i + 1, len(digests))
+        yield(create_email(sender, to, title, digest))
+
+def get_gmail_service(creds: str):
+    """
+    Function that returns the authenticated Gmail API service for a credentials file, built once and reused
+
+    @param creds: gmail API credentials json filepath
+    @returns: googleapiclient Resource for the Gmail API
+    """
+    if creds not in _SERVICES:
+        cred=Credentials.from_authorized_user_file(creds)
+        _SERVICES[creds]=build('gmail', 'v1', credentials=cred, cache_discovery=False)
+    return(_SERVICES[creds])
+
+class GmailTransport:
+    """
+    Sends alert messages through the Gmail API, several messages per batch HTTP request
+    """
+    def __init__(self, creds: str):
+        self.creds=creds
+
+    def send_batch(self, messages: list) -> list:
+        """
+        @param messages: list of create_email() outputs
+        @returns: list of Gmail message IDs, None for messages that failed
+        """
+        service=get_gmail_service(self.creds)
+        ids=[None] * len(messages)
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logging.info('sending alert message %s failed: %s' % (request_id, exception))
+            else:
+                ids[int(request_id)]=response['id']
+        batch=service.new_batch_http_request(callback=callback)
+        for i, message in enumerate(messages):
+            batch.add(service.users().messages().send(userId='me', body=message), request_id=str(i))
+        batch.execute()
+        return(ids)
+
+    def was_sent(self, message_id: str) -> bool:
+        """
+        @param message_id: Message-ID header given to create_email()
+        @returns: True if a message with this Message-ID is in the sender's mailbox
+        """
+        service=get_gmail_service(self.creds)
+        found=service.users().messages().list(userId='me', q='rfc822msgid:%s' % (message_id.strip('<>'))).execute()
+        return(len(found.get('messages', [])) > 0)
+
+class LocalTransport:
+    """
+    Stand-in transport that writes every alert message as an .eml file to a directory instead of sending it
+    """
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path=path
+
+    def send_batch(self, messages: list) -> list:
+        """
+        @param messages: list of create_email() outputs
+        @returns: list of the file names written
+        """
+        ids=[]
+        for message in messages:
+            raw=base64.urlsafe_b64decode(message['raw'])
+            message_id=email.message_from_bytes(raw)['Message-ID']
+            if message_id is not None:
+                name=message_id.strip('<>') + '.eml'
+            else:
+                name='%s-%s.eml' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'), len(os.listdir(self.path)))
+            with open(os.path.join(self.path, name + '.tmp'), 'wb') as f:
+                f.write(raw)
+            os.replace(os.path.join(self.path, name + '.tmp'), os.path.join(self.path, name))
+            ids.append(name)
+        return(ids)
+
+    def was_sent(self, message_id: str) -> bool:
+        return(os.path.exists(os.path.join(self.path, message_id.strip('<>') + '.eml')))
+
+def send_messages(transport, messages) -> list:
+    """
+    Function that sends alert messages in batches of EMAIL_CONFIG['batch'], consuming messages lazily
+
+    @param transport: GmailTransport or LocalTransport
+    @param messages: iterable of create_email() outputs, e.g. digest_messages()
+    @returns: list of message IDs, None for messages that failed
+    """
+    ids=[]
+    batch=[]
+    for message in messages:
+        batch.append(message)
+        if len(batch) >= EMAIL_CONFIG['batch']:
+            ids+=transport.send_batch(batch)
+            batch=[]
+    if batch:
+        ids+=transport.send_batch(batch)
+    print('Message Ids: %s' % (', '.join(str(x) for x in ids)))
+    return(ids)
+
+def send_alerts(transport, sender: str, to: str, subject: str, email_dict: dict, posting_ids: dict, journal) -> list:
+    """
+    Function that sends the digests of an alert through a run journal, so every listing is emailed exactly
+    once even when the run crashes and is resumed. Each digest is recorded as 'sending' with a unique
+    Message-ID before it is handed to the transport, and as 'sent' once the transport confirms it. On
+    resume, check_unconfirmed() asks the transport about digests left in between
+
+    @param transport: GmailTransport or LocalTransport
+    @param sender: sender of email, needs to have gmail API set up
+    @param to: recipient
+    @param subject: title of email
+    @param email_dict: output of make_email_dict
+    @param posting_ids: dict with the email body text as key and the posting ID of its listing as value
+    @param journal: RunJournal of the run
+    @returns: list of message IDs
+    """
+    digests=split_digest(email_dict)
+    ids=[]
+    for start in range(0, len(digests), EMAIL_CONFIG['batch']):
+        batch=[]
+        for i, digest in enumerate(digests[start:start + EMAIL_CONFIG['batch']], start):
+            title=subject if len(digests) == 1 else '%s (%s/%s)' % (subject, i + 1, len(digests))
+            message_id=new_message_id()
+            journal.sending(message_id, [posting_ids[body] for body in digest])
+            batch.append((message_id, create_email(sender, to, title, digest, message_id)))
+        sent=transport.send_batch([message for message_id, message in batch])
+        for (message_id, message), result in zip(batch, sent):
+            if result is None:
+                journal.forget(message_id)
+            else:
+                journal.sent(message_id)
+        ids+=sent
+    print('Message Ids: %s' % (', '.join(str(x) for x in ids)))
+    if None in ids:
+        raise RuntimeError('%s alert emails could not be sent' % (ids.count(None)))
+    return(ids)
+
+def check_unconfirmed(transport, journal) -> None:
+    """
+    Function that settles the digests a crashed run handed to the transport without a confirmation: those
+    that reached the mailbox are marked sent, the others are forgotten so their listings are sent again
+
+    @param transport: GmailTransport or LocalTransport
+    @param journal: RunJournal of the run
+    @returns: None
+    """
+    for message_id, posting_ids in journal.unconfirmed():
+        if transport.was_sent(message_id):
+            journal.sent(message_id)
+        else:
+            logging.info('alert %s for %s listings was not sent, sending again' % (message_id, len(posting_ids)))
+            journal.forget(message_id)
+
 def send_message(creds: str, message: dict):
     """
     Function that sends message via gmail API
@@ -143,8 +382,45 @@ def send_message(creds: str, message: dict):
     @param message: output of create_email, a dict containing base64 encoded MIME message
     @returns: None, prints confirmation to screen
     """
-    cred = Credentials.from_authorized_user_file(creds)
-    SCOPES = ['https://www.googleapis.com/auth/gmail.send']                                         
-    service = build('gmail', 'v1', credentials=cred)
+    service = get_gmail_service(creds)
     message = (service.users().messages().send(userId='me', body=message).execute())
     print('Message Id: %s' % message['id'])
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(prog='CLscraper email', description='send an alert email for listings already in the database')
+    parser.add_argument('base_path', type=str, nargs=1, help='base output path for files')
+    parser.add_argument('api', type=str, nargs=1, help='path to file with Google maps API key')
+    parser.add_argument('mailto', type=str, nargs=1, help='email address to send alters to')
+    parser.add_argument('gmail_creds', type=str, nargs=1, help='path to Gmail token json file')
+    parser.add_argument('--ids', type=str, nargs='+', default=None, help='posting IDs to include')
+    parser.add_argument('--zipcode', type=str, nargs='+', default=None, help='zipcodes to include')
+    parser.add_argument('--since', type=str, default=None, help='only listings posted on or after this date, YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, default=20, help='maximum number of listings, newest first')
+    parser.add_argument('--subject', type=str, default='Housing Email Alert', help='title of the email')
+    parser.add_argument('--max-email-bytes', type=int, default=EMAIL_CONFIG['max_bytes'], help='size bound of one alert email, larger alerts are split into digests')
+    parser.add_argument('--email-dir', type=str, default=None, help='write alert emails as .eml files to this directory instead of sending them')
+    arguments=parser.parse_args(argv)
+    EMAIL_CONFIG['max_bytes']=arguments.max_email_bytes
+    with open(arguments.api[0], 'r') as file:
+        api_key=file.read().rstrip()
+    log_path, database_path, file_path, cache_path, media_path=create_paths(arguments.base_path[0])
+    configure_cache(path=cache_path)
+    configure_media(path=media_path)
+
+    DB=open_store(os.path.join(database_path, 'CL_database.sqlite'))
+    columns, rows=find_listings(DB, arguments.ids, arguments.zipcode, arguments.since, limit=arguments.limit)
+    DB.close()
+    df=pd.DataFrame(rows, columns=columns)
+    # post pages come from the response cache when they are still in it
+    CL_dict=fetch_pages(list(df['url']))
+    missing=~df['url'].isin(list(CL_dict))
+    if missing.any():
+        print('%s listings skipped, their post could not be fetched' % (missing.sum()))
+    df=df[~missing]
+    if len(df) == 0:
+        print('no listings to send')
+        return()
+    email_dict=make_email_dict(df, CL_dict, api_key)
+    transport=GmailTransport(arguments.gmail_creds[0]) if arguments.email_dir is None else LocalTransport(arguments.email_dir)
+    send_messages(transport, digest_messages('me', arguments.mailto[0], arguments.subject, email_dict))
+    return()
@@ -0,0 +1,389 @@
+import bs4
+import logging
+import os
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from CLscraper.geocache import coord_key, reverse_lookup_batch
+from CLscraper.lib import *
+from CLscraper.metrics import stage
+
+# elements that never have children, they are closed as soon as they are opened (matches bs4)
+VOID_ELEMENTS=frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                         'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+                         'image', 'isindex', 'nextid', 'spacer'])
+# elements whose strings bs4 leaves out of .text
+HIDDEN_ELEMENTS=frozenset(['script', 'style', 'template'])
+# elements inside which bs4 keeps whitespace-only strings as they are
+PRESERVE_WHITESPACE_ELEMENTS=frozenset(['pre', 'textarea'])
+# characters bs4 counts as whitespace when collapsing strings
+ASCII_SPACES='\x20\x0a\x09\x0c\x0d'
+# span classes whose first occurrence is captured, mapped to the metric name
+SPAN_FIELDS={'price' : 'price', 'housing_movein_now' : 'available', 'shared-line-bubble' : 'size'}
+
+class Element:
+    """
+    An open element on the parser stack. Text is not copied into every open element, instead the
+    element keeps start/end indexes into the parser's list of text chunks and joins them on demand
+    """
+    __slots__=('tag', 'start', 'end', 'fields', 'last_child', 'prev_sibling')
+
+    def __init__(self, tag: str, start: int, prev_sibling):
+        self.tag=tag
+        self.start=start
+        self.end=start
+        self.fields=[]
+        self.last_child=None
+        self.prev_sibling=prev_sibling
+
+class PostParser(HTMLParser):
+    """
+    Streaming tokenizer that collects every field needed by make_output() in a single pass over a
+    craigslist post, following the same rules as the BeautifulSoup based functions in lib.py
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks=[]
+        self.hidden=0
+        self.preserve=0
+        self.stack=[Element(None, 0, None)]
+        self.values={'title' : None, 'price' : None, 'available' : None, 'size' : None, 'body' : None}
+        self.started=set()
+        self.images=0
+        self.postinginfo=[]
+        self.coords=None
+        self.sqft=None
+        self.dog_span=False
+        self.image_url=None
+
+    def text(self, element: Element) -> str:
+        return(''.join(self.chunks[element.start:element.end]))
+
+    def capture(self, element: Element, field: str) -> None:
+        # only the first element matching a field is captured, like get_first(soup.findAll(...))
+        if field not in self.started:
+            self.started.add(field)
+            element.fields.append(field)
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs={key : ('' if value is None else value) for key, value in attrs}
+        parent=self.stack[-1]
+        element=Element(tag, len(self.chunks), parent.last_child)
+        classes=attrs.get('class', '').split()
+        if tag == 'span':
+            for c in classes:
+                if c in SPAN_FIELDS:
+                    self.capture(element, SPAN_FIELDS[c])
+            if not self.dog_span:
+                element.fields.append('dog')
+        elif tag == 'a' and 'thumb' in classes:
+            self.images+=1
+        elif tag == 'p' and 'postinginfo' in classes:
+            element.fields.append('postinginfo')
+        elif tag == 'div' and 'viewposting' in classes and self.coords is None:
+            if 'data-latitude' in attrs and 'data-longitude' in attrs:
+                self.coords=(attrs['data-latitude'], attrs['data-longitude'])
+            else:
+                self.coords=(None, None)
+        elif tag == 'section' and attrs.get('id') == 'postingbody':
+            self.capture(element, 'body')
+        elif tag == 'title':
+            self.capture(element, 'title')
+        elif tag == 'img' and attrs.get('title') == '1' and self.image_url is None:
+            self.image_url=attrs.get('src')
+        if tag in VOID_ELEMENTS:
+            parent.last_child=element
+            return
+        if tag in HIDDEN_ELEMENTS:
+            self.hidden+=1
+        if tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve+=1
+        self.stack.append(element)
+
+    def handle_endtag(self, tag: str) -> None:
+        # like bs4, close every element up to the most recent open one with this name, or ignore the tag
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                while len(self.stack) > i:
+                    self.close_element(self.stack.pop())
+                return
+
+    def handle_data(self, data: str) -> None:
+        if self.hidden:
+            return
+        # like bs4, a whitespace-only string between tags collapses to one newline or space
+        if not self.preserve and not data.strip(ASCII_SPACES):
+            data='\n' if '\n' in data else ' '
+        self.chunks.append(data)
+
+    def close_element(self, element: Element) -> None:
+        element.end=len(self.chunks)
+        self.stack[-1].last_child=element
+        if element.tag in HIDDEN_ELEMENTS:
+            self.hidden-=1
+        if element.tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve-=1
+        if element.tag == 'sup' and element.prev_sibling is not None and self.text(element) == '2':
+            self.sqft=self.text(element.prev_sibling)
+        for field in element.fields:
+            text=self.text(element)
+            if field == 'postinginfo':
+                self.postinginfo.append(text)
+            elif field == 'dog':
+                self.dog_span=self.dog_span or 'dog' in text
+            else:
+                self.values[field]=text.strip()
+
+    def finish(self) -> None:
+        """
+        Flush the tokenizer and close any elements left open at the end of the document
+        """
+        self.close()
+        while len(self.stack) > 1:
+            self.close_element(self.stack.pop())
+
+def parse_post(html: str) -> dict:
+    """
+    Function that parses a craigslist post in one pass and returns the raw fields
+
+    @param html: HTML of a craigslist posting
+    @returns: dict with title, price, available, size, body, images, scam, postinginfo, coords, sqft (from the
+    superscript tag), dog_span (a span mentions dogs) and image_url (first post image)
+    """
+    if isinstance(html, bytes):
+        html=html.decode('utf-8', errors='replace')
+    parser=PostParser()
+    parser.feed(html)
+    parser.finish()
+    fields=dict(parser.values)
+    fields['images']=parser.images
+    fields['scam']=bool(SCAM_PATTERN.search(''.join(parser.chunks).lower()))
+    fields['postinginfo']=parser.postinginfo
+    fields['coords']=parser.coords or (None, None)
+    fields['sqft']=parser.sqft
+    fields['dog_span']=parser.dog_span
+    fields['image_url']=parser.image_url
+    return(fields)
+
+def posting_info_from_text(post_info: list) -> tuple:
+    """
+    Function that extracts out post ID and posting time, see parse_posting_info()
+
+    @param post_info: list of the text of each postinginfo paragraph
+    @returns: a tuple with posting ID, posting date, posting update date
+    """
+    post_id, posted, updated=(None, None, None)
+    for text in post_info:
+        if 'post id' in text:
+            post_id=text.split(":")[1].strip()
+        elif 'posted' in text:
+            posted=text.split(":")[1].strip().split(" ")[0]
+        elif 'updated' in text:
+            updated=text.split(":")[1].strip().split(" ")[0]
+    return(post_id, posted, updated)
+
+def metrics_from_fields(fields: dict) -> list:
+    """
+    Function that builds the metrics_from_soup() list from the output of parse_post()
+
+    @param fields: output of parse_post()
+    @returns: a list of metrics
+    """
+    posting_id, posted, updated=posting_info_from_text(fields['postinginfo'])
+    lat, long=fields['coords']
+    if lat is None or long is None:
+        lat, long=(None, None)
+    emoji=count_emoji(fields['title'])
+    return([lat, long, posting_id, posted, updated, fields['price'], fields['available'], fields['size'],
+            fields['images'], emoji, fields['scam']])
+
+def text_from_fields(fields: dict) -> str:
+    """
+    Function that returns the post body text, see get_posting_text()
+
+    @param fields: output of parse_post()
+    @returns: string of post body text
+    """
+    if not fields['body']:
+        print("no text in posting")
+        raise ValueError
+    return(fields['body'].replace('QR Code Link to This Post' , '').replace('\n' , ''))
+
+def parse_listing(html: str, url: str, file_path: str) -> dict:
+    """
+    Function that runs the CPU bound part of extract_html(): parsing, text metrics, and writing the post text
+
+    @param html: HTML (str or bytes) of a craigslist posting
+    @param url: URL for craigslist post
+    @param file_path: directory to write body txt files, None to leave the text to the caller (see PostArchive)
+    @returns: dict with the make_output() arguments except address, the post text and the main image URL
+    """
+    fields=parse_post(html)
+    soup_metrics=metrics_from_fields(fields)
+    posttext=text_from_fields(fields)
+    if file_path is not None:
+        with open(os.path.join(file_path, soup_metrics[2] + '.txt'), "w") as file:
+            file.write(posttext)
+    return({'soup_metrics' : soup_metrics,
+            'text' : posttext,
+            'dog' : 'yes' if fields['dog_span'] else dog_from_text(posttext),
+            'sqft' : fields['sqft'] if fields['sqft'] is not None else sqft_from_text(posttext),
+            'text_metrics' : metrics_from_text(posttext),
+            'snippet' : posttext[0:100],
+            'image_url' : fields['image_url'],
+            'url' : url})
+
+def build_record(listing: dict, address: list) -> ListingRecord:
+    """
+    Function that creates the output record of a parsed listing
+
+    @param listing: output of parse_listing()
+    @param address: output of reverse_lookup()
+    @returns: ListingRecord
+    """
+    record=make_record(listing['soup_metrics'], listing['dog'], listing['sqft'], listing['text_metrics'], address,
+                       listing['snippet'], listing['url'])
+    record.image_url=listing.get('image_url')
+    return(record)
+
+def build_listing(listing: dict, address: list) -> pd.DataFrame:
+    """
+    Function that creates the output row of a parsed listing
+
+    @param listing: output of parse_listing()
+    @param address: output of reverse_lookup()
+    @returns: DataFrame with metrics
+    """
+    return(listings_frame([build_record(listing, address)]))
+
+def extract_html(html: str, url: str, file_path: str, api_key: str) -> pd.DataFrame:
+    """
+    Single pass replacement for extract_soup() that works on the raw HTML of a post
+
+    @param html: HTML of a craigslist posting
+    @param url: URL for craigslist post
+    @param file_path: directory to write body txt files
+    @param api_key: Google maps API key, if None the reverse address lookup is skipped
+    @returns: DataFrame with metrics
+    """
+    listing=parse_listing(html, url, file_path)
+    if api_key is None:
+        address=[None, None, None, None]
+    else:
+        address=reverse_lookup(api_key, listing['soup_metrics'][0], listing['soup_metrics'][1])
+    return(build_listing(listing, address))
+
+def parse_worker(task: tuple) -> tuple:
+    """
+    Process pool worker around parse_listing(), exceptions are caught so one bad listing never
+    takes down the pool
+
+    @param task: tuple of (url, HTML bytes, file_path)
+    @returns: tuple of (url, output of parse_listing() or None, error message or None)
+    """
+    url, html, file_path=task
+    try:
+        return((url, parse_listing(html, url, file_path), None))
+    except Exception as e:
+        return((url, None, repr(e)))
+
+def parse_pages(pages: dict, text_store, api_key: str, workers: int=None, reposts=None,
+                skip_repost_geocode: bool=False, replace_text: bool=False) -> tuple:
+    """
+    Function that parses posts in parallel over a process pool, then geocodes them in this process
+
+    @param pages: dict with URL as key and post HTML as value, output of fetch_pages()
+    @param text_store: a PostArchive for the post bodies, or a directory to write one body txt file per post
+    @param api_key: Google maps API key, if None the reverse address lookup is skipped
+    @param workers: number of worker processes, defaults to the CPU count, 1 parses in this process
+    @param reposts: RepostIndex to check the posts against, optional, see collect_listings()
+    @param skip_repost_geocode: do not geocode posts found to be reposts
+    @param replace_text: archive the bodies of posts already in the PostArchive again, e.g. after an edit
+    @returns: tuple of (list of ListingRecord, number of failed listings), see records.listings_frame()
+    """
+    workers=workers or os.cpu_count() or 1
+    file_path=text_store if isinstance(text_store, str) else None
+    archive=None if isinstance(text_store, str) else text_store
+    tasks=[(url, html.encode('utf-8') if isinstance(html, str) else html, file_path) for url, html in pages.items()]
+    if workers == 1 or len(tasks) < 2:
+        return(collect_listings(map(parse_worker, tasks), api_key, archive, reposts, skip_repost_geocode, replace_text))
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        results=pool.map(parse_worker, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        return(collect_listings(results, api_key, archive, reposts, skip_repost_geocode, replace_text))
+
+def collect_listings(results, api_key: str, archive=None, reposts=None, skip_repost_geocode: bool=False,
+                     replace_text: bool=False) -> tuple:
+    """
+    Function that geocodes parse_worker() results as one deduplicated, cached batch and creates their output records.
+    With a RepostIndex, every record gets a field 'repost_of' holding the posting ID of the earlier post it is a
+    near-duplicate of, or None
+
+    @param results: iterable of parse_worker() outputs
+    @param api_key: Google maps API key, if None the reverse address lookup is skipped
+    @param archive: PostArchive the post bodies are appended to, optional
+    @param reposts: RepostIndex the posts are checked against and added to, optional
+    @param skip_repost_geocode: do not geocode posts found to be reposts, their address columns stay empty
+    @param replace_text: archive the bodies of posts already in the archive again
+    @returns: tuple of (list of ListingRecord, number of failed listings)
+    """
+    parsed=[]
+    fails=0
+    for url, listing, error in results:
+        if error is None:
+            parsed.append(listing)
+        else:
+            logging.info("Listing ID %s failed" % (url))
+            fails+=1
+    if archive is not None:
+        archive.append_many({x['soup_metrics'][2] : x['text'] for x in parsed}, replace=replace_text)
+    repost_of={}
+    if reposts is not None:
+        with stage('reposts'):
+            repost_of=reposts.check_many([(x['soup_metrics'][2], x['text'], x['soup_metrics'][0], x['soup_metrics'][1])
+                                          for x in parsed if x['soup_metrics'][2] is not None])
+        logging.info('%s reposts found' % (sum(x is not None for x in repost_of.values())))
+    def original(listing):
+        posting_id=listing['soup_metrics'][2]
+        return(None if posting_id is None else repost_of.get(int(posting_id)))
+    if api_key is not None:
+        with stage('geocode'):
+            addresses=reverse_lookup_batch(api_key, [tuple(x['soup_metrics'][0:2]) for x in parsed
+                                                     if not (skip_repost_geocode and original(x) is not None)])
+    outlist=[]
+    for listing in parsed:
+        try:
+            if api_key is None or (skip_repost_geocode and original(listing) is not None):
+                address=[None, None, None, None]
+            else:
+                address=addresses[coord_key(*listing['soup_metrics'][0:2])]
+            record=build_record(listing, address)
+            if reposts is not None:
+                record.repost_of=original(listing)
+            outlist.append(record)
+        except Exception:
+            logging.info("Listing ID %s failed" % (listing['url']))
+            fails+=1
+    return(outlist, fails)
+
+def check_parity(html: str, url: str, file_path: str) -> list:
+    """
+    Function that runs extract_html() and the BeautifulSoup based extract_soup() on the same page
+    (without geocoding) and lists every column where the two disagree
+
+    @param html: HTML of a craigslist posting
+    @param url: URL for craigslist post
+    @param file_path: directory to write body txt files
+    @returns: list of (column, extract_soup value, extract_html value) tuples, empty when identical
+    """
+    expected=extract_soup(bs4.BeautifulSoup(html, 'html.parser'), url, file_path, None)
+    result=extract_html(html, url, file_path, None)
+    diffs=[]
+    for column in expected.columns:
+        a=expected[column].iloc[0]
+        b=result[column].iloc[0]
+        if not (a == b or (pd.isnull(a) and pd.isnull(b))):
+            diffs.append((column, a, b))
+    if list(expected.columns) != list(result.columns) or list(expected.index) != list(result.index):
+        diffs.append(('index', list(expected.index), list(result.index)))
+    return(diffs)
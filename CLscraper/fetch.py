@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import time
+import urllib.parse
+
+import requests
+
+from CLscraper.cache import *
+from CLscraper.metrics import count
+from CLscraper.session import http_get
+
+# default fetch settings, overridden from the command line with configure_fetch()
+FETCH_CONFIG={'concurrency' : 4,
+              'host_concurrency' : 4,
+              'rate' : 1.0,
+              'burst' : 2,
+              'min_rate' : 0.05,
+              'retries' : 4}
+
+# status codes craigslist uses to tell us to slow down
+BACKOFF_STATUS=(403, 429)
+
+# one token bucket per host, kept for the whole run so search and post scraping share a budget
+_BUCKETS={}
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for a single host with adaptive backoff
+
+    rate is the current number of requests per second allowed. It is halved every time the host
+    answers with a 403/429 and creeps back up towards the configured ceiling after each success.
+    """
+    def __init__(self, rate: float, burst: int, min_rate: float):
+        self.max_rate=rate
+        self.rate=rate
+        self.min_rate=min_rate
+        self.burst=burst
+        self.tokens=float(burst)
+        self.last=time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens=min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last=now
+
+    async def acquire(self) -> None:
+        """
+        Reserve one token, sleeping until it is available. Tokens are reserved before sleeping
+        (the balance can go negative) so concurrent tasks on the same loop queue up fairly.
+        """
+        self._refill(time.monotonic())
+        self.tokens-=1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def penalize(self) -> float:
+        """
+        Halve the request rate after a 403/429, returns the number of seconds to back off
+        """
+        self.rate=max(self.min_rate, self.rate / 2)
+        self.tokens=min(self.tokens, 0)
+        return(1 / self.rate)
+
+    def reward(self) -> None:
+        """
+        Additively increase the request rate after a successful response
+        """
+        self.rate=min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+def configure_fetch(**kwargs) -> None:
+    """
+    Function that updates the fetch engine settings, and resets per-host rate limits
+
+    @param kwargs: any of concurrency, host_concurrency, rate, burst, min_rate, retries
+    @returns: None
+    """
+    for key, value in kwargs.items():
+        if key not in FETCH_CONFIG:
+            raise KeyError('unknown fetch setting %s' % (key))
+        if value is not None:
+            FETCH_CONFIG[key]=value
+    _BUCKETS.clear()
+
+def get_bucket(url: str) -> TokenBucket:
+    """
+    Function that returns the token bucket for the host of a URL, creating it if needed
+
+    @param url: URL to be fetched
+    @returns: TokenBucket shared by all requests to that host
+    """
+    host=urllib.parse.urlsplit(url).netloc
+    if host not in _BUCKETS:
+        _BUCKETS[host]=TokenBucket(FETCH_CONFIG['rate'], FETCH_CONFIG['burst'], FETCH_CONFIG['min_rate'])
+    return(_BUCKETS[host])
+
+def host_semaphore(url: str, host_semaphores: dict) -> asyncio.Semaphore:
+    """
+    Function that returns the semaphore capping requests in flight to the host of a URL, creating it if needed
+
+    @param url: URL to be fetched
+    @param host_semaphores: dict with host as key and asyncio.Semaphore as value, one per fetch_all() call
+    @returns: asyncio.Semaphore
+    """
+    host=urllib.parse.urlsplit(url).netloc
+    if host not in host_semaphores:
+        host_semaphores[host]=asyncio.Semaphore(FETCH_CONFIG['host_concurrency'])
+    return(host_semaphores[host])
+
+def retry_after(response) -> float:
+    """
+    Function that reads the Retry-After header (in seconds) of a response if present
+
+    @param response: requests.Response object
+    @returns: number of seconds or None
+    """
+    try:
+        return(float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return(None)
+
+async def request_with_backoff(url: str, semaphore: asyncio.Semaphore, headers: dict, host_semaphores: dict=None):
+    """
+    Function that requests a single URL under the host rate limit, the per-host and the global concurrency
+    caps, retrying with a reduced rate when the host answers 403/429
+
+    @param url: URL to fetch
+    @param semaphore: semaphore limiting the number of requests in flight
+    @param headers: extra request headers
+    @param host_semaphores: dict of per-host semaphores shared by the fetch_all() call, see host_semaphore()
+    @returns: requests.Response object, or None if the request could not be made
+    """
+    bucket=get_bucket(url)
+    host_limit=host_semaphore(url, {} if host_semaphores is None else host_semaphores)
+    response=None
+    for attempt in range(FETCH_CONFIG['retries'] + 1):
+        await bucket.acquire()
+        async with host_limit, semaphore:
+            try:
+                response=await asyncio.to_thread(http_get, url, headers=headers)
+            except requests.RequestException as e:
+                logging.info('request for %s failed: %s' % (url, e))
+                count('fetch_failed')
+                return(None)
+        if response.status_code in BACKOFF_STATUS:
+            count('fetch_backoff')
+            delay=bucket.penalize()
+            wait=retry_after(response) or delay
+            logging.info('%s returned %s, backing off %.1f seconds' % (url, response.status_code, wait))
+            await asyncio.sleep(wait)
+            continue
+        bucket.reward()
+        break
+    return(response)
+
+async def fetch_one(url: str, semaphore: asyncio.Semaphore, host_semaphores: dict=None, revalidate: bool=False) -> str:
+    """
+    Function that returns the HTML of a single URL, from the response cache when it is fresh (or
+    always in replay mode), otherwise from the network with ETag/Last-Modified revalidation
+
+    @param url: URL to fetch
+    @param semaphore: semaphore limiting the number of requests in flight
+    @param host_semaphores: dict of per-host semaphores, see host_semaphore()
+    @param revalidate: revalidate a cached page with the server even when it is still fresh
+    @returns: page HTML, or None if the page could not be fetched
+    """
+    entry=read_cache(url)
+    if entry is not None and (CACHE_CONFIG['replay'] or (is_fresh(url, entry) and not revalidate)):
+        text=cached_text(url)
+        if text is not None:
+            count('fetch_cache_hit')
+            return(text)
+    if CACHE_CONFIG['replay']:
+        logging.info('%s not in cache, skipped in replay mode' % (url))
+        return(None)
+    count('fetch_cache_miss')
+    response=await request_with_backoff(url, semaphore, conditional_headers(entry), host_semaphores)
+    if response is None:
+        return(None)
+    if response.status_code == 304 and entry is not None:
+        text=cached_text(url)
+        if text is not None:
+            touch_cache(url, entry)
+            count('fetch_cache_revalidated')
+            return(text)
+        response=await request_with_backoff(url, semaphore, {}, host_semaphores)
+        if response is None:
+            return(None)
+    # error pages, and throttled answers once the retries are used up, are never handed on as content
+    if response.status_code != 200:
+        logging.info('%s returned %s, not fetched' % (url, response.status_code))
+        count('fetch_failed')
+        return(None)
+    write_cache(url, response)
+    return(response.text)
+
+async def fetch_all(url_list: list, on_page=None, revalidate: bool=False) -> dict:
+    """
+    Function that fetches a list of URLs concurrently
+
+    @param url_list: list of URLs to fetch
+    @param on_page: function called with (url, page HTML) as soon as each page arrives, optional
+    @param revalidate: revalidate cached pages with the server even when they are still fresh
+    @returns: a dictionary with URL as key and page HTML as value, in url_list order, failed requests are dropped
+    """
+    semaphore=asyncio.Semaphore(FETCH_CONFIG['concurrency'])
+    host_semaphores={}
+    async def fetch_tagged(url):
+        return((url, await fetch_one(url, semaphore, host_semaphores, revalidate)))
+    urls=list(dict.fromkeys(url_list))
+    results={}
+    for future in asyncio.as_completed([fetch_tagged(url) for url in urls]):
+        url, text=await future
+        results[url]=text
+        if len(results) % 10 == 0:
+            print("%s listings completed / %s total" % (len(results), len(urls)))
+        if text is not None and on_page is not None:
+            on_page(url, text)
+    return({url : results[url] for url in urls if results[url] is not None})
+
+async def fetch_each(url_list: list, on_page, revalidate: bool=False) -> int:
+    """
+    Function that fetches a list of URLs concurrently and hands every page to on_page as soon as it arrives,
+    without keeping it. on_page runs in a worker thread and may block, the fetch worker waiting on it starts
+    no new request, so a slow consumer holds back the fetching instead of pages piling up in memory
+
+    @param url_list: list of URLs to fetch
+    @param on_page: function called with (url, page HTML) for every page fetched
+    @param revalidate: revalidate cached pages with the server even when they are still fresh
+    @returns: number of pages fetched, failed requests are dropped
+    """
+    semaphore=asyncio.Semaphore(FETCH_CONFIG['concurrency'])
+    host_semaphores={}
+    urls=list(dict.fromkeys(url_list))
+    pending=iter(urls)
+    completed, fetched=([0], [0])
+    async def worker():
+        for url in pending:
+            text=await fetch_one(url, semaphore, host_semaphores, revalidate)
+            completed[0]+=1
+            if completed[0] % 10 == 0:
+                print("%s listings completed / %s total" % (completed[0], len(urls)))
+            if text is not None:
+                fetched[0]+=1
+                await asyncio.to_thread(on_page, url, text)
+    await asyncio.gather(*[worker() for i in range(min(FETCH_CONFIG['concurrency'], len(urls)))])
+    return(fetched[0])
+
+def stream_pages(url_list: list, on_page, revalidate: bool=False) -> int:
+    """
+    Function that fetches a list of URLs with the asyncio fetch engine, passing each page on as it arrives
+
+    @param url_list: list of URLs to fetch
+    @param on_page: function called with (url, page HTML) for every page fetched, see fetch_each()
+    @param revalidate: revalidate cached pages with the server even when they are still fresh
+    @returns: number of pages fetched
+    """
+    return(asyncio.run(fetch_each(url_list, on_page, revalidate)))
+
+def fetch_pages(url_list: list, on_page=None, revalidate: bool=False) -> dict:
+    """
+    Function that fetches a list of URLs with the asyncio fetch engine and returns the raw page text
+
+    @param url_list: list of URLs to fetch
+    @param on_page: function called with (url, page HTML) as soon as each page arrives, optional
+    @param revalidate: revalidate cached pages with the server even when they are still fresh
+    @returns: a dictionary with URL as key and page HTML as value
+    """
+    return(asyncio.run(fetch_all(url_list, on_page, revalidate)))
@@ -0,0 +1,134 @@
+import json
+import logging
+import sqlite3
+import time
+
+from CLscraper.maps import reverse_lookup
+
+# geocode cache settings, the cache is disabled until configure_geocode() is given a path
+GEOCODE_CONFIG={'path' : None,
+                'precision' : 4,
+                'ttl' : 60 * 60 * 24 * 90}
+
+# running totals for this run, logged after every batch
+GEOCODE_STATS={'hits' : 0, 'misses' : 0, 'deduped' : 0}
+
+_CONNECTION=None
+
+def configure_geocode(**kwargs) -> None:
+    """
+    Function that updates the geocode cache settings
+
+    @param kwargs: any of path, precision (decimal places coordinates are rounded to), ttl (seconds)
+    @returns: None
+    """
+    global _CONNECTION
+    for key, value in kwargs.items():
+        if key not in GEOCODE_CONFIG:
+            raise KeyError('unknown geocode setting %s' % (key))
+        if value is not None:
+            GEOCODE_CONFIG[key]=value
+    if _CONNECTION is not None:
+        _CONNECTION.close()
+        _CONNECTION=None
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Function that opens the geocode cache database, creating the table if needed
+
+    @returns: sqlite3.Connection, or None if the cache is disabled
+    """
+    global _CONNECTION
+    if _CONNECTION is None and GEOCODE_CONFIG['path'] is not None:
+        # used by one thread at a time, but not always the one that opened it (see pipeline.stream_listings())
+        _CONNECTION=sqlite3.connect(GEOCODE_CONFIG['path'], check_same_thread=False)
+        _CONNECTION.execute('CREATE TABLE IF NOT EXISTS geocode (coords TEXT PRIMARY KEY, address TEXT, fetched REAL)')
+    return(_CONNECTION)
+
+def coord_key(lat: str, long: str) -> str:
+    """
+    Function that buckets a coordinate pair by rounding it to the configured precision
+
+    @param lat: latitude
+    @param long: longitude
+    @returns: a string key such as '45.5231,-122.6765', or None if the coordinates are missing
+    """
+    try:
+        lat, long=(float(lat), float(long))
+    except (TypeError, ValueError):
+        return(None)
+    precision=GEOCODE_CONFIG['precision']
+    return('%.*f,%.*f' % (precision, lat, precision, long))
+
+def read_geocode(keys: list) -> dict:
+    """
+    Function that looks up coordinate keys in the cache, ignoring entries older than the TTL
+
+    @param keys: list of outputs of coord_key()
+    @returns: dict with coordinate key as key and parse_address() output as value
+    """
+    connection=get_connection()
+    if connection is None or len(keys) == 0:
+        return({})
+    found={}
+    oldest=time.time() - GEOCODE_CONFIG['ttl']
+    # sqlite limits the number of bound parameters, so query in chunks
+    for i in range(0, len(keys), 500):
+        chunk=keys[i:i + 500]
+        rows=connection.execute('SELECT coords, address FROM geocode WHERE fetched > ? AND coords IN (%s)'
+                                % (','.join('?' * len(chunk))), [oldest] + chunk)
+        for coords, address in rows:
+            found[coords]=json.loads(address)
+    return(found)
+
+def write_geocode(results: dict) -> None:
+    """
+    Function that stores new geocode results in the cache
+
+    @param results: dict with coordinate key as key and parse_address() output as value
+    @returns: None
+    """
+    connection=get_connection()
+    if connection is None or len(results) == 0:
+        return
+    now=time.time()
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)',
+                               [(coords, json.dumps(address), now) for coords, address in results.items()])
+
+def reverse_lookup_batch(key: str, coords: list) -> dict:
+    """
+    Function that reverse geocodes a batch of coordinates. Coordinates are bucketed and deduplicated
+    before anything is sent to the Google API, and answers are served from the cache when possible
+
+    @param key: Google maps API key
+    @param coords: list of (latitude, longitude) tuples
+    @returns: dict with coordinate key (see coord_key()) as key and parse_address() output as value,
+    coordinates that could not be geocoded are left out
+    """
+    keys={}
+    located=0
+    for lat, long in coords:
+        bucket=coord_key(lat, long)
+        if bucket is not None:
+            keys.setdefault(bucket, (lat, long))
+            located+=1
+    found=read_geocode(list(keys))
+    hits=len(found)
+    fetched={}
+    for bucket, (lat, long) in keys.items():
+        if bucket in found:
+            continue
+        try:
+            fetched[bucket]=reverse_lookup(key, lat, long)
+        except Exception:
+            logging.info('reverse lookup for %s failed' % (bucket))
+    write_geocode(fetched)
+    found.update(fetched)
+
+    GEOCODE_STATS['hits']+=hits
+    GEOCODE_STATS['misses']+=len(keys) - hits
+    GEOCODE_STATS['deduped']+=located - len(keys)
+    logging.info('geocode batch of %s listings: %s unique locations, %s cache hits, %s API calls'
+                 % (len(coords), len(keys), hits, len(keys) - hits))
+    return(found)
@@ -0,0 +1,145 @@
+import logging
+import math
+import re
+
+# side of one grid cell in degrees, about 1.1 km north-south. Cells are numbered row by row from
+# (-90, -180), so the cells of one row over a range of longitudes are a single range of keys
+CELL_SIZE=0.01
+CELL_COLUMNS=int(round(360 / CELL_SIZE))
+# above this many grid rows a box is scanned as one key range instead of one range per row
+MAX_ROWS=64
+EARTH_RADIUS_KM=6371.0088
+
+PRICE_PATTERN=re.compile(r'[^0-9.]')
+
+def grid_row(lat: float) -> int:
+    return(int(math.floor((lat + 90) / CELL_SIZE)))
+
+def grid_column(long: float) -> int:
+    return(int(math.floor((long + 180) / CELL_SIZE)))
+
+def grid_cell(lat: float, long: float) -> int:
+    """
+    @param lat: latitude in degrees
+    @param long: longitude in degrees
+    @returns: integer key of the grid cell containing the point
+    """
+    return(grid_row(lat) * CELL_COLUMNS + grid_column(long))
+
+def cell_ranges(south: float, west: float, north: float, east: float) -> list:
+    """
+    Function that covers a bounding box with grid cells
+
+    @param south: minimum latitude
+    @param west: minimum longitude
+    @param north: maximum latitude
+    @param east: maximum longitude
+    @returns: list of (first, last) cell key ranges, one per grid row
+    """
+    first_row, last_row=(grid_row(max(south, -90.0)), grid_row(min(north, 90.0 - 1e-9)))
+    first_column, last_column=(grid_column(max(west, -180.0)), grid_column(min(east, 180.0 - 1e-9)))
+    if last_row - first_row + 1 > MAX_ROWS:
+        return([(first_row * CELL_COLUMNS + first_column, last_row * CELL_COLUMNS + last_column)])
+    return([(row * CELL_COLUMNS + first_column, row * CELL_COLUMNS + last_column) for row in range(first_row, last_row + 1)])
+
+def bbox_around(lat: float, long: float, radius_km: float) -> tuple:
+    """
+    @param lat: latitude of the center in degrees
+    @param long: longitude of the center in degrees
+    @param radius_km: radius in kilometers
+    @returns: (south, west, north, east) of a box containing the circle
+    """
+    dlat=math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlong=dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+    return((lat - dlat, long - dlong, lat + dlat, long + dlong))
+
+def haversine_km(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """
+    @returns: great circle distance between two points in kilometers, None if a coordinate is missing
+    """
+    if lat1 is None or long1 is None or lat2 is None or long2 is None:
+        return(None)
+    phi1, phi2=(math.radians(lat1), math.radians(lat2))
+    a=(math.sin((phi2 - phi1) / 2) ** 2
+       + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(long2 - long1) / 2) ** 2)
+    return(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a))))
+
+def to_float(value):
+    try:
+        value=float(value)
+    except (TypeError, ValueError):
+        return(None)
+    return(None if math.isnan(value) else value)
+
+def parse_price(value):
+    """
+    @param value: price as scraped, e.g. '$2,450', or a number
+    @returns: price as an int, None if there is none
+    """
+    if isinstance(value, str):
+        value=PRICE_PATTERN.sub('', value)
+    value=to_float(value)
+    return(None if value is None else int(value))
+
+def create_index(connection) -> None:
+    """
+    Function that creates the query index tables of the listing store: one row per listing with typed
+    coordinates, grid cell, price, posting date and zipcode, each with its own B-tree index
+
+    @param connection: sqlite3.Connection to the listing store
+    @returns: None
+    """
+    connection.execute('CREATE TABLE IF NOT EXISTS listing_index (posting_id INTEGER PRIMARY KEY, cell INTEGER, '
+                       'latitude REAL, longitude REAL, price INTEGER, date_posted TEXT, zipcode TEXT)')
+    # the cell index covers the coordinates, price and date, so area queries only read the index
+    connection.execute('CREATE INDEX IF NOT EXISTS listing_index_cell ON listing_index '
+                       '(cell, latitude, longitude, price, date_posted)')
+    connection.execute('CREATE INDEX IF NOT EXISTS listing_index_price ON listing_index (price)')
+    connection.execute('CREATE INDEX IF NOT EXISTS listing_index_date_posted ON listing_index (date_posted)')
+    connection.execute('CREATE INDEX IF NOT EXISTS listing_index_zipcode ON listing_index (zipcode, date_posted, price)')
+
+def index_row(posting_id, latitude, longitude, price, date_posted, zipcode) -> tuple:
+    lat, long=(to_float(latitude), to_float(longitude))
+    cell=grid_cell(lat, long) if lat is not None and long is not None else None
+    zipcode=None if zipcode is None or str(zipcode) in ('', 'nan') else str(zipcode).split('.')[0]
+    return((int(posting_id), cell, lat, long, parse_price(price), None if date_posted is None else str(date_posted), zipcode))
+
+def index_listings(connection, posting_ids: list=None) -> int:
+    """
+    Function that adds listings of the store to the query index, inside the caller's transaction
+
+    @param connection: sqlite3.Connection to the listing store
+    @param posting_ids: posting IDs to index, None for every listing not indexed yet
+    @returns: number of listings indexed
+    """
+    select='SELECT "index", latitude, longitude, price, date_posted, zipcode FROM listings'
+    if posting_ids is None:
+        cursor=connection.execute(select + ' WHERE "index" NOT IN (SELECT posting_id FROM listing_index)')
+    else:
+        ids=[int(x) for x in posting_ids]
+        rows=[]
+        for i in range(0, len(ids), 500):
+            rows+=connection.execute(select + ' WHERE "index" IN (%s)' % (', '.join('?' * len(ids[i:i + 500]))),
+                                     ids[i:i + 500]).fetchall()
+        cursor=rows
+    rows=[index_row(*row) for row in cursor]
+    connection.executemany('INSERT OR REPLACE INTO listing_index VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    return(len(rows))
+
+def ensure_index(connection) -> int:
+    """
+    Function that creates the query index of a listing store if needed. Stores written before the index
+    existed are indexed once, which is recorded in the meta table
+
+    @param connection: sqlite3.Connection to the listing store, with its listings and meta tables
+    @returns: number of listings indexed
+    """
+    indexed=0
+    with connection:
+        create_index(connection)
+        if connection.execute("SELECT value FROM meta WHERE key = 'listing_index'").fetchone() is None:
+            indexed=index_listings(connection)
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('listing_index', '1')")
+    if indexed:
+        logging.info('indexed %s listings for queries' % (indexed))
+    return(indexed)
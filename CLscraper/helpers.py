@@ -2,7 +2,9 @@ import numpy as np
 import os
 import pandas as pd
 import re
-import shutil
+
+from CLscraper.seen import SeenIndex
+from CLscraper.store import get_meta, listings_stamp, load_ids, migrate_tsv, open_store, set_meta
 
 def exist_or_make(path: str) -> None:
     """
@@ -19,33 +21,47 @@ def create_paths(base_path: str) -> list:
     Function that takes in a base path and outputs directories for data and log files
     
     @param base_path: base output path for files
-    @returns a list with: log_path, database_path, and file_path
+    @returns a list with: log_path, database_path, file_path, cache_path, and media_path
     """
     log_path=os.path.join(base_path, 'logs')
     database_path=os.path.join(base_path, 'database')
     file_path=os.path.join(base_path, 'post_text')
-    out=[log_path, database_path, file_path]
+    cache_path=os.path.join(base_path, 'cache')
+    media_path=os.path.join(base_path, 'media')
+    out=[log_path, database_path, file_path, cache_path, media_path]
     [exist_or_make(x) for x in out]
     return(out)
 
-def check_database(database_path: str) -> tuple:
+def check_database(database_path: str, tsv_path: str=None, bloom_path: str=None) -> tuple:
     """
-    Function that checks status of current database file, and backs up current database file
+    Function that opens the listing store, migrating the old TSV database into it on first use
     
-    @param database_path: file path of database file
-    @returns: tuple of pd.DataFrame, list of all craigslist post ID in database, errors out if database file provided is < 2 lines long
+    @param database_path: file path of the SQLite listing store
+    @param tsv_path: file path of the old TSV database file, imported once if it exists
+    @param bloom_path: optional file path of a persisted Bloom filter in front of the seen-ID index, it is
+    rebuilt from the store when the store changed since it was saved, e.g. by a run without --bloom
+    @returns: tuple of the store connection, SeenIndex of all craigslist post ID in database (loaded lazily)
+    """
+    DB=open_store(database_path)
+    if tsv_path is not None:
+        migrate_tsv(DB, tsv_path)
+    if bloom_path is not None and os.path.exists(bloom_path) and get_meta(DB, 'bloom_stamp') != listings_stamp(DB):
+        os.remove(bloom_path)
+    database=SeenIndex(lambda: load_ids(DB), bloom_path)
+    return(DB, database)
+
+def save_seen(DB, database: SeenIndex) -> None:
+    """
+    Function that persists the Bloom filter of the seen-ID index, and records which state of the store
+    it covers, see check_database()
+
+    @param DB: store connection, output of check_database()
+    @param database: SeenIndex, output of check_database()
+    @returns: None
     """
-    with open(database_path,"r") as f:
-        count = len(f.readlines())
-    if count < 2:
-        return('Compare main database file to backup before proceeding')
-    else:
-        backup=database_path.replace('/database','/database/backup')
-        shutil.copy(database_path, backup)
-        # read in current database
-        DB=pd.read_csv(database_path, sep='\t')
-        database=DB['index'].tolist()
-        return(DB, database)
+    database.save()
+    if database.bloom_path is not None and database.bloom is not None:
+        set_meta(DB, 'bloom_stamp', listings_stamp(DB))
 
 def get_first(values: list):
     """
@@ -83,11 +99,14 @@ def filter_spam(df):
     """
     Function that takes in the craigslist database pd.DataFrame and subsets to likely real postings
     
-    @param df: pd.DataFrame output by make_output()
-    @returns: pd.DataFrame with spam listings removed
+    @param df: pd.DataFrame output by normalize_listings(), or by make_output()
+    @returns: pd.DataFrame with spam listings, and reposts of earlier listings, removed
     """
     spam_bool=((df.num_images > 2) & (df.scam == False) & \
-               (df.emoji < 2) & (~df.property_management.astype(str).str.contains('www|http')) & \
+               (df.emoji < 2) & (~df.property_management.str.contains('www|http', na=False)) & \
                (pd.notnull(df.latitude)) & (df.dog != 'no'))
-    clean=df[spam_bool]
+    if 'repost_of' in df.columns:
+        spam_bool=spam_bool & pd.isnull(df.repost_of)
+    # missing values of the nullable columns never pass
+    clean=df[spam_bool.fillna(False).astype(bool)]
     return(clean)
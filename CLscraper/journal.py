@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+
+class RunJournal:
+    """
+    On-disk journal of one scrape run. The search results, every parsed listing and every alert email are
+    checkpointed as they happen, so a run that crashes is resumed from its last completed item instead of
+    starting over.
+    The journal is cleared once the run's listings are in the database
+    """
+    def __init__(self, path: str):
+        dirname=os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.connection=sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS run (key TEXT PRIMARY KEY, value TEXT)')
+        # fetched pages are no longer journaled, posts that were not parsed yet are fetched again
+        self.connection.execute('DROP TABLE IF EXISTS pages')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS listings (url TEXT PRIMARY KEY, posting_id TEXT, row BLOB)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS emails (digest TEXT PRIMARY KEY, state TEXT, posting_ids TEXT)')
+        self.connection.commit()
+
+    def get(self, key: str):
+        row=self.connection.execute('SELECT value FROM run WHERE key = ?', (key,)).fetchone()
+        return(None if row is None else json.loads(row[0]))
+
+    def set(self, key: str, value) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO run VALUES (?, ?)', (key, json.dumps(value)))
+
+    def pending(self) -> bool:
+        """
+        @returns: True if an earlier run stopped after its search stage and before its database append
+        """
+        return(self.get('tags') is not None)
+
+    def start(self, tags: dict) -> None:
+        """
+        Record the output of the search stage, which opens the run
+
+        @param tags: dict with new posting URL as key and list of search names as value, output of search_all()
+        @returns: None
+        """
+        self.set('started', time.time())
+        self.set('tags', tags)
+
+    def add_listings(self, outlist: list) -> None:
+        """
+        @param outlist: list of ListingRecord, output of parse_pages()
+        @returns: None
+        """
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO listings VALUES (?, ?, ?)',
+                                        [(record.url, str(record.index), pickle.dumps(record)) for record in outlist])
+
+    def listings(self) -> list:
+        """
+        @returns: list of the ListingRecord of every listing parsed so far
+        """
+        return([pickle.loads(row) for (row,) in self.connection.execute('SELECT row FROM listings ORDER BY rowid')])
+
+    def emailed(self) -> set:
+        """
+        @returns: set of posting IDs whose alert email was sent, or may have been sent, by this run
+        """
+        emailed=set()
+        for (posting_ids,) in self.connection.execute('SELECT posting_ids FROM emails'):
+            emailed.update(json.loads(posting_ids))
+        return(emailed)
+
+    def unconfirmed(self) -> list:
+        """
+        @returns: list of (digest ID, list of posting IDs) of emails handed to the transport without a confirmation
+        """
+        return([(digest, json.loads(posting_ids)) for digest, posting_ids
+                in self.connection.execute("SELECT digest, posting_ids FROM emails WHERE state = 'sending'")])
+
+    def sending(self, digest: str, posting_ids: list) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO emails VALUES (?, 'sending', ?)", (digest, json.dumps(posting_ids)))
+
+    def sent(self, digest: str) -> None:
+        with self.connection:
+            self.connection.execute("UPDATE emails SET state = 'sent' WHERE digest = ?", (digest,))
+
+    def forget(self, digest: str) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM emails WHERE digest = ?', (digest,))
+
+    def clear(self) -> None:
+        """
+        Empty the journal once the run's listings are safely in the database
+        """
+        with self.connection:
+            for table in ('run', 'listings', 'emails'):
+                self.connection.execute('DELETE FROM %s' % (table))
+        logging.info('run journal cleared')
+
+    def close(self) -> None:
+        self.connection.close()
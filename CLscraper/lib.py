@@ -1,34 +1,30 @@
 import bs4
 import datetime
 import emoji
+import logging
 import numpy as np
 import os
 import pandas as pd
 import re
-import requests
-import time
 
+from CLscraper.fetch import fetch_pages
 from CLscraper.helpers import *
 from CLscraper.maps import *
+from CLscraper.records import ListingRecord, listings_frame
+from CLscraper.seen import SeenIndex
+from CLscraper.store import get_meta, set_meta
+from CLscraper.textmetrics import *
 
 def scrape_data(url_list: list)-> dict:
     """
-    Function that takes in a list of URLs and pulls data from craigslist with a sleep timer from 2-10 seconds
+    Function that takes in a list of URLs and pulls data from craigslist with the concurrent fetch engine,
+    throughput is set by the per-host rate limit in fetch.FETCH_CONFIG
     
     @param url_list: list of craigslist post URLs to scrape
     @returns: a dictionary with URL as key and BeautifulSoup object as the value
     """
-    soup_dict={}
-    scrape_count=0
-    for url in url_list:
-        req=requests.get(url)
-        content=req.text
-        soup=bs4.BeautifulSoup(content)
-        soup_dict[url]=soup
-        time.sleep(np.random.randint(2,10))
-        scrape_count+=1
-        if scrape_count % 10 == 0:
-            print("%s listings completed / %s total" % (scrape_count, len(url_list)))
+    pages=fetch_pages(url_list)
+    soup_dict={url : bs4.BeautifulSoup(content) for url, content in pages.items()}
     return(soup_dict)
 
 def extract_links(soup_list: list) -> dict:
@@ -45,14 +41,114 @@ def extract_links(soup_list: list) -> dict:
         url_dict[link.split('/')[-1].split('.')[0]]=link
     return(url_dict)
 
-def search_links(stem: str, database: list) -> dict:
+def page_links(soup: bs4.BeautifulSoup) -> dict:
+    """
+    Function that extracts posting URLs from one craigslist search page, in the order they are listed
+    
+    @param soup: BeautifulSoup object scraped from a craigslist search URL
+    @returns: a dict with the posting ID as the key and posting URL as value, in page order
+    """
+    url_dict={}
+    for link in re.findall(r'http[s]?:.*apa.*html', str(soup)):
+        url_dict.setdefault(link.split('/')[-1].split('.')[0], link)
+    return(url_dict)
+
+def page_metadata(soup: bs4.BeautifulSoup) -> dict:
+    """
+    Function that reads the listing details shown on a craigslist search page, used by delta sync to
+    spot changed posts without fetching them
+    
+    @param soup: BeautifulSoup object scraped from a craigslist search URL
+    @returns: a dict with the posting ID as the key and a dict of url, price and updated (result date) as value
+    """
+    metadata={}
+    for row in soup.findAll('li', {'class' : 'result-row'}):
+        link=row.find('a', href=True)
+        posting_id=row.get('data-pid')
+        if posting_id is None or link is None:
+            continue
+        price=row.find('span', {'class' : 'result-price'})
+        updated=row.find('time', {'class' : 'result-date'})
+        metadata[posting_id]={'url' : link['href'],
+                              'price' : None if price is None else price.text.strip(),
+                              'updated' : None if updated is None else updated.get('datetime')}
+    return(metadata)
+
+def pagination_done(soup: bs4.BeautifulSoup, database, run: int, known_run: int) -> tuple:
+    """
+    Function that decides whether incremental pagination of a newest-first search stops after a page
+    
+    @param soup: BeautifulSoup object of the last search results page fetched
+    @param database: a SeenIndex of all CL post ids in the database
+    @param run: number of consecutive known listings before this page
+    @param known_run: number of consecutive known listings that ends pagination, None to only stop on a known page
+    @returns: tuple of (True if pagination stops, number of consecutive known listings after this page)
+    """
+    ids=list(page_links(soup))
+    for posting_id in ids:
+        run=run + 1 if int(posting_id) in database else 0
+    page_known=len(ids) > 0 and all(int(x) in database for x in ids)
+    return(page_known or (known_run is not None and run >= known_run), run)
+
+def scrape_incremental(soup: bs4.BeautifulSoup, additional_urls: list, database, known_run: int) -> dict:
+    """
+    Function that walks the pages of a newest-first search one at a time, and stops requesting pages once
+    a whole page, or known_run consecutive listings, are already in the database
+    
+    @param soup: BeautifulSoup object of the first search results page
+    @param additional_urls: output of generate_search_urls()
+    @param database: a SeenIndex of all CL post ids in the database
+    @param known_run: number of consecutive known listings that ends pagination, None to only stop on a known page
+    @returns: a dictionary with URL as key and BeautifulSoup object as the value, for the extra pages fetched
+    """
+    pages={}
+    run=0
+    for url in additional_urls:
+        done, run=pagination_done(soup, database, run, known_run)
+        if done:
+            logging.info('stopping pagination before %s, %s consecutive known listings' % (url, run))
+            break
+        page=scrape_data([url])
+        if url not in page:
+            break
+        pages.update(page)
+        soup=page[url]
+    return(pages)
+
+def record_high_water_mark(store, stem: str, listing_dict: dict) -> None:
+    """
+    Function that records the newest posting ID seen for a search stem in the listing store
+    
+    @param store: listing store connection, output of open_store(), or None to skip
+    @param stem: a base craiglist URL describing a rental search
+    @param listing_dict: dict with the posting ID as the key, output of extract_links()
+    @returns: None
+    """
+    if store is None or len(listing_dict) == 0:
+        return
+    key='high_water_mark:' + stem
+    newest=max(int(x) for x in listing_dict)
+    previous=get_meta(store, key)
+    if previous is not None:
+        logging.info('%s listings newer than the previous high-water mark for %s'
+                     % (sum(int(x) > int(previous) for x in listing_dict), stem))
+    if previous is None or newest > int(previous):
+        set_meta(store, key, str(newest))
+
+def search_links(stem: str, database: list, incremental: bool=False, known_run: int=None, store=None) -> dict:
     """
     Function that pulls all individual craigslist post URLs from a base craigslist housing search result
     
     @param stem: a base craiglist URL describing a rental search
-    @param database: a list of all CL post ids currently in text database
-    @returns:
+    @param database: a SeenIndex of all CL post ids in the database, new ids are added to it so that a
+    posting returned by several searches in one run is only scraped once
+    @param incremental: for newest-first searches, stop paginating once results are all known (see scrape_incremental())
+    @param known_run: number of consecutive known listings that ends incremental pagination
+    @param store: listing store connection used to record the per-stem high-water mark, optional
+    @returns: list of new posting URLs
     """
+    if not isinstance(database, SeenIndex):
+        database=SeenIndex(lambda ids=database: ids)
     # scrape first results page to determine max results
     CL_dict=scrape_data([stem])
     soup=CL_dict[stem]
@@ -60,13 +156,19 @@ def search_links(stem: str, database: list) -> dict:
     
     # if multiple pages, get all search result urls
     additional_urls=generate_search_urls(stem, max_res)
-    all_urls=[stem] + additional_urls
 
-    # scrape search pages, and extract all listing urls 
-    CL_dict_add=scrape_data(all_urls)
-    soup_list=list(CL_dict_add.values())
+    # scrape remaining search pages (concurrently, or page by page until known results), and extract all listing urls 
+    if incremental:
+        CL_dict.update(scrape_incremental(soup, additional_urls, database, known_run))
+    else:
+        CL_dict.update(scrape_data(additional_urls))
+    soup_list=list(CL_dict.values())
     listing_dict=extract_links(soup_list)
+    record_high_water_mark(store, stem, listing_dict)
     new_urls=check_new(database, listing_dict)
+    # claim the new ids so later searches in this run skip them
+    new_set=set(new_urls)
+    database.update([key for key, url in listing_dict.items() if url in new_set])
     return(new_urls)
 
 def count_title_emoji(soup: bs4.BeautifulSoup) -> int:
@@ -77,7 +179,7 @@ def count_title_emoji(soup: bs4.BeautifulSoup) -> int:
     @returns: the number of emojis in the posting title
     """
     emojitext=get_first(soup.findAll('title'))
-    return(sum([x in emoji.EMOJI_DATA for x in emojitext]))
+    return(count_emoji(emojitext))
 
 def parse_posting_info(soup: bs4.BeautifulSoup) -> tuple:
     """
@@ -134,7 +236,7 @@ def metrics_from_soup(soup: bs4.BeautifulSoup) -> list:
     size=get_first(soup.findAll('span', {'class' : 'shared-line-bubble'}))
     images=len(soup.findAll("a", {"class":"thumb"}))
     emoji=count_title_emoji(soup)
-    scam=bool(re.search(r'lease to own|rent to own|real estate agent|purchase program|realtor|loftium', soup.text.lower()))
+    scam=bool(SCAM_PATTERN.search(soup.text.lower()))
     
     posting_id, posted, updated=parse_posting_info(soup)
     lat, long=get_coords(soup)
@@ -154,32 +256,6 @@ def get_posting_text(soup: bs4.BeautifulSoup) -> str:
     body=body_soup.replace('QR Code Link to This Post' , '').replace('\n' , '')
     return(body)
 
-def property_management(body: str) -> str:
-    """
-    Function to look for specific property managment companies or web links in post body
-    
-    @param body: post text stripped from HTML
-    @returns: property management name or a web address from the post
-    """ 
-    company=None
-    companies=['tindel','invitation','pathlight','management group', 'lgi homes', 'windermere', 'green keys']
-    for c in companies:
-        if re.search(c, body.lower()):
-            company=c
-    if company is None and re.findall(r'(http|www)[s]?', body):
-        company="".join([x for x in body.split(" ") if re.search(r'(http|www)[s]?', x.lower())])
-    return(company)
-
-def count_caps_words(body: str) -> int:
-    """
-    Function that counts the number of ALL CAPS WORDS
-    
-    @param body: text of craigslist posting
-    @returns: the number of emojis in the posting title
-    """
-    caps_words = [len(re.sub('[a-z0-9]', '', x))/len(x) for x in body.split(" ") if len(x) > 0]
-    return(sum(np.array(caps_words) == 1))
-
 def metrics_from_text(body: str) -> list:
     """
     Function that returns a number of metrics from the post text
@@ -210,12 +286,8 @@ def get_sqft(soup: bs4.BeautifulSoup, body: str) -> str:
             if x.text == '2' and x.find_previous_sibling():
                     sqft=x.find_previous_sibling().text
     # if sqft can't be found in a tag, try to pull it from text, add caveat (estimated)        
-    if sqft is None and re.search(r'ft', body):
-        try:
-            max_size=max([re.findall(r'\d+',x[0]) for x in re.findall( r'(( \w+){3}) ft', body)])[0]
-            sqft=str(max_size) + "(estimated)"
-        except:
-            pass
+    if sqft is None:
+        sqft=sqft_from_text(body)
     return(sqft)
 
 def dog_friendliness(soup: bs4.BeautifulSoup, body: str) -> str:
@@ -226,19 +298,12 @@ def dog_friendliness(soup: bs4.BeautifulSoup, body: str) -> str:
     @param body: post text stripped from HTML
     @returns: doggo an indicator of dog friendliness, can be: yes, no, unknown, or a snippet of the post
     """ 
-    doggo='unknown'
     # first look for tag indicating dog friendly
     if sum(['dog' in x.text for x in soup.findAll('span')]) > 0:
-        doggo='yes'
-    # next search for 'no dogs' in text
-    elif re.search(r'no (pet|dog|animal)s?', body.lower()):
-        doggo='no'
-    # finally search the text for any mention of dogs and return the whole sentence
-    elif re.search(r'(pet|dog|animal)s?', body.lower()):
-        doggo=" ".join([x for x in body.split(".") if re.search(r'(pet|dog|animal)s?', x.lower())])     
-    return(doggo)
+        return('yes')
+    return(dog_from_text(body))
 
-def make_output(soup_metrics: list, dog: str, sqft: str, text_metrics: list, address: list, snippet: str, url: str) -> pd.DataFrame:
+def make_record(soup_metrics: list, dog: str, sqft: str, text_metrics: list, address: list, snippet: str, url: str) -> ListingRecord:
     """
     This function combines all metrics derived from the post body and text
     
@@ -249,38 +314,42 @@ def make_output(soup_metrics: list, dog: str, sqft: str, text_metrics: list, add
     @param address: ouput from parse_address()
     @param snippet: first 100 characters of post body
     @param url: posting URL
-    @returns
+    @returns: ListingRecord, see listings_frame() to build a DataFrame of many
     """
     lat, long, posting_id, posted, updated, price, available, size, images, emoji, scam=soup_metrics
     prop, angry, word_length=text_metrics
     postal_address, zipcode, neighborhood, locality=address
     
-    results_dict={posting_id : 
-     {'url' : url,
-      'price' : price,
-      'date_available' : available,
-      'bed_bath' : size,
-      'sqft' : sqft,
-      'num_images' : images,
-      'dog' : dog,
-      'scam' : scam,
-      'property_management' : prop,
-      'angry_score' : angry,
-      'emoji' : emoji,
-      'word_length' : word_length,
-      'address' : postal_address,
-      'snippet' : snippet,
-      'zipcode' : zipcode,
-      'neighborhood' : neighborhood,
-      'locality' : locality,
-      'date_posted' : posted,
-      'date_updated' : updated,
-      'latitude' : lat,
-      'longitude' : long
-    }}
-    
-    df=pd.DataFrame.from_dict(results_dict, columns=list(results_dict[posting_id].keys()), orient='index')
-    return(df)
+    return(ListingRecord(posting_id,
+                         url=url,
+                         price=price,
+                         date_available=available,
+                         bed_bath=size,
+                         sqft=sqft,
+                         num_images=images,
+                         dog=dog,
+                         scam=scam,
+                         property_management=prop,
+                         angry_score=angry,
+                         emoji=emoji,
+                         word_length=word_length,
+                         address=postal_address,
+                         snippet=snippet,
+                         zipcode=zipcode,
+                         neighborhood=neighborhood,
+                         locality=locality,
+                         date_posted=posted,
+                         date_updated=updated,
+                         latitude=lat,
+                         longitude=long))
+
+def make_output(soup_metrics: list, dog: str, sqft: str, text_metrics: list, address: list, snippet: str, url: str) -> pd.DataFrame:
+    """
+    One-row DataFrame version of make_record(), same arguments
+
+    @returns: DataFrame with metrics
+    """
+    return(listings_frame([make_record(soup_metrics, dog, sqft, text_metrics, address, snippet, url)]))
 
 def extract_soup(soup: bs4.BeautifulSoup, url: str, file_path: str, api_key: str) -> pd.DataFrame:
     """
@@ -289,6 +358,7 @@ def extract_soup(soup: bs4.BeautifulSoup, url: str, file_path: str, api_key: str
     @param soup: BeautifulSoup object created from a craigslist posting
     @param url: URL for craigslist post
     @param file_path: directory to write body txt files
+    @param api_key: Google maps API key, if None the reverse address lookup is skipped
     @returns: DataFrame with metrics
     """
     # pull metrics from soup
@@ -306,7 +376,10 @@ def extract_soup(soup: bs4.BeautifulSoup, url: str, file_path: str, api_key: str
     dog=dog_friendliness(soup, posttext)
     sqft=get_sqft(soup, posttext)
     # reverse lookup lat, long coords to address
-    address=reverse_lookup(api_key, soup_metrics[0], soup_metrics[1])
+    if api_key is None:
+        address=[None, None, None, None]
+    else:
+        address=reverse_lookup(api_key, soup_metrics[0], soup_metrics[1])
     # create output dataframe
     df=make_output(soup_metrics, dog, sqft, text_metrics, address, snippet, url)
     return(df)
@@ -1,6 +1,10 @@
-import requests
+from CLscraper.media import get_map_png
+from CLscraper.session import http_get
 from email.mime.image import MIMEImage
 
+# Google's reverse lookup API
+GEOCODE_URL='https://maps.googleapis.com/maps/api/geocode/json?latlng='
+
 def parse_address(json) -> list:
     """
     Function that parses the Gogle maps API json output 
@@ -28,9 +32,7 @@ def reverse_lookup(key: str, lat: str, long: str) -> list:
     @param long: longitude
     @returns: Google's reverse lookup json object
     """
-    # Google's reverse lookup API
-    url='https://maps.googleapis.com/maps/api/geocode/json?latlng='
-    r=requests.get(url + lat + ',' + long + "&key=" + key)
+    r=http_get(GEOCODE_URL + lat + ',' + long + "&key=" + key)
     json=r.json()
     # parse output
     address=parse_address(json)
@@ -40,7 +42,7 @@ def check_new(database: list, url_dict: dict) -> list:
     """
     Function that filters list of all URLs to only new URLs
     
-    @param database: a list of all CL post ids currently in text database
+    @param database: a SeenIndex (or any container) of all CL post ids currently in the database
     @param url_dict: a dict of URLs to be checked against URLs already scraped, generated by extract_links()
     @returns: filtered list of only new URLs
     """
@@ -57,19 +59,10 @@ def get_map(lat, long, api_key):
     @param api: google maps API key
     @returns: a MIMEImage object of a google map PNG
     """
-    # set parameters to create google map
-    url = "https://maps.googleapis.com/maps/api/staticmap?"
-    center_lat=str(lat)
-    center_long=str(long)
-    zoom = 10
-    r = requests.get(url,
-                     params={"center" : center_lat + ',' + center_long,
-                             "zoom" : str(zoom),
-                             "size" : "200x200",
-                             "markers" :  center_lat + ',' + center_long,
-                            "key" : api_key})
-    if r.status_code == 200:
-        image=MIMEImage(r.content)
+    # fetch a cached or new google map PNG
+    png=get_map_png(lat, long, api_key)
+    if png is not None:
+        image=MIMEImage(png)
     else:
         image=None
     return(image)
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from CLscraper.cache import write_atomic
+from CLscraper.metrics import count
+from CLscraper.session import http_get
+
+# media settings, the disk cache is disabled until configure_media() is given a path
+MEDIA_CONFIG={'path' : None,
+              'workers' : 8,
+              'size' : (200, 200),
+              'zoom' : 10}
+
+STATIC_MAP_URL='https://maps.googleapis.com/maps/api/staticmap?'
+
+def configure_media(**kwargs) -> None:
+    """
+    Function that updates the media settings
+
+    @param kwargs: any of path, workers, size, zoom
+    @returns: None
+    """
+    for key, value in kwargs.items():
+        if key not in MEDIA_CONFIG:
+            raise KeyError('unknown media setting %s' % (key))
+        if value is not None:
+            MEDIA_CONFIG[key]=value
+
+def media_file(kind: str, key: str) -> str:
+    """
+    Function that maps a media item to its location in the disk cache
+
+    @param kind: 'thumb' for post images or 'map' for static maps
+    @param key: string identifying the item, an image URL or a coordinate pair
+    @returns: file path, or None if the cache is disabled
+    """
+    if MEDIA_CONFIG['path'] is None:
+        return(None)
+    digest=hashlib.sha256(('%s|%s|%s' % (key, MEDIA_CONFIG['size'], MEDIA_CONFIG['zoom'])).encode('utf-8')).hexdigest()
+    return(os.path.join(MEDIA_CONFIG['path'], kind, digest + '.png'))
+
+def cached_media(kind: str, key: str, fetch) -> bytes:
+    """
+    Function that returns a finished PNG from the disk cache, or creates and stores it
+
+    @param kind: 'thumb' for post images or 'map' for static maps
+    @param key: string identifying the item, an image URL or a coordinate pair
+    @param fetch: function without arguments that returns the PNG bytes or None
+    @returns: PNG bytes, or None if the item could not be fetched. Bytes that could not be written to the
+    cache are still returned
+    """
+    path=media_file(kind, key)
+    if path is not None and os.path.exists(path):
+        count('media_cache_hit')
+        with open(path, 'rb') as f:
+            return(f.read())
+    count('media_cache_miss')
+    data=fetch()
+    if data is not None and path is not None:
+        try:
+            write_atomic(path, data)
+        except OSError as e:
+            logging.info('media cache write failed for %s: %s' % (path, e))
+    return(data)
+
+def make_thumbnail(data: bytes) -> bytes:
+    """
+    Function that resizes an image to a PNG thumbnail. JPEGs are decoded in draft mode, which lets the
+    decoder downscale by up to 8x while decoding, so full resolution pixels are never materialized
+
+    @param data: raw image bytes
+    @returns: PNG bytes of the thumbnail
+    """
+    img=Image.open(io.BytesIO(data))
+    img.draft('RGB', MEDIA_CONFIG['size'])
+    small=img.resize(MEDIA_CONFIG['size'])
+    buf=io.BytesIO()
+    small.save(buf, format='PNG')
+    return(buf.getvalue())
+
+def get_thumbnail(image_url: str) -> bytes:
+    """
+    Function that returns a 200 x 200 PNG thumbnail of a post image
+
+    @param image_url: URL of the post image
+    @returns: PNG bytes, or None if the image could not be fetched
+    """
+    def fetch():
+        r=http_get(image_url)
+        if r.status_code == 200:
+            return(make_thumbnail(r.content))
+    if image_url is None:
+        return(None)
+    return(cached_media('thumb', image_url, fetch))
+
+def get_map_png(lat, long, api_key: str) -> bytes:
+    """
+    Function that returns a google static map PNG centered on a latitude, longitude pair
+
+    @param lat: latitude
+    @param long: longitude
+    @param api_key: google maps API key
+    @returns: PNG bytes, or None if the map could not be fetched
+    """
+    center=str(lat) + ',' + str(long)
+    def fetch():
+        r=http_get(STATIC_MAP_URL,
+                   params={"center" : center,
+                           "zoom" : str(MEDIA_CONFIG['zoom']),
+                           "size" : '%sx%s' % MEDIA_CONFIG['size'],
+                           "markers" : center,
+                           "key" : api_key})
+        if r.status_code == 200:
+            return(r.content)
+    return(cached_media('map', center, fetch))
+
+def listing_media(lat, long, image_url: str, api_key: str) -> tuple:
+    """
+    Function that fetches the map and thumbnail of one listing
+
+    @param lat: latitude
+    @param long: longitude
+    @param image_url: URL of the post image
+    @param api_key: google maps API key
+    @returns: tuple of (map PNG bytes, thumbnail PNG bytes), missing images are None
+    """
+    images=[]
+    for get, args in ((get_map_png, (lat, long, api_key)), (get_thumbnail, (image_url,))):
+        try:
+            images.append(get(*args))
+        except Exception as e:
+            logging.info('media fetch failed: %s' % (e))
+            images.append(None)
+    return(tuple(images))
+
+def fetch_listing_media(listings: list, api_key: str) -> list:
+    """
+    Function that fetches the map and thumbnail of every listing in an alert concurrently
+
+    @param listings: list of (latitude, longitude, image URL) tuples
+    @param api_key: google maps API key
+    @returns: list of (map PNG bytes, thumbnail PNG bytes) tuples in the same order, missing images are None
+    """
+    with ThreadPoolExecutor(max_workers=MEDIA_CONFIG['workers']) as pool:
+        return(list(pool.map(lambda listing: listing_media(*listing, api_key), listings)))
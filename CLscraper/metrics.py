@@ -0,0 +1,260 @@
+import contextlib
+import json
+import resource
+import threading
+import time
+import urllib.parse
+
+from CLscraper.cache import write_atomic
+
+# upper bounds in seconds of the HTTP latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# run metrics, reset by reset_metrics() at the start of every run
+STAGES={}
+COUNTERS={}
+HOSTS={}
+
+_LOCK=threading.Lock()
+# stages currently running, innermost last, each a dict with the peak memory seen so far
+_STACK=[]
+
+def reset_metrics() -> None:
+    """
+    Function that clears every stage timer, counter and host histogram
+    """
+    with _LOCK:
+        STAGES.clear()
+        COUNTERS.clear()
+        HOSTS.clear()
+        del _STACK[:]
+
+def count(name: str, value: int=1) -> None:
+    """
+    Function that increments a run counter, safe to call from worker threads
+
+    @param name: counter name, e.g. 'fetch_cache_hit'
+    @param value: amount to add
+    @returns: None
+    """
+    with _LOCK:
+        COUNTERS[name]=COUNTERS.get(name, 0) + value
+
+def set_count(name: str, value: int) -> None:
+    """
+    Function that sets a run counter kept elsewhere, e.g. the geocode cache stats
+
+    @param name: counter name
+    @param value: current value
+    @returns: None
+    """
+    with _LOCK:
+        COUNTERS[name]=value
+
+def request_count() -> int:
+    """
+    @returns: number of HTTP requests made since the last reset_metrics(), over all hosts
+    """
+    with _LOCK:
+        return(sum(x['requests'] for x in HOSTS.values()))
+
+def observe_request(url: str, seconds: float, status: int, size: int) -> None:
+    """
+    Function that records one HTTP request in the histogram of its host
+
+    @param url: URL that was requested
+    @param seconds: time until the response body was read
+    @param status: HTTP status code, 0 when the request failed
+    @param size: number of response body bytes
+    @returns: None
+    """
+    host=urllib.parse.urlsplit(url).netloc
+    with _LOCK:
+        if host not in HOSTS:
+            HOSTS[host]={'requests' : 0, 'seconds' : 0.0, 'bytes' : 0, 'status' : {},
+                         'buckets' : [0] * (len(LATENCY_BUCKETS) + 1)}
+        entry=HOSTS[host]
+        entry['requests']+=1
+        entry['seconds']+=seconds
+        entry['bytes']+=size
+        entry['status'][str(status)]=entry['status'].get(str(status), 0) + 1
+        i=0
+        while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+            i+=1
+        entry['buckets'][i]+=1
+
+def reset_peak_memory() -> bool:
+    """
+    Function that resets the kernel's resident memory high-water mark of this process (Linux only)
+
+    @returns: True if the mark was reset, so the next peak_memory() reading only covers what came after
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return(True)
+    except OSError:
+        return(False)
+
+def peak_memory() -> int:
+    """
+    Function that reads the resident memory high-water mark of this process, see reset_peak_memory()
+
+    @returns: peak resident memory in kilobytes
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return(int(line.split()[1]))
+    except OSError:
+        pass
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def children_peak_memory() -> int:
+    """
+    Function that reads the largest resident memory high-water mark of the finished child processes (the
+    parse pool). The kernel keeps it for the life of the process and it cannot be reset, so it is reported
+    once per run rather than per stage
+
+    @returns: peak resident memory in kilobytes
+    """
+    return(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    Context manager that times a pipeline stage and records its memory high-water mark. Stages can be
+    nested, the time and peak memory of an inner stage are also part of the outer one
+
+    @param name: stage name, e.g. 'fetch'
+    """
+    if _STACK:
+        _STACK[-1]['peak']=max(_STACK[-1]['peak'], peak_memory())
+    reset=reset_peak_memory()
+    frame={'peak' : 0 if reset else peak_memory()}
+    _STACK.append(frame)
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds=time.perf_counter() - start
+        _STACK.pop()
+        peak=max(frame['peak'], peak_memory())
+        if _STACK:
+            _STACK[-1]['peak']=max(_STACK[-1]['peak'], peak)
+        with _LOCK:
+            entry=STAGES.setdefault(name, {'calls' : 0, 'seconds' : 0.0, 'peak_memory_kb' : 0})
+            entry['calls']+=1
+            entry['seconds']+=seconds
+            entry['peak_memory_kb']=max(entry['peak_memory_kb'], peak)
+
+def observe_stage(name: str, seconds: float, items: int=0) -> None:
+    """
+    Function that adds the busy time of one batch of a streaming pipeline stage, safe to call from worker
+    threads. Stages running side by side share the process, so no peak memory is recorded
+
+    @param name: stage name, e.g. 'pipeline_parse'
+    @param seconds: time spent on the batch
+    @param items: number of items in the batch
+    @returns: None
+    """
+    with _LOCK:
+        entry=STAGES.setdefault(name, {'calls' : 0, 'seconds' : 0.0, 'items' : 0})
+        entry['calls']+=1
+        entry['seconds']+=seconds
+        entry['items']=entry.get('items', 0) + items
+
+def hit_rate(hits: int, misses: int) -> float:
+    return(hits / (hits + misses) if hits + misses > 0 else None)
+
+def run_summary(extra: dict=None) -> dict:
+    """
+    Function that collects the run metrics into one JSON serializable dict
+
+    @param extra: other figures to include under 'run', e.g. listing counts
+    @returns: dict with run (with the peak memory of the parse pool processes), stages, counters, cache hit
+    rates and per-host HTTP metrics
+    """
+    with _LOCK:
+        counters=dict(COUNTERS)
+        hosts=json.loads(json.dumps(HOSTS))
+        stages=json.loads(json.dumps(STAGES))
+    caches={'fetch' : hit_rate(counters.get('fetch_cache_hit', 0) + counters.get('fetch_cache_revalidated', 0),
+                               counters.get('fetch_cache_miss', 0)),
+            'geocode' : hit_rate(counters.get('geocode_hits', 0), counters.get('geocode_misses', 0)),
+            'media' : hit_rate(counters.get('media_cache_hit', 0), counters.get('media_cache_miss', 0))}
+    for entry in hosts.values():
+        entry['mean_seconds']=entry['seconds'] / entry['requests'] if entry['requests'] else None
+        entry['buckets']=dict(zip([str(x) for x in LATENCY_BUCKETS] + ['+Inf'], entry['buckets']))
+    return({'run' : dict(extra or {}, time=time.time(), children_peak_memory_kb=children_peak_memory()),
+            'stages' : stages,
+            'counters' : counters,
+            'cache_hit_rate' : caches,
+            'hosts' : hosts})
+
+def write_summary(path: str, summary: dict) -> None:
+    """
+    @param path: file path of the JSON run summary
+    @param summary: output of run_summary()
+    @returns: None
+    """
+    write_atomic(path, json.dumps(summary, indent=2).encode('utf-8'))
+
+def prometheus_label(value: str) -> str:
+    return(str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+def prometheus_text(summary: dict) -> str:
+    """
+    Function that formats a run summary in the Prometheus text exposition format
+
+    @param summary: output of run_summary()
+    @returns: metrics text
+    """
+    # metric name -> (type, list of sample lines), every family is written as one group
+    families={}
+    def sample(name: str, kind: str, labels: str, value, suffix: str='') -> None:
+        families.setdefault(name, (kind, []))[1].append('%s%s%s %s' % (name, suffix, labels, value))
+    sample('clscraper_last_run_timestamp_seconds', 'gauge', '', summary['run']['time'])
+    for key, value in summary['run'].items():
+        if key != 'time' and isinstance(value, (int, float)) and not isinstance(value, bool):
+            sample('clscraper_run_%s' % (key), 'gauge', '', value)
+    for name, entry in summary['stages'].items():
+        labels='{stage="%s"}' % (prometheus_label(name))
+        sample('clscraper_stage_seconds', 'gauge', labels, entry['seconds'])
+        # stages of the streaming pipeline, see observe_stage(), count items instead of measuring memory
+        if 'peak_memory_kb' in entry:
+            sample('clscraper_stage_peak_memory_bytes', 'gauge', labels, entry['peak_memory_kb'] * 1024)
+        if 'items' in entry:
+            sample('clscraper_stage_items', 'gauge', labels, entry['items'])
+    for name, value in sorted(summary['counters'].items()):
+        sample('clscraper_events', 'gauge', '{event="%s"}' % (prometheus_label(name)), value)
+    for name, value in summary['cache_hit_rate'].items():
+        if value is not None:
+            sample('clscraper_cache_hit_ratio', 'gauge', '{cache="%s"}' % (name), value)
+    for host, entry in summary['hosts'].items():
+        host=prometheus_label(host)
+        cumulative=0
+        for bound, n in entry['buckets'].items():
+            cumulative+=n
+            sample('clscraper_http_request_duration_seconds', 'histogram', '{host="%s",le="%s"}' % (host, bound),
+                   cumulative, '_bucket')
+        sample('clscraper_http_request_duration_seconds', 'histogram', '{host="%s"}' % (host), entry['seconds'], '_sum')
+        sample('clscraper_http_request_duration_seconds', 'histogram', '{host="%s"}' % (host), entry['requests'], '_count')
+        sample('clscraper_http_response_bytes', 'gauge', '{host="%s"}' % (host), entry['bytes'])
+    lines=[]
+    for name, (kind, samples) in families.items():
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines+=samples
+    return('\n'.join(lines) + '\n')
+
+def write_prometheus(path: str, summary: dict) -> None:
+    """
+    Function that writes a run summary as a node exporter textfile. The file is replaced atomically so the
+    exporter never reads a half written file
+
+    @param path: file path ending in .prom, inside the node exporter textfile directory
+    @param summary: output of run_summary()
+    @returns: None
+    """
+    write_atomic(path, prometheus_text(summary).encode('utf-8'))
@@ -0,0 +1,47 @@
+import argparse
+import os
+
+from CLscraper.archive import PostArchive, pack_directory
+from CLscraper.helpers import check_database, create_paths, save_seen
+from CLscraper.store import count_listings, get_meta
+
+def migrate(base_path: str, keep_text: bool=False, bloom: bool=False) -> dict:
+    """
+    Function that runs the one-time migrations of an output directory: the old CL_database.main.txt TSV
+    database is imported into the SQLite store, a store with an older schema is rewritten to the typed
+    columns, post_text/*.txt files are packed into the post archive, and
+    the Bloom filter of seen posting IDs is rebuilt. Each step is a no-op when there is nothing left to do
+
+    @param base_path: base output path for files
+    @param keep_text: leave the post_text/*.txt files in place once they are archived
+    @param bloom: rebuild database/seen.bloom from the store
+    @returns: dict of figures: listings in the store, the TSV file imported, schema version, posts packed
+    """
+    log_path, database_path, file_path, cache_path, media_path=create_paths(base_path)
+    bloom_path=os.path.join(database_path, 'seen.bloom') if bloom else None
+    if bloom_path is not None and os.path.exists(bloom_path):
+        os.remove(bloom_path)
+    DB, database=check_database(os.path.join(database_path, 'CL_database.sqlite'),
+                                os.path.join(database_path, 'CL_database.main.txt'), bloom_path)
+    archive=PostArchive(os.path.join(file_path, 'archive'))
+    packed=pack_directory(archive, file_path, remove=not keep_text)
+    figures={'listings' : count_listings(DB), 'migrated_tsv' : get_meta(DB, 'migrated_tsv'),
+             'schema_version' : get_meta(DB, 'schema_version'), 'packed_posts' : packed}
+    if bloom:
+        # the filter is built from the store when the IDs are loaded
+        database.load()
+    save_seen(DB, database)
+    archive.close()
+    DB.close()
+    return(figures)
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(prog='CLscraper migrate', description='one-time migrations of a CLscraper output directory')
+    parser.add_argument('base_path', type=str, nargs=1, help='base output path for files')
+    parser.add_argument('--keep-text', action='store_true', help='keep post_text/*.txt files after packing them into the archive')
+    parser.add_argument('--bloom', action='store_true', help='rebuild the Bloom filter of seen posting IDs')
+    arguments=parser.parse_args(argv)
+    figures=migrate(arguments.base_path[0], arguments.keep_text, arguments.bloom)
+    for key, value in figures.items():
+        print('%s\t%s' % (key, value))
+    return()
@@ -0,0 +1,228 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from CLscraper.extract import collect_listings, parse_worker
+from CLscraper.fetch import stream_pages
+from CLscraper.helpers import filter_spam
+from CLscraper.media import MEDIA_CONFIG, listing_media
+from CLscraper.metrics import observe_stage
+from CLscraper.records import listings_frame
+from CLscraper.schema import normalize_listings
+
+# streaming pipeline settings: items waiting between two stages, and the largest micro-batch the geocode
+# stage takes at once (geocoding, repost checks and archive writes are batched)
+PIPELINE_CONFIG={'queue_size' : 32,
+                 'geocode_batch' : 32}
+
+# end of stream marker passed down the queues
+_DONE=object()
+
+def configure_pipeline(**kwargs) -> None:
+    """
+    Function that updates the streaming pipeline settings
+
+    @param kwargs: any of queue_size, geocode_batch
+    @returns: None
+    """
+    for key, value in kwargs.items():
+        if key not in PIPELINE_CONFIG:
+            raise KeyError('unknown pipeline setting %s' % (key))
+        if value is not None:
+            PIPELINE_CONFIG[key]=value
+
+class PipelineStopped(Exception):
+    """
+    Raised inside a stage when the pipeline is shut down, e.g. because another stage failed
+    """
+
+class Pipeline:
+    """
+    Streaming pipeline: a source thread feeds a chain of stages connected by bounded queues. Every stage runs
+    in its own worker threads and passes each batch on as soon as it is done. A full queue blocks the stage
+    in front of it, so however many items flow through, at most queue_size of them wait between two stages
+    """
+    def __init__(self, source, queue_size: int=None):
+        """
+        @param source: function called in its own thread with an emit function, to emit every input item
+        @param queue_size: bound of every queue, defaults to PIPELINE_CONFIG['queue_size']
+        """
+        self.source=source
+        self.queue_size=queue_size or PIPELINE_CONFIG['queue_size']
+        self.stages=[]
+        self.stopped=threading.Event()
+        self.errors=[]
+        self.lock=threading.Lock()
+
+    def add_stage(self, name: str, function, workers: int=1, batch: int=1):
+        """
+        @param name: stage name, busy time is recorded in the run metrics as pipeline_<name>
+        @param function: called with a list of up to batch items, returns an iterable of output items
+        @param workers: number of threads running the stage
+        @param batch: largest number of waiting items handed to one call
+        @returns: the Pipeline, so stages can be chained
+        """
+        self.stages.append((name, function, max(1, workers), max(1, batch)))
+        return(self)
+
+    def put(self, outbox: queue.Queue, item) -> None:
+        while not self.stopped.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def get(self, inbox: queue.Queue):
+        while not self.stopped.is_set():
+            try:
+                return(inbox.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        raise PipelineStopped()
+
+    def take(self, inbox: queue.Queue, batch: int) -> list:
+        """
+        @returns: the next items waiting in inbox, at least one and at most batch, None at the end of the stream
+        """
+        item=self.get(inbox)
+        items=[]
+        while item is not _DONE:
+            items.append(item)
+            if len(items) == batch:
+                return(items)
+            try:
+                item=inbox.get_nowait()
+            except queue.Empty:
+                return(items)
+        # every worker of the stage has to see the end marker
+        inbox.put(_DONE)
+        return(items or None)
+
+    def fail(self, error: Exception) -> None:
+        with self.lock:
+            self.errors.append(error)
+        self.stopped.set()
+
+    def run_source(self, outbox: queue.Queue) -> None:
+        try:
+            self.source(lambda item: self.put(outbox, item))
+            self.put(outbox, _DONE)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self.fail(e)
+
+    def run_stage(self, stage: tuple, inbox: queue.Queue, outbox: queue.Queue, running: list) -> None:
+        name, function, workers, batch=stage
+        try:
+            while True:
+                items=self.take(inbox, batch)
+                if items is None:
+                    break
+                start=time.perf_counter()
+                outputs=list(function(items))
+                observe_stage('pipeline_' + name, time.perf_counter() - start, len(items))
+                for output in outputs:
+                    self.put(outbox, output)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            logging.info('pipeline stage %s failed: %s' % (name, repr(e)))
+            self.fail(e)
+        finally:
+            with self.lock:
+                running[0]-=1
+                last=running[0] == 0
+            if last and not self.stopped.is_set():
+                try:
+                    self.put(outbox, _DONE)
+                except PipelineStopped:
+                    pass
+
+    def run(self):
+        """
+        Generator that starts every stage and yields the outputs of the last one as they arrive. When a
+        stage fails the pipeline is shut down and its exception is raised here
+
+        @returns: generator of the output items of the last stage
+        """
+        queues=[queue.Queue(maxsize=self.queue_size) for i in range(len(self.stages) + 1)]
+        threads=[threading.Thread(target=self.run_source, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            running=[stage[2]]
+            threads+=[threading.Thread(target=self.run_stage, args=(stage, queues[i], queues[i + 1], running), daemon=True)
+                      for j in range(stage[2])]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                try:
+                    item=self.get(queues[-1])
+                except PipelineStopped:
+                    break
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+def stream_listings(urls: list, archive, api_key: str, workers: int=None, reposts=None,
+                    skip_repost_geocode: bool=False, alerts: bool=True, figures: dict=None):
+    """
+    Generator that runs the scrape of new posts as one streaming pipeline: fetch -> parse -> geocode -> media.
+    Each post moves on as soon as the stage before is done with it, and its HTML is dropped once it is parsed,
+    so at most the pages waiting in the queues are held at once, however many posts a run finds. Parsing runs in a process pool, geocoding, repost
+    checks and archive writes in micro-batches of what is waiting, and the map and thumbnail of listings
+    that pass the spam filter are fetched as soon as they are geocoded
+
+    @param urls: posting URLs to fetch
+    @param archive: PostArchive for the post bodies
+    @param api_key: Google maps API key, if None the reverse address lookup and the media stage are skipped
+    @param workers: number of parse processes, defaults to the CPU count, 1 parses in a thread of this process
+    @param reposts: RepostIndex to check the posts against, optional, see collect_listings()
+    @param skip_repost_geocode: do not geocode posts found to be reposts
+    @param alerts: fetch the media of alert candidates
+    @param figures: dict whose 'failed' count is increased for every listing that failed, optional
+    @returns: generator of (ListingRecord, tuple of map and thumbnail PNG bytes or None) in completion order
+    """
+    workers=workers or os.cpu_count() or 1
+    figures=figures if figures is not None else {}
+    figures.setdefault('failed', 0)
+    pool=ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def parse(pages):
+        tasks=[(url, html.encode('utf-8') if isinstance(html, str) else html, None) for url, html in pages]
+        return(map(parse_worker, tasks) if pool is None else list(pool.map(parse_worker, tasks)))
+
+    def geocode(results):
+        records, fails=collect_listings(results, api_key, archive, reposts, skip_repost_geocode)
+        figures['failed']+=fails
+        candidates=set()
+        if alerts and api_key is not None and records:
+            candidates=set(filter_spam(normalize_listings(listings_frame(records).reset_index()))['index'].astype(str))
+        return([(record, str(record.index) in candidates) for record in records])
+
+    def media(items):
+        return([(record, listing_media(record.latitude, record.longitude, record.image_url, api_key) if alert else None)
+                for record, alert in items])
+
+    pipeline=Pipeline(lambda emit: stream_pages(urls, lambda url, html: emit((url, html))))
+    # a parse thread per process keeps every process busy while finished listings are handed on
+    pipeline.add_stage('parse', parse, workers=workers * 2 if pool is not None else 1)
+    pipeline.add_stage('geocode', geocode, batch=PIPELINE_CONFIG['geocode_batch'])
+    pipeline.add_stage('media', media, workers=MEDIA_CONFIG['workers'] if alerts and api_key is not None else 1)
+    try:
+        for item in pipeline.run():
+            yield item
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,161 @@
+import argparse
+import csv
+import math
+import os
+import sqlite3
+import sys
+
+from CLscraper.geoindex import EARTH_RADIUS_KM, bbox_around, cell_ranges, ensure_index, haversine_km, to_float
+
+def store_path(base_path: str) -> str:
+    """
+    @param base_path: base output path for files, as given to CLscraper scrape
+    @returns: file path of the SQLite listing store
+    """
+    return(os.path.join(base_path, 'database', 'CL_database.sqlite'))
+
+def open_readonly(path: str) -> sqlite3.Connection:
+    """
+    Function that opens the listing store read only, so a query never blocks or changes a running scrape.
+    A store written before the query index existed is indexed first
+
+    @param path: file path of the SQLite listing store
+    @returns: sqlite3.Connection, with the distance_km(lat1, long1, lat2, long2) SQL function
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError('no listing store at %s' % (path))
+    connection=sqlite3.connect('file:%s?mode=ro' % (path), uri=True)
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'listing_index'").fetchone() is None:
+        connection.close()
+        writer=sqlite3.connect(path)
+        ensure_index(writer)
+        writer.close()
+        connection=sqlite3.connect('file:%s?mode=ro' % (path), uri=True)
+    connection.create_function('distance_km', 4, lambda lat1, long1, lat2, long2:
+                               haversine_km(to_float(lat1), to_float(long1), lat2, long2), deterministic=True)
+    return(connection)
+
+def find_listings(connection: sqlite3.Connection, ids: list=None, zipcode: list=None, since: str=None,
+                  columns: list=None, limit: int=None, min_price: int=None, max_price: int=None,
+                  near: tuple=None, bbox: tuple=None) -> tuple:
+    """
+    Function that selects listings from the store through the query index. Location filters scan only
+    the grid cells covering the area, attribute filters use the price, date_posted and zipcode indexes
+
+    @param connection: output of open_readonly()
+    @param ids: posting IDs to return, None for any
+    @param zipcode: zipcodes to return, None for any
+    @param since: only listings posted on or after this ISO date or time
+    @param columns: columns to return, None for all
+    @param limit: maximum number of listings, newest first, or nearest first with near
+    @param min_price: minimum price
+    @param max_price: maximum price
+    @param near: (latitude, longitude, radius in km), adds the column distance_km
+    @param bbox: (south, west, north, east) in degrees
+    @returns: tuple of the list of column names and the list of row tuples
+    """
+    where, parameters=([], [])
+    if ids is not None:
+        where.append('i.posting_id IN (%s)' % (', '.join('?' * len(ids))))
+        parameters.extend([int(x) for x in ids])
+    if zipcode is not None:
+        where.append('i.zipcode IN (%s)' % (', '.join('?' * len(zipcode))))
+        parameters.extend([str(x) for x in zipcode])
+    if since is not None:
+        where.append('i.date_posted >= ?')
+        parameters.append(since)
+    if min_price is not None:
+        where.append('i.price >= ?')
+        parameters.append(min_price)
+    if max_price is not None:
+        where.append('i.price <= ?')
+        parameters.append(max_price)
+    box=None if bbox is None else tuple(bbox)
+    if near is not None:
+        around=bbox_around(*near)
+        box=around if box is None else (max(box[0], around[0]), max(box[1], around[1]),
+                                        min(box[2], around[2]), min(box[3], around[3]))
+    source, source_parameters=('listing_index i', [])
+    if box is not None:
+        south, west, north, east=box
+        ranges=cell_ranges(south, west, north, east) if south <= north and west <= east else []
+        if ranges:
+            # the cell ranges are joined in as a constant table, so each one is a single range scan of the
+            # covering cell index and the listing rows are only read for the final matches
+            source='(VALUES %s) AS cells CROSS JOIN listing_index i' % (', '.join(['(?, ?)'] * len(ranges)))
+            source_parameters=[x for cells in ranges for x in cells]
+            where.append('i.cell BETWEEN cells.column1 AND cells.column2')
+        else:
+            where.append('0')
+        where.append('i.latitude BETWEEN ? AND ? AND i.longitude BETWEEN ? AND ?')
+        parameters.extend([south, north, west, east])
+    select, select_parameters, order=('i.posting_id', [], 'posting_id DESC')
+    if near is not None:
+        # plain SQL arithmetic on the equirectangular projection around the center, which over a few
+        # kilometers is within a meter of the great circle distance
+        lat, long, radius=near
+        scale=math.cos(math.radians(lat))
+        select+=', (i.latitude - ?) * (i.latitude - ?) + (i.longitude - ?) * (i.longitude - ?) * ? AS squared_degrees'
+        select_parameters=[lat, lat, long, long, scale * scale]
+        where.append('squared_degrees <= ?')
+        parameters.append(math.degrees(radius / EARTH_RADIUS_KM) ** 2)
+        order='squared_degrees'
+    sql='SELECT %s FROM %s' % (select, source)
+    if where:
+        sql+=' WHERE ' + ' AND '.join(where)
+    sql+=' ORDER BY %s' % (order)
+    if limit is not None:
+        sql+=' LIMIT %d' % (limit)
+    columns=', '.join(['l."%s"' % (x) for x in columns]) if columns else 'l.*'
+    outer_parameters=[]
+    if near is not None:
+        columns+=', distance_km(l.latitude, l.longitude, ?, ?) AS distance_km'
+        outer_parameters=[near[0], near[1]]
+    sql='SELECT %s FROM (%s) m JOIN listings l ON l."index" = m.posting_id ORDER BY m.%s' % (columns, sql, order)
+    cursor=connection.execute(sql, outer_parameters + select_parameters + source_parameters + parameters)
+    return([x[0] for x in cursor.description], cursor.fetchall())
+
+def listing_history(connection: sqlite3.Connection, posting_ids: list) -> tuple:
+    """
+    Function that reads the changes delta sync recorded for listings
+
+    @param connection: output of open_readonly()
+    @param posting_ids: posting IDs to read the history of
+    @returns: tuple of the list of column names and the list of row tuples, oldest change first
+    """
+    columns=['posting_id', 'observed', 'field', 'old', 'new']
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'listing_history'").fetchone() is None:
+        return(columns, [])
+    rows=[]
+    ids=[int(x) for x in posting_ids]
+    for i in range(0, len(ids), 500):
+        batch=ids[i:i + 500]
+        rows+=connection.execute('SELECT %s FROM listing_history WHERE posting_id IN (%s)'
+                                 % (', '.join(columns), ', '.join('?' * len(batch))), batch).fetchall()
+    return(columns, sorted(rows, key=lambda x: (x[1], x[0])))
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(prog='CLscraper query', description='search the CLscraper listing database, results are printed as TSV')
+    parser.add_argument('base_path', type=str, nargs=1, help='base output path for files')
+    parser.add_argument('--ids', type=str, nargs='+', default=None, help='posting IDs to return')
+    parser.add_argument('--zipcode', type=str, nargs='+', default=None, help='zipcodes to return')
+    parser.add_argument('--since', type=str, default=None, help='only listings posted on or after this date, YYYY-MM-DD')
+    parser.add_argument('--columns', type=str, nargs='+', default=None, help='columns to print, default all')
+    parser.add_argument('--min-price', type=int, default=None, help='minimum price')
+    parser.add_argument('--max-price', type=int, default=None, help='maximum price')
+    parser.add_argument('--near', type=float, nargs=3, default=None, metavar=('LAT', 'LONG', 'KM'), help='only listings within KM kilometers of a point, nearest first')
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'), help='only listings inside a bounding box')
+    parser.add_argument('--limit', type=int, default=None, help='maximum number of listings, newest first')
+    parser.add_argument('--history', action='store_true', help='print the price and edit history of the listings found instead')
+    arguments=parser.parse_args(argv)
+    connection=open_readonly(store_path(arguments.base_path[0]))
+    columns, rows=find_listings(connection, arguments.ids, arguments.zipcode, arguments.since,
+                                ['index'] if arguments.history else arguments.columns,
+                                arguments.limit, arguments.min_price, arguments.max_price, arguments.near, arguments.bbox)
+    if arguments.history:
+        columns, rows=listing_history(connection, [row[0] for row in rows])
+    writer=csv.writer(sys.stdout, delimiter='\t', lineterminator='\n')
+    writer.writerow(columns)
+    writer.writerows(rows)
+    connection.close()
+    return()
@@ -0,0 +1,67 @@
+import pandas as pd
+
+from CLscraper.store import LISTING_COLUMNS
+
+class ListingRecord:
+    """
+    One parsed listing: the posting ID in 'index' and one attribute per column of the listings table.
+    'repost_of' is only set once the listing was checked against a RepostIndex. 'image_url', the post's
+    main image for alert emails, is carried along but never becomes a column
+    """
+    __slots__=('index',) + tuple(LISTING_COLUMNS) + ('repost_of', 'image_url')
+
+    def __init__(self, index, image_url: str=None, **fields):
+        self.index=index
+        self.image_url=image_url
+        for column in LISTING_COLUMNS:
+            setattr(self, column, fields.get(column))
+
+class ListingBatch:
+    """
+    Columnar builder of listing rows. Records are appended field by field to one list per column, and
+    the DataFrame is built once for the whole batch, with the columns of make_output() in the same order
+    """
+    def __init__(self):
+        self.index=[]
+        self.columns={column : [] for column in LISTING_COLUMNS}
+        self.repost_of=None
+
+    def append(self, record: ListingRecord) -> None:
+        if hasattr(record, 'repost_of'):
+            if self.repost_of is None:
+                self.repost_of=[None] * len(self.index)
+            self.repost_of.append(record.repost_of)
+        elif self.repost_of is not None:
+            self.repost_of.append(None)
+        self.index.append(record.index)
+        for column, values in self.columns.items():
+            values.append(getattr(record, column))
+
+    def __len__(self) -> int:
+        return(len(self.index))
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        @returns: pd.DataFrame with the posting ID as index, and a 'repost_of' column after the listing
+        columns when any record was checked for reposts
+        """
+        data=dict(self.columns)
+        if self.repost_of is not None:
+            data['repost_of']=self.repost_of
+        index=pd.Index(self.index)
+        # a column with missing values stays object dtype holding None, as concatenated one row frames were
+        data={column : pd.Series(values, index=index, dtype=object) if any(x is None for x in values) else values
+              for column, values in data.items()}
+        return(pd.DataFrame(data, index=index, columns=list(data)))
+
+def listings_frame(records) -> pd.DataFrame:
+    """
+    Function that builds one DataFrame from parsed listings, in place of concatenating one-row frames
+
+    @param records: iterable of ListingRecord
+    @returns: pd.DataFrame, see ListingBatch.to_frame()
+    """
+    batch=ListingBatch()
+    for record in records:
+        batch.append(record)
+    return(batch.to_frame())
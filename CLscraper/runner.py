@@ -0,0 +1,124 @@
+import json
+import logging
+
+from CLscraper.lib import *
+from CLscraper.searches import SEARCH_STEMS
+
+def load_searches(config_path: str=None, names: list=None) -> dict:
+    """
+    Function that reads the searches to run, from searches.py or from a JSON config file. The config maps
+    a search name to either a search stem URL, or to {"sites" : [...], "path" : "search/apa?..."} to run one
+    filter combination on several craigslist sites, named <name>_<site>
+
+    @param config_path: JSON config file, None to use searches.SEARCH_STEMS
+    @param names: names of the searches to keep, None for all
+    @returns: dict with search name as key and craigslist search stem URL as value
+    """
+    if config_path is None:
+        config=SEARCH_STEMS
+    else:
+        with open(config_path, 'r') as f:
+            config=json.load(f)
+    stems={}
+    for name, search in config.items():
+        if isinstance(search, str):
+            stems[name]=search
+        else:
+            for site in search['sites']:
+                stems[name + '_' + site]='https://%s.craigslist.org/%s' % (site, search['path'].lstrip('/'))
+    if names is not None:
+        missing=[x for x in names if x not in stems]
+        if missing:
+            raise KeyError('unknown searches %s' % (', '.join(missing)))
+        stems={name : stems[name] for name in names}
+    return(stems)
+
+def first_pages(stems: dict) -> dict:
+    """
+    Function that fetches the first results page of every search in one concurrent batch
+
+    @param stems: dict with search name as key and craigslist search stem URL as value
+    @returns: dict with search name as key and BeautifulSoup object as value, searches that failed are dropped
+    """
+    pages=scrape_data(list(stems.values()))
+    soups={}
+    for name, stem in stems.items():
+        if stem in pages:
+            soups[name]=pages[stem]
+        else:
+            logging.info('first results page of %s could not be fetched, search skipped' % (name))
+    return(soups)
+
+def walk_incremental(soups: dict, additional: dict, database, known_run: int) -> dict:
+    """
+    Function that paginates several newest-first searches in lockstep: each round fetches the next page of
+    every search that has not reached known listings yet, in one concurrent batch
+
+    @param soups: dict with search name as key and BeautifulSoup object of its first page as value
+    @param additional: dict with search name as key and output of generate_search_urls() as value
+    @param database: a SeenIndex of all CL post ids in the database
+    @param known_run: number of consecutive known listings that ends pagination
+    @returns: dict with search name as key and dict of the extra pages fetched (URL to BeautifulSoup) as value
+    """
+    walking={name : {'soup' : soup, 'urls' : list(additional[name]), 'run' : 0} for name, soup in soups.items()}
+    pages={name : {} for name in soups}
+    while walking:
+        batch={}
+        for name, state in list(walking.items()):
+            done, state['run']=pagination_done(state['soup'], database, state['run'], known_run)
+            if done or len(state['urls']) == 0:
+                if done:
+                    logging.info('stopping pagination of %s, %s consecutive known listings' % (name, state['run']))
+                del walking[name]
+                continue
+            batch[name]=state['urls'].pop(0)
+        fetched=scrape_data(list(batch.values()))
+        for name, url in batch.items():
+            if url not in fetched:
+                del walking[name]
+                continue
+            pages[name][url]=fetched[url]
+            walking[name]['soup']=fetched[url]
+    return(pages)
+
+def search_all(stems: dict, database, incremental: bool=False, known_run: int=None, store=None,
+               metadata: dict=None) -> dict:
+    """
+    Function that runs many searches together. Search pages of all searches are fetched in shared concurrent
+    batches (identical pages once), and a posting returned by several searches is only scraped once
+
+    @param stems: dict with search name as key and craigslist search stem URL as value
+    @param database: a SeenIndex of all CL post ids in the database, new ids are claimed in it
+    @param incremental: for newest-first searches, stop paginating once results are all known
+    @param known_run: number of consecutive known listings that ends incremental pagination
+    @param store: listing store connection used to record the per-stem high-water marks, optional
+    @param metadata: dict filled with the listing details of every search page fetched, see page_metadata(), optional
+    @returns: dict with new posting URL as key and the list of names of the searches that returned it as value
+    """
+    if not isinstance(database, SeenIndex):
+        database=SeenIndex(lambda ids=database: ids)
+    soups=first_pages(stems)
+    additional={name : generate_search_urls(stems[name], int(get_first(soup.findAll('span', {'class' : 'total'}))))
+                for name, soup in soups.items()}
+    if incremental:
+        pages=walk_incremental(soups, additional, database, known_run)
+    else:
+        fetched=scrape_data([url for urls in additional.values() for url in urls])
+        pages={name : {url : fetched[url] for url in urls if url in fetched} for name, urls in additional.items()}
+    found={}
+    for name, soup in soups.items():
+        listing_dict=extract_links([soup] + list(pages[name].values()))
+        if metadata is not None:
+            for page in [soup] + list(pages[name].values()):
+                metadata.update(page_metadata(page))
+        record_high_water_mark(store, stems[name], listing_dict)
+        found[name]=listing_dict
+    # every search is checked against the database as it was before this run, then the new ids are claimed
+    new={}
+    for name, listing_dict in found.items():
+        for key, url in listing_dict.items():
+            if int(key) not in database:
+                new.setdefault(key, (url, []))[1].append(name)
+    database.update(list(new))
+    logging.info('%s new listings over %s searches' % (len(new), len(soups)))
+    return({url : names for url, names in new.values()})
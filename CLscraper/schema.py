@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import re
+
+# version of the typed listing layout below. Stores record the version they were written with in their meta
+# table, and are rewritten by store.migrate_schema() when it is older
+SCHEMA_VERSION=1
+
+# typed columns of the listings table, in order after the posting ID column 'index': pandas dtype in memory
+# (None keeps free text as it is) and SQLite column type on disk
+LISTING_SCHEMA={'url' : (None, 'TEXT'),
+                'price' : ('Int32', 'INTEGER'),
+                'date_available' : ('datetime64[ns]', 'TEXT'),
+                'beds' : ('Int8', 'INTEGER'),
+                'baths' : ('Float32', 'REAL'),
+                'sqft' : ('Int32', 'INTEGER'),
+                'sqft_estimated' : ('boolean', 'INTEGER'),
+                'num_images' : ('Int16', 'INTEGER'),
+                'dog' : ('category', 'TEXT'),
+                'dog_text' : (None, 'TEXT'),
+                'scam' : ('boolean', 'INTEGER'),
+                'property_management' : (None, 'TEXT'),
+                'angry_score' : ('Int16', 'INTEGER'),
+                'emoji' : ('Int16', 'INTEGER'),
+                'word_length' : ('Int32', 'INTEGER'),
+                'address' : (None, 'TEXT'),
+                'snippet' : (None, 'TEXT'),
+                'zipcode' : ('category', 'TEXT'),
+                'neighborhood' : ('category', 'TEXT'),
+                'locality' : ('category', 'TEXT'),
+                'date_posted' : ('datetime64[ns]', 'TEXT'),
+                'date_updated' : ('datetime64[ns]', 'TEXT'),
+                'latitude' : ('float32', 'REAL'),
+                'longitude' : ('float32', 'REAL')}
+
+# dog_from_text() answers, anything else is the sentence of the post that mentions pets
+DOG_VALUES=['yes', 'no', 'unknown', 'mentioned']
+NUMBER_PATTERN=r'(-?\d[\d,]*(?:\.\d+)?)'
+DATE_PATTERN=r'^\d{4}-\d{2}-\d{2}'
+BEDS_PATTERN=r'(\d+)\s*br'
+BATHS_PATTERN=r'(\d+(?:\.\d+)?)\s*ba'
+AVAILABLE_PATTERN=re.compile(r'^\s*available\s*', re.IGNORECASE)
+
+def text_values(series: pd.Series) -> pd.Series:
+    """
+    @returns: series as an object series of strings, with missing values as None
+    """
+    return(series.astype('string').astype(object).where(series.notnull(), None))
+
+def to_number(series: pd.Series) -> pd.Series:
+    """
+    Function that reads numbers scraped as text, e.g. '$2,450' or '1200(estimated)', the first number wins
+
+    @param series: pd.Series of text or numbers
+    @returns: pd.Series of float64, NaN where there is no number
+    """
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        series=text_values(series).str.extract(NUMBER_PATTERN, expand=False).str.replace(',', '', regex=False).astype(object)
+    series=pd.to_numeric(series, errors='coerce').astype('Float64')
+    return(pd.Series(series.to_numpy(dtype='float64', na_value=np.nan), index=series.index))
+
+def to_integer(series: pd.Series, dtype: str) -> pd.Series:
+    return(to_number(series).round().astype(dtype))
+
+def to_boolean(series: pd.Series) -> pd.Series:
+    """
+    @param series: pd.Series of booleans, 0/1 or 'True'/'False' text
+    @returns: pd.Series of nullable booleans
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return(series.astype('boolean'))
+    values={'true' : True, '1' : True, '1.0' : True, 'false' : False, '0' : False, '0.0' : False}
+    return(text_values(series).str.lower().map(values).astype('boolean'))
+
+def to_datetime(series: pd.Series) -> pd.Series:
+    """
+    Function that reads dates and times written as YYYY-MM-DD or YYYY-MM-DD[T ]HH:MM:SS, any time zone offset
+    is dropped (times stay craigslist local time). The date and the time of day are read with fixed formats,
+    so a column mixing both is parsed in one vectorized pass
+
+    @param series: pd.Series of ISO 8601 text or datetimes
+    @returns: pd.Series of datetime64, NaT where there is no date
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return(series.dt.tz_localize(None) if series.dt.tz is not None else series)
+    text=text_values(series)
+    day=text.str.slice(0, 10).where(text.str.match(DATE_PATTERN, na=False))
+    day=pd.to_datetime(day.astype(object), format='%Y-%m-%d', errors='coerce')
+    clock=text.str.slice(11, 19).where(text.str.len().fillna(0) >= 19).astype(object)
+    return(day + pd.to_timedelta(clock, errors='coerce').fillna(pd.Timedelta(0)))
+
+def available_dates(series: pd.Series, posted: pd.Series) -> pd.Series:
+    """
+    Function that reads the move-in date craigslist shows as 'available nov 15' or 'available now'. The year
+    is the posting year, or the next one when the date would fall well before the post
+
+    @param series: pd.Series of date_available text or datetimes
+    @param posted: pd.Series of posting datetimes, output of to_datetime()
+    @returns: pd.Series of datetime64, NaT where there is no date
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return(series)
+    text=text_values(series).str.replace(AVAILABLE_PATTERN, '', regex=True).str.strip().str.lower()
+    iso=to_datetime(text)
+    day=text.str.slice(0, 3) + ' ' + text.str.extract(r'(\d+)', expand=False) + ' ' + posted.dt.strftime('%Y')
+    dates=pd.to_datetime(day.astype(object), format='%b %d %Y', errors='coerce')
+    dates=dates.where(~(dates < posted - pd.Timedelta(days=60)), dates + pd.DateOffset(years=1))
+    dates=dates.where(text != 'now', posted.dt.normalize())
+    return(iso.where(iso.notnull(), dates))
+
+def to_category(series: pd.Series) -> pd.Series:
+    """
+    @returns: series as a categorical of text, numbers read back from a TSV file (97202.0) lose their '.0'
+    """
+    return(text_values(series).str.replace(r'\.0$', '', regex=True).astype('category'))
+
+def normalize_listings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function that converts a batch of listings to the typed layout of LISTING_SCHEMA with vectorized column
+    operations: integer price, numeric sqft with an estimated flag, beds and baths out of bed_bath, datetimes,
+    float32 coordinates, and categoricals for the low cardinality text columns. It takes listings as parsed
+    (listings_frame()), from the old TSV database or read back from the store, and returns a frame already in
+    the current layout unchanged
+
+    @param df: pd.DataFrame of listings with the posting ID in column 'index'
+    @returns: pd.DataFrame with 'index', the LISTING_SCHEMA columns in order and any other columns after them,
+    with attrs['schema_version'] set
+    """
+    if df.attrs.get('schema_version') == SCHEMA_VERSION:
+        return(df)
+    df=df.copy()
+    if 'bed_bath' in df.columns:
+        size=text_values(df['bed_bath']).str.lower()
+        df['beds']=size.str.extract(BEDS_PATTERN, expand=False)
+        df['baths']=size.str.extract(BATHS_PATTERN, expand=False)
+        df=df.drop(columns=['bed_bath'])
+    if 'sqft_estimated' not in df.columns and 'sqft' in df.columns:
+        sqft=text_values(df['sqft'])
+        df['sqft_estimated']=sqft.str.contains('estimated', regex=False).where(sqft.notnull())
+    if 'dog_text' not in df.columns and 'dog' in df.columns:
+        dog=text_values(df['dog'])
+        mentioned=dog.notnull() & ~dog.isin(DOG_VALUES)
+        df['dog_text']=dog.where(mentioned, None)
+        df['dog']=dog.where(~mentioned, 'mentioned')
+    for column, (dtype, sql_type) in LISTING_SCHEMA.items():
+        if column not in df.columns:
+            df[column]=None
+        if dtype is None:
+            continue
+        if dtype.startswith('Int'):
+            df[column]=to_integer(df[column], dtype)
+        elif dtype in ('Float32', 'float32'):
+            df[column]=to_number(df[column]).astype(dtype)
+        elif dtype == 'boolean':
+            df[column]=to_boolean(df[column])
+        elif dtype == 'category':
+            df[column]=to_category(df[column])
+        elif column != 'date_available':
+            df[column]=to_datetime(df[column])
+    df['date_available']=available_dates(df['date_available'], df['date_posted'])
+    df['dog']=df['dog'].cat.set_categories(DOG_VALUES)
+    df['index']=pd.to_numeric(df['index']).astype('int64')
+    columns=['index'] + list(LISTING_SCHEMA)
+    df=df[columns + [x for x in df.columns if x not in columns]]
+    df.attrs['schema_version']=SCHEMA_VERSION
+    return(df)
+
+def schema_columns() -> str:
+    """
+    @returns: SQL column definitions of the listings table, posting ID first
+    """
+    return(', '.join(['"index" INTEGER PRIMARY KEY'] + ['"%s" %s' % (column, sql_type)
+                                                         for column, (dtype, sql_type) in LISTING_SCHEMA.items()]))
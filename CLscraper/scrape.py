@@ -0,0 +1,285 @@
+import argparse
+import logging
+import time
+
+from CLscraper.archive import PostArchive, pack_directory
+from CLscraper.cache import CACHE_CONFIG, configure_cache
+from CLscraper.dedup import RepostIndex
+from CLscraper.extract import parse_pages
+from CLscraper.fetch import FETCH_CONFIG, configure_fetch, fetch_pages
+from CLscraper.geocache import GEOCODE_CONFIG, GEOCODE_STATS, configure_geocode
+from CLscraper.journal import RunJournal
+from CLscraper.media import MEDIA_CONFIG, configure_media, fetch_listing_media
+from CLscraper.metrics import count, reset_metrics, run_summary, set_count, stage, write_prometheus, write_summary
+from CLscraper.helpers import *
+from CLscraper.lib import *
+from CLscraper.maps import *
+from CLscraper.email import *
+from CLscraper.pipeline import PIPELINE_CONFIG, configure_pipeline, stream_listings
+from CLscraper.records import listings_frame
+from CLscraper.runner import load_searches, search_all
+from CLscraper.schema import normalize_listings
+from CLscraper.seen import SeenIndex
+from CLscraper.session import HTTP_CONFIG, configure_http
+from CLscraper.store import append_listings, changed_listings, count_listings, sync_baseline, update_listings
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Function that adds the command line arguments shared by one-shot runs and the serve daemon
+
+    @param parser: argparse.ArgumentParser
+    @returns: None
+    """
+    parser.add_argument('base_path', type=str, nargs=1, help='base output path for files')
+    parser.add_argument('api', type=str, nargs=1, help='path to file with Google maps API key')
+    parser.add_argument('mailto', type=str, nargs=1, help='email address to send alters to')
+    parser.add_argument('gmail_creds', type=str, nargs=1, help='path to Gmail token json file')
+    parser.add_argument('--searches', type=str, nargs='+', default=None, help='names of the searches to run, default all')
+    parser.add_argument('--searches-file', type=str, default=None, help='JSON file of searches to run instead of those in searches.py')
+    parser.add_argument('--concurrency', type=int, default=FETCH_CONFIG['concurrency'], help='maximum number of craigslist requests in flight')
+    parser.add_argument('--host-concurrency', type=int, default=FETCH_CONFIG['host_concurrency'], help='maximum number of requests in flight to one craigslist site')
+    parser.add_argument('--rate', type=float, default=FETCH_CONFIG['rate'], help='maximum craigslist requests per second, per host')
+    parser.add_argument('--timeout', type=float, default=HTTP_CONFIG['timeout'], help='HTTP request timeout in seconds')
+    parser.add_argument('--pool-size', type=int, default=HTTP_CONFIG['pool_size'], help='keep-alive connections kept open per host')
+    parser.add_argument('--search-ttl', type=float, default=CACHE_CONFIG['search_ttl'], help='seconds a cached search page is reused without revalidating it, for quick re-runs (default 0)')
+    parser.add_argument('--replay', action='store_true', help='re-run the parse pipeline from cached pages only, without network access')
+    parser.add_argument('--incremental', action='store_true', help='stop paginating newest-first searches once results are already in the database')
+    parser.add_argument('--known-run', type=int, default=None, help='with --incremental, also stop after this many consecutive known listings')
+    parser.add_argument('--delta-sync', action='store_true', help='re-fetch known listings whose price or date changed on the search pages, and record the changes')
+    parser.add_argument('--bloom', action='store_true', help='keep a Bloom filter of seen posting IDs on disk, so the full ID set is only loaded when needed')
+    parser.add_argument('--pack-post-text', action='store_true', help='move existing post_text/*.txt files into the packed post archive')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes used to parse posts')
+    parser.add_argument('--queue-size', type=int, default=PIPELINE_CONFIG['queue_size'], help='posts waiting between two stages of the streaming pipeline')
+    parser.add_argument('--geocode-precision', type=int, default=GEOCODE_CONFIG['precision'], help='decimal places coordinates are rounded to for the geocode cache')
+    parser.add_argument('--geocode-ttl', type=float, default=GEOCODE_CONFIG['ttl'] / 86400, help='days a cached geocode result stays valid')
+    parser.add_argument('--no-repost-check', action='store_true', help='do not look for reposts of earlier listings')
+    parser.add_argument('--repost-threshold', type=float, default=0.8, help='estimated text similarity above which a post is a repost')
+    parser.add_argument('--skip-repost-geocode', action='store_true', help='do not geocode reposts, they are never alerted on')
+    parser.add_argument('--max-email-bytes', type=int, default=EMAIL_CONFIG['max_bytes'], help='size bound of one alert email, larger alerts are split into digests')
+    parser.add_argument('--email-dir', type=str, default=None, help='write alert emails as .eml files to this directory instead of sending them')
+    parser.add_argument('--metrics', type=str, default=None, help='file path of the JSON run summary, by default next to the run log')
+    parser.add_argument('--prometheus-textfile', type=str, default=None, help='also write run metrics to this .prom file for the node exporter textfile collector')
+
+def setup_run(arguments) -> dict:
+    """
+    Function that configures the package from the command line and opens the listing store
+
+    @param arguments: parsed command line, see add_run_arguments()
+    @returns: dict with everything a scrape needs: api_key, mailto, gmail_creds, transport, archive, DB, database,
+    reposts, journal, database_file, metrics_file and the parsed arguments
+    """
+    base_path=arguments.base_path[0]
+    EMAIL_CONFIG['max_bytes']=arguments.max_email_bytes
+    configure_fetch(concurrency=arguments.concurrency, host_concurrency=arguments.host_concurrency, rate=arguments.rate)
+    configure_http(timeout=arguments.timeout, pool_size=max(arguments.pool_size, arguments.concurrency))
+    configure_pipeline(queue_size=arguments.queue_size)
+    reset_metrics()
+
+    # set api key as global variable
+    with open(arguments.api[0], 'r') as file:
+        api_key=file.read().rstrip()
+
+    # first check if requires directories are present, if not, create
+    log_path, database_path, file_path, cache_path, media_path=create_paths(base_path)
+    configure_media(path=media_path)
+    archive=PostArchive(os.path.join(file_path, 'archive'))
+    configure_cache(path=cache_path, replay=arguments.replay, search_ttl=arguments.search_ttl)
+    configure_geocode(path=os.path.join(database_path, 'geocode.sqlite'), precision=arguments.geocode_precision,
+                      ttl=arguments.geocode_ttl * 86400)
+    # set up logging
+    curr_time=datetime.datetime.today().strftime("%d%m%Y_%H:%M")
+    logging.basicConfig(filename=os.path.join(log_path, curr_time + '.log.txt'), format='%(message)s    %(asctime)s',
+                   level=logging.INFO, filemode='w')
+    # one-time migration of the old one-file-per-post text directory
+    if arguments.pack_post_text:
+        pack_directory(archive, file_path, remove=True)
+
+    # open the listing store, importing the old TSV database the first time
+    database_file=os.path.join(database_path, 'CL_database.main.txt')
+    bloom_path=os.path.join(database_path, 'seen.bloom') if arguments.bloom else None
+    DB, database=check_database(os.path.join(database_path, 'CL_database.sqlite'), database_file, bloom_path)
+
+    logging.info('Database currently contains %s listings' % (count_listings(DB)))
+    # near-duplicate index of every post body seen, to recognize reposts under a new posting ID
+    reposts=None
+    if not (arguments.no_repost_check or arguments.replay):
+        reposts=RepostIndex(os.path.join(database_path, 'reposts.sqlite'), threshold=arguments.repost_threshold)
+    # in replay mode every cached listing is re-extracted, and no geocoding is done
+    if arguments.replay:
+        database=SeenIndex()
+        api_key=None
+    return({'arguments' : arguments,
+            'api_key' : api_key,
+            'mailto' : arguments.mailto[0],
+            'gmail_creds' : arguments.gmail_creds[0],
+            'transport' : GmailTransport(arguments.gmail_creds[0]) if arguments.email_dir is None else LocalTransport(arguments.email_dir),
+            'archive' : archive,
+            'DB' : DB,
+            'database' : database,
+            'reposts' : reposts,
+            'journal' : None if arguments.replay else RunJournal(os.path.join(database_path, 'journal.sqlite')),
+            'database_file' : database_file,
+            'metrics_file' : arguments.metrics or os.path.join(log_path, curr_time + '.metrics.json')})
+
+def sync_changes(run: dict, metadata: dict) -> int:
+    """
+    Function that re-fetches and re-parses the stored listings whose search page details changed, and
+    writes the new values to the store with a history of every changed field
+
+    @param run: output of setup_run()
+    @param metadata: dict with posting ID as key and page_metadata() values as value, from search_all()
+    @returns: number of listings re-fetched
+    """
+    changed=changed_listings(run['DB'], metadata)
+    logging.info('%s known listings changed on the search pages' % (len(changed)))
+    if len(changed) == 0:
+        return(0)
+    count('delta_refetched', len(changed))
+    with stage('delta_sync'):
+        pages=fetch_pages([metadata[str(x)]['url'] for x in changed], revalidate=True)
+        outlist, fails=parse_pages(pages, run['archive'], run['api_key'], run['arguments'].workers, replace_text=True)
+        if outlist:
+            fields=update_listings(run['DB'], normalize_listings(listings_frame(outlist).reset_index()), metadata)
+            logging.info('%s listings re-parsed, %s changed fields recorded, %s failed' % (len(outlist), fields, fails))
+        # a post that is gone or no longer parses keeps its stored row, but its details become the baseline
+        # too, so it is not re-fetched on every run
+        reparsed={int(record.index) for record in outlist if record.index is not None}
+        sync_baseline(run['DB'], metadata, [x for x in changed if int(x) not in reparsed])
+    return(len(changed))
+
+def scrape_searches(run: dict, stems: dict) -> dict:
+    """
+    Function that runs the scrape pipeline once over a set of searches: search pages, new posts, parsing and
+    geocoding, spam filter, email alert and database append. Listings are tagged with the names of the
+    searches that returned them in the column 'search'
+
+    Progress is checkpointed in the run journal: when the previous run crashed, its searches are not run
+    again, its parsed listings are reused and only the posts it had not parsed yet are fetched again, and
+    listings it already emailed are not emailed again
+
+    With --delta-sync, known listings whose details changed on the search pages are updated first
+
+    @param run: output of setup_run()
+    @param stems: dict with search name as key and craigslist search stem URL as value, see runner.load_searches()
+    @returns: dict of run figures: new (posting URLs found), listings, failed, alerts and changed
+    """
+    arguments=run['arguments']
+    database=run['database']
+    journal=run['journal']
+    changed=0
+    if journal is not None and journal.pending():
+        tags=journal.get('tags')
+        logging.info('resuming the run started %s, %s listings' % (time.ctime(journal.get('started')), len(tags)))
+        # claim the listings of the resumed run, as search_all() did when it first ran
+        database.update([url.split('/')[-1].split('.')[0] for url in tags])
+    else:
+        # get urls from all posts that match our critera, then subset to those that aren't in our database
+        metadata={} if arguments.delta_sync and not arguments.replay else None
+        with stage('search'):
+            tags=search_all(stems, database, arguments.incremental, arguments.known_run, run['DB'], metadata)
+        if metadata:
+            changed=sync_changes(run, metadata)
+        if journal is not None and len(tags) > 0:
+            journal.start(tags)
+    recent_urls=list(tags)
+
+    logging.info("scraping %s links" % (len(recent_urls)))
+    if len(recent_urls) == 0:
+        return({'new' : 0, 'listings' : 0, 'failed' : 0, 'alerts' : 0, 'changed' : changed})
+
+    # fetch, parse, geocode and fetch alert media of new posts as one streaming pipeline, every listing is
+    # journaled as it comes out, post bodies go to the packed archive
+    outlist=journal.listings() if journal is not None else []
+    parsed={record.url for record in outlist}
+    figures, media, pending={}, {}, []
+    with stage('pipeline'):
+        for record, images in stream_listings([url for url in recent_urls if url not in parsed], run['archive'],
+                                              run['api_key'], arguments.workers, run['reposts'],
+                                              arguments.skip_repost_geocode, not arguments.replay, figures):
+            outlist.append(record)
+            # with the media cache on, images are read back from disk when the alert is built instead of
+            # being held in memory until then
+            if images is not None and MEDIA_CONFIG['path'] is None:
+                media[str(record.index)]=images
+            if journal is not None:
+                pending.append(record)
+                if len(pending) >= PIPELINE_CONFIG['geocode_batch']:
+                    journal.add_listings(pending)
+                    pending=[]
+        if pending:
+            journal.add_listings(pending)
+    fails=figures['failed']
+    order={url : i for i, url in enumerate(recent_urls)}
+    outlist.sort(key=lambda record: order.get(record.url, len(order)))
+    if len(outlist) == 0:
+        logging.info("no listings parsed, %s listings failed" % (fails))
+        if journal is not None:
+            journal.clear()
+        return({'new' : len(recent_urls), 'listings' : 0, 'failed' : fails, 'alerts' : 0, 'changed' : changed})
+
+    # make dataframe in the typed layout of the store, combine with current database
+    out=normalize_listings(listings_frame(outlist).reset_index())
+    out['search']=[','.join(tags.get(url, [])) for url in out['url']]
+    # filter spam and reposts, and send email alert
+    clean=filter_spam(out)
+    print("%s non-spam postings" % (len(clean)))
+    database_file=run['database_file']
+    if arguments.replay:
+        replay_file=database_file.replace('main', 'replay_' + str(datetime.date.today()))
+        out.to_csv(replay_file, sep='\t', index=False)
+        logging.info("%s listings re-extracted from cache to %s, %s listings failed" % (len(out), replay_file, fails))
+        return({'new' : len(recent_urls), 'listings' : len(out), 'failed' : fails, 'alerts' : 0, 'changed' : changed})
+    # listings emailed before a crash are left out
+    check_unconfirmed(run['transport'], journal)
+    clean=clean[~clean['index'].astype(str).isin(journal.emailed())]
+    with stage('media'):
+        # from the media cache, or fetched for listings resumed from the journal
+        alerted=set(clean['index'].astype(str))
+        missing=[x for x in outlist if str(x.index) in alerted and str(x.index) not in media]
+        fetched=fetch_listing_media([(x.latitude, x.longitude, getattr(x, 'image_url', None)) for x in missing], run['api_key'])
+        media.update({str(x.index) : images for x, images in zip(missing, fetched)})
+        email_dict=media_email_dict(clean, media)
+    print(len(email_dict))
+    if len(email_dict) > 0:
+        with stage('email'):
+            posting_ids={make_post_text(row) : str(row['index']) for i, row in clean.iterrows()}
+            send_alerts(run['transport'], 'me', run['mailto'], 'Housing Email Alert', email_dict, posting_ids, journal)
+    try:
+        with stage('database'):
+            append_listings(run['DB'], out)
+            save_seen(run['DB'], database)
+    except Exception:
+        logging.info('database append failed, writing new data to %s' % (database_file.replace('main', str(datetime.date.today()))))
+        out.to_csv(database_file.replace('main', str(datetime.date.today())), sep='\t', index=False)
+    journal.clear()
+    logging.info("%s listings added to database, %s listings failed" % (len(out), fails))
+    logging.info("geocode cache: %(hits)s hits, %(misses)s API calls, %(deduped)s duplicate locations in batch" % (GEOCODE_STATS))
+    return({'new' : len(recent_urls), 'listings' : len(out), 'failed' : fails, 'alerts' : len(email_dict), 'changed' : changed})
+
+def report_metrics(run: dict, figures: dict) -> None:
+    """
+    Function that writes the run summary, and the Prometheus textfile when requested
+
+    @param run: output of setup_run()
+    @param figures: run level figures, e.g. the output of scrape_searches()
+    @returns: None
+    """
+    for key, value in GEOCODE_STATS.items():
+        set_count('geocode_' + key, value)
+    summary=run_summary(figures)
+    write_summary(run['metrics_file'], summary)
+    if run['arguments'].prometheus_textfile is not None:
+        write_prometheus(run['arguments'].prometheus_textfile, summary)
+    logging.info('run metrics written to %s' % (run['metrics_file']))
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(prog='CLscraper scrape', description='CLscraper, runs every search once')
+    add_run_arguments(parser)
+    arguments=parser.parse_args(argv)
+    run=setup_run(arguments)
+
+    # craigslist search stem URLs from searches.py or the --searches-file config
+    stems=load_searches(arguments.searches_file, arguments.searches)
+    figures=scrape_searches(run, stems)
+    report_metrics(run, figures)
+    return()
@@ -0,0 +1,112 @@
+import hashlib
+import math
+import os
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over integer posting IDs, stored as a bytearray so it can be saved to and
+    loaded from disk without loading the full set of IDs
+    """
+    def __init__(self, capacity: int=1000000, error_rate: float=0.01, bits: bytearray=None):
+        self.size=int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes=max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits=bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.size=len(self.bits) * 8
+
+    def positions(self, posting_id: int) -> list:
+        digest=hashlib.blake2b(str(posting_id).encode('ascii'), digest_size=16).digest()
+        h1=int.from_bytes(digest[:8], 'little')
+        h2=int.from_bytes(digest[8:], 'little') | 1
+        return([(h1 + i * h2) % self.size for i in range(self.hashes)])
+
+    def add(self, posting_id: int) -> None:
+        for p in self.positions(posting_id):
+            self.bits[p >> 3]|=1 << (p & 7)
+
+    def __contains__(self, posting_id: int) -> bool:
+        return(all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(posting_id)))
+
+    def save(self, path: str) -> None:
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.bits)
+        os.replace(path + '.tmp', path)
+
+class SeenIndex:
+    """
+    Set of every posting ID already in the database or already claimed by a search in this run, with O(1)
+    membership. The IDs are loaded lazily on first use. With a bloom_path, a persisted Bloom filter answers
+    for IDs that were never seen, so the full set is only loaded once a known ID shows up
+    """
+    def __init__(self, loader=None, bloom_path: str=None):
+        self.loader=loader
+        self.ids=None if loader is not None else set()
+        self.bloom_path=bloom_path
+        self.bloom=None
+        self.pending=set()
+        self.claimed=set()
+        if bloom_path is not None and os.path.exists(bloom_path):
+            with open(bloom_path, 'rb') as f:
+                self.bloom=BloomFilter(bits=bytearray(f.read()))
+
+    def load(self) -> set:
+        """
+        Load the IDs from the loader the first time they are needed, IDs added before that are kept
+        """
+        if self.ids is None:
+            self.ids=set(int(x) for x in self.loader())
+            self.ids.update(self.pending)
+            self.pending=set()
+            if self.bloom_path is not None and self.bloom is None:
+                self.bloom=BloomFilter()
+                for posting_id in self.ids:
+                    self.bloom.add(posting_id)
+        return(self.ids)
+
+    def __contains__(self, posting_id) -> bool:
+        posting_id=int(posting_id)
+        if posting_id in self.pending:
+            return(True)
+        if self.ids is None and self.bloom is not None and posting_id not in self.bloom:
+            return(False)
+        return(posting_id in self.load())
+
+    def __len__(self) -> int:
+        return(len(self.load()))
+
+    def add(self, posting_id) -> None:
+        posting_id=int(posting_id)
+        self.claimed.add(posting_id)
+        if self.ids is None:
+            self.pending.add(posting_id)
+        else:
+            self.ids.add(posting_id)
+        if self.bloom is not None:
+            self.bloom.add(posting_id)
+
+    def update(self, posting_ids) -> None:
+        for posting_id in posting_ids:
+            self.add(posting_id)
+
+    def discard(self, posting_id) -> None:
+        """
+        Forget a claimed posting ID, e.g. one whose post never reached the database. The Bloom filter cannot
+        forget it, which only costs a lookup in the full set
+        """
+        posting_id=int(posting_id)
+        self.pending.discard(posting_id)
+        if self.ids is not None:
+            self.ids.discard(posting_id)
+
+    def take_claims(self) -> set:
+        """
+        @returns: set of the posting IDs added since the last call
+        """
+        claimed, self.claimed=(self.claimed, set())
+        return(claimed)
+
+    def save(self) -> None:
+        """
+        Persist the Bloom filter, if one is configured
+        """
+        if self.bloom_path is not None and self.bloom is not None:
+            self.bloom.save(self.bloom_path)
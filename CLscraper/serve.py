@@ -0,0 +1,198 @@
+import argparse
+import collections
+import logging
+import signal
+import time
+
+from CLscraper.helpers import save_seen
+from CLscraper.metrics import request_count
+from CLscraper.runner import load_searches
+from CLscraper.scrape import add_run_arguments, report_metrics, scrape_searches, setup_run
+from CLscraper.store import read_rows
+
+# default polling settings, overridden from the command line with configure_serve()
+SERVE_CONFIG={'min_interval' : 120,
+              'max_interval' : 3600,
+              'initial_interval' : 600,
+              'target_new' : 3,
+              'smoothing' : 0.3,
+              'budget' : 600}
+
+class SearchSchedule:
+    """
+    Polling state of one search. The interval follows the rate new listings appear at: it is set so that,
+    on average, a poll finds target_new listings, clamped to [min_interval, max_interval]. A search that
+    comes back empty has its interval doubled, so quiet searches back off quickly
+    """
+    def __init__(self, name: str, stem: str):
+        self.name=name
+        self.stem=stem
+        self.interval=float(SERVE_CONFIG['initial_interval'])
+        self.next_poll=time.monotonic()
+        self.last_poll=None
+        # new listings per second and requests per poll, exponentially smoothed
+        self.rate=None
+        self.cost=None
+
+    def update(self, now: float, new: int, requests: int) -> None:
+        """
+        Update the smoothed rate and request cost after a poll, and pick the next interval
+
+        @param now: time.monotonic() at the end of the poll
+        @param new: number of new listings the poll found
+        @param requests: number of HTTP requests the poll made
+        @returns: None
+        """
+        alpha=SERVE_CONFIG['smoothing']
+        self.cost=requests if self.cost is None else alpha * requests + (1 - alpha) * self.cost
+        # the first poll picks up the backlog of the search, so it says nothing about the rate
+        if self.last_poll is not None:
+            rate=new / max(now - self.last_poll, 1.0)
+            self.rate=rate if self.rate is None else alpha * rate + (1 - alpha) * self.rate
+            if new == 0:
+                self.interval*=2
+            elif self.rate > 0:
+                self.interval=SERVE_CONFIG['target_new'] / self.rate
+        self.interval=min(SERVE_CONFIG['max_interval'], max(SERVE_CONFIG['min_interval'], self.interval))
+        self.last_poll=now
+
+class RequestBudget:
+    """
+    Sliding one hour window of the HTTP requests made by the daemon
+    """
+    def __init__(self, per_hour: int):
+        self.per_hour=per_hour
+        self.window=collections.deque()
+        self.spent=0
+
+    def record(self, now: float, requests: int) -> None:
+        self.window.append((now, requests))
+        self.spent+=requests
+
+    def expire(self, now: float) -> None:
+        while self.window and self.window[0][0] <= now - 3600:
+            self.spent-=self.window.popleft()[1]
+
+    def wait_time(self, now: float, cost: float) -> float:
+        """
+        @param now: time.monotonic()
+        @param cost: expected number of requests of the next poll
+        @returns: seconds until the window has room for cost more requests
+        """
+        self.expire(now)
+        if self.spent + cost <= self.per_hour:
+            return(0.0)
+        spent=self.spent
+        for start, requests in self.window:
+            spent-=requests
+            if spent + cost <= self.per_hour:
+                return(start + 3600 - now)
+        # a single poll costs more than the whole budget, run it once the window is empty
+        if not self.window:
+            return(0.0)
+        return(self.window[-1][0] + 3600 - now)
+
+def configure_serve(**kwargs) -> None:
+    """
+    Function that updates the polling settings
+
+    @param kwargs: any of min_interval, max_interval, initial_interval, target_new, smoothing, budget
+    @returns: None
+    """
+    for key, value in kwargs.items():
+        if key not in SERVE_CONFIG:
+            raise KeyError('unknown serve setting %s' % (key))
+        if value is not None:
+            SERVE_CONFIG[key]=value
+
+def budget_stretch(schedules: list) -> float:
+    """
+    Function that scales every interval up when the projected hourly request rate of all searches would
+    exceed the budget, so busy searches keep their share instead of starving quiet ones
+
+    @param schedules: list of SearchSchedule
+    @returns: factor >= 1 applied to every interval
+    """
+    projected=sum(x.cost * 3600 / x.interval for x in schedules if x.cost is not None)
+    return(max(1.0, projected / SERVE_CONFIG['budget']))
+
+def release_claims(run: dict) -> int:
+    """
+    Function that un-claims the posting IDs a poll claimed but did not store: posts that failed to fetch or
+    parse, or every new ID of a poll that raised. A one-shot run forgets its claims when it exits, the daemon
+    keeps its seen-ID index, so without this they would never be retried
+
+    @param run: output of scrape.setup_run()
+    @returns: number of posting IDs released
+    """
+    claimed=run['database'].take_claims()
+    stored=read_rows(run['DB'], list(claimed), ['url'])
+    released=[x for x in claimed if x not in stored]
+    for posting_id in released:
+        run['database'].discard(posting_id)
+    return(len(released))
+
+def serve(run: dict, stems: dict) -> None:
+    """
+    Function that polls each search on its own adaptive schedule until SIGTERM or SIGINT. The seen-ID index,
+    HTTP connection pools, caches and database connections stay open between polls
+
+    @param run: output of scrape.setup_run()
+    @param stems: dict with search name as key and craigslist search stem URL as value
+    @returns: None
+    """
+    schedules=[SearchSchedule(name, stem) for name, stem in stems.items()]
+    budget=RequestBudget(SERVE_CONFIG['budget'])
+    stopping=[]
+    def stop(signum, frame):
+        logging.info('signal %s received, stopping after the current poll' % (signum))
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    totals={'polls' : 0, 'new' : 0, 'listings' : 0, 'failed' : 0, 'alerts' : 0, 'changed' : 0}
+    while not stopping:
+        schedule=min(schedules, key=lambda x: x.next_poll)
+        now=time.monotonic()
+        wait=max(schedule.next_poll - now, budget.wait_time(now, schedule.cost or 1))
+        if wait > 0:
+            # sleep in short steps so a signal stops the daemon promptly
+            time.sleep(min(wait, 5))
+            continue
+        before=request_count()
+        try:
+            figures=scrape_searches(run, {schedule.name : schedule.stem})
+        except Exception:
+            logging.exception('poll of %s failed' % (schedule.name))
+            figures={'new' : 0, 'listings' : 0, 'failed' : 0, 'alerts' : 0, 'changed' : 0}
+        released=release_claims(run)
+        if released:
+            logging.info('%s: %s listings not stored, they are retried on the next poll' % (schedule.name, released))
+        now=time.monotonic()
+        requests=request_count() - before
+        budget.record(now, requests)
+        schedule.update(now, figures['new'], requests)
+        schedule.next_poll=now + schedule.interval * budget_stretch(schedules)
+        totals['polls']+=1
+        for key in ('new', 'listings', 'failed', 'alerts', 'changed'):
+            totals[key]+=figures[key]
+        logging.info('%s: %s new listings, %s requests, next poll in %.0f seconds'
+                     % (schedule.name, figures['new'], requests, schedule.next_poll - now))
+        report_metrics(run, totals)
+    save_seen(run['DB'], run['database'])
+    run['DB'].close()
+
+def main(argv: list=None):
+    parser=argparse.ArgumentParser(prog='CLscraper serve', description='CLscraper daemon, polls each search on an adaptive schedule')
+    add_run_arguments(parser)
+    parser.add_argument('--min-interval', type=float, default=SERVE_CONFIG['min_interval'], help='shortest time between polls of one search, in seconds')
+    parser.add_argument('--max-interval', type=float, default=SERVE_CONFIG['max_interval'], help='longest time between polls of one search, in seconds')
+    parser.add_argument('--target-new', type=float, default=SERVE_CONFIG['target_new'], help='new listings a poll should find on average')
+    parser.add_argument('--budget', type=int, default=SERVE_CONFIG['budget'], help='maximum HTTP requests per hour, over all searches')
+    # a daemon polls newest-first searches often, so pagination stops at known listings by default
+    parser.set_defaults(incremental=True)
+    arguments=parser.parse_args(argv)
+    configure_serve(min_interval=arguments.min_interval, max_interval=arguments.max_interval,
+                    target_new=arguments.target_new, budget=arguments.budget)
+    run=setup_run(arguments)
+    serve(run, load_searches(arguments.searches_file, arguments.searches))
+    return()
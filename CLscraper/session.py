@@ -0,0 +1,72 @@
+import requests
+import time
+
+from requests.adapters import HTTPAdapter
+from CLscraper.metrics import observe_request
+
+# default HTTP client settings, overridden from the command line with configure_http()
+HTTP_CONFIG={'timeout' : 30,
+             'pool_size' : 8,
+             'max_hosts' : 10}
+
+# brotli transfer encoding is only decoded by urllib3 when the brotli package is installed
+try:
+    import brotli
+    ACCEPT_ENCODING='gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING='gzip, deflate'
+
+_SESSION=None
+
+def configure_http(**kwargs) -> None:
+    """
+    Function that updates the HTTP client settings, the shared session is rebuilt on next use
+
+    @param kwargs: any of timeout, pool_size, max_hosts
+    @returns: None
+    """
+    global _SESSION
+    for key, value in kwargs.items():
+        if key not in HTTP_CONFIG:
+            raise KeyError('unknown HTTP setting %s' % (key))
+        if value is not None:
+            HTTP_CONFIG[key]=value
+    if _SESSION is not None:
+        _SESSION.close()
+        _SESSION=None
+
+def get_session() -> requests.Session:
+    """
+    Function that returns the package wide requests.Session, which keeps a pool of keep-alive
+    connections per host (craigslist subdomains, Google Maps APIs, craigslist image servers)
+
+    @returns: requests.Session
+    """
+    global _SESSION
+    if _SESSION is None:
+        session=requests.Session()
+        adapter=HTTPAdapter(pool_connections=HTTP_CONFIG['max_hosts'], pool_maxsize=HTTP_CONFIG['pool_size'])
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding' : ACCEPT_ENCODING})
+        _SESSION=session
+    return(_SESSION)
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """
+    Function that makes a GET request through the shared session with the configured timeout, and records
+    its latency and size in the per-host run metrics
+
+    @param url: URL to request
+    @param kwargs: passed to requests.Session.get
+    @returns: requests.Response object
+    """
+    kwargs.setdefault('timeout', HTTP_CONFIG['timeout'])
+    start=time.perf_counter()
+    try:
+        response=get_session().get(url, **kwargs)
+    except requests.RequestException:
+        observe_request(url, time.perf_counter() - start, 0, 0)
+        raise
+    observe_request(url, time.perf_counter() - start, response.status_code, len(response.content))
+    return(response)
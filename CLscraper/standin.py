@@ -0,0 +1,164 @@
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# recorded craigslist and Google Maps responses served by the stand-in server
+FIXTURE_PATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# posting IDs handed out by the stand-in, newest first
+FIRST_ID=7400000000
+SEARCH_PAGE_SIZE=120
+
+def read_fixture(fixtures: str, name: str) -> bytes:
+    with open(os.path.join(fixtures, name), 'rb') as f:
+        return(f.read())
+
+def fill(template: str, values: dict) -> str:
+    """
+    Function that replaces @NAME@ placeholders in a fixture
+
+    @param template: fixture text
+    @param values: dict with placeholder name as key and replacement as value
+    @returns: filled in text
+    """
+    for key, value in values.items():
+        template=template.replace('@' + key + '@', str(value))
+    return(template)
+
+def listing_values(posting_id: int, base: str, revision: int=0) -> dict:
+    """
+    Function that gives every stand-in listing stable, varied attributes. Coordinates repeat every 50
+    listings, like a management company posting several units at one address, and every fourth listing
+    links to a website, which filter_spam() drops
+
+    @param posting_id: craigslist posting ID
+    @param base: base URL of the stand-in server
+    @param revision: number of times the listing was edited, each edit drops the price by 25 and moves the update time
+    @returns: dict of placeholder values
+    """
+    return({'POSTING_ID' : posting_id,
+            'BASE' : base,
+            'URL' : '%s/apa/d/portland-updated-craftsman/%s.html' % (base, posting_id),
+            'PRICE' : '{:,}'.format(2000 + (posting_id % 40) * 50 - revision * 25),
+            'UPDATED' : '2021-11-%02d %02d:%02d' % (1 + posting_id % 28, 10 + revision % 14, posting_id % 60),
+            'LAT' : '%.6f' % (45.40 + (posting_id % 50) * 0.002),
+            'LONG' : '%.6f' % (-122.70 + (posting_id % 50) * 0.002),
+            'CONTACT' : ('Professionally managed, schedule a showing at www.example-rentals.com' if posting_id % 4 == 0
+                         else 'Call or text to schedule a showing')})
+
+class StandinServer:
+    """
+    Local HTTP server that stands in for craigslist and the Google Maps APIs, serving the fixtures with
+    configurable latency and a configurable share of 429 Too Many Requests answers
+    """
+    def __init__(self, fixtures: str=FIXTURE_PATH, total: int=600, latency: float=0.0, error_rate: float=0.0,
+                 seed: int=0, port: int=0):
+        self.fixtures=fixtures
+        self.total=total
+        self.latency=latency
+        self.error_rate=error_rate
+        self.random=random.Random(seed)
+        self.lock=threading.Lock()
+        self.counts={}
+        # posting ID to number of edits, see edit()
+        self.revisions={}
+        self.templates={name : read_fixture(fixtures, name).decode('utf-8')
+                        for name in ('post.html', 'search.html', 'search_row.html')}
+        self.binaries={name : read_fixture(fixtures, name) for name in ('geocode.json', 'map.png', 'image.jpg')}
+        self.server=ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.base='http://127.0.0.1:%s' % (self.server.server_address[1])
+        self.thread=None
+
+    def handler(self):
+        standin=self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version='HTTP/1.1'
+
+            def do_GET(self):
+                status, content_type, body, headers=standin.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return(Handler)
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key]=self.counts.get(key, 0) + 1
+
+    def respond(self, path: str) -> tuple:
+        """
+        Function that builds the response to a GET request
+
+        @param path: request path and query string
+        @returns: tuple of (status, content type, body bytes, extra headers)
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        url=urllib.parse.urlsplit(path)
+        query=urllib.parse.parse_qs(url.query)
+        with self.lock:
+            throttled=self.error_rate > 0 and self.random.random() < self.error_rate
+        if throttled:
+            self.count('429')
+            return((429, 'text/plain', b'Too Many Requests', {'Retry-After' : '0'}))
+        if url.path.startswith('/search/'):
+            self.count('search')
+            return((200, 'text/html; charset=utf-8', self.search_page(int(query.get('s', ['0'])[0])).encode('utf-8'), {}))
+        if url.path.startswith('/apa/'):
+            self.count('post')
+            posting_id=int(os.path.basename(url.path).split('.')[0])
+            page=fill(self.templates['post.html'], listing_values(posting_id, self.base, self.revisions.get(posting_id, 0)))
+            return((200, 'text/html; charset=utf-8', page.encode('utf-8'), {}))
+        if url.path.endswith('/geocode/json'):
+            self.count('geocode')
+            return((200, 'application/json', self.binaries['geocode.json'], {}))
+        if url.path.endswith('/staticmap'):
+            self.count('map')
+            return((200, 'image/png', self.binaries['map.png'], {}))
+        if url.path.startswith('/images/'):
+            self.count('image')
+            return((200, 'image/jpeg', self.binaries['image.jpg'], {}))
+        self.count('404')
+        return((404, 'text/plain', b'Not Found', {}))
+
+    def search_page(self, offset: int) -> str:
+        ids=[FIRST_ID - i for i in range(offset, min(offset + SEARCH_PAGE_SIZE, self.total))]
+        rows='\n'.join([fill(self.templates['search_row.html'], listing_values(x, self.base, self.revisions.get(x, 0)))
+                       for x in ids])
+        return(fill(self.templates['search.html'], {'FROM' : offset + 1, 'TO' : offset + len(ids),
+                                                    'TOTAL' : self.total, 'RESULTS' : rows}))
+
+    def edit(self, posting_ids: list) -> None:
+        """
+        Edit listings, lowering their price and moving their update time, as landlords do
+
+        @param posting_ids: posting IDs to edit
+        @returns: None
+        """
+        with self.lock:
+            for posting_id in posting_ids:
+                self.revisions[posting_id]=self.revisions.get(posting_id, 0) + 1
+
+    def start(self) -> str:
+        """
+        Start serving in a background thread
+
+        @returns: base URL of the server
+        """
+        self.thread=threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return(self.base)
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
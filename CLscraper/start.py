@@ -1,82 +1,35 @@
 import argparse
-import logging
+import importlib
+import sys
 
-from CLscraper.helpers import *
-from CLscraper.lib import *
-from CLscraper.maps import *
-from CLscraper.email import *
-from CLscraper.searches import SEARCH_STEMS
+# subcommand name, module implementing it with a main(argv) function, and help text. The module is only
+# imported once its subcommand is chosen, so pandas, bs4, PIL and the Google clients are never loaded by
+# a command that does not use them
+COMMANDS={'scrape' : ('CLscraper.scrape', 'run every search once: fetch and parse new listings, send alerts and store them'),
+          'serve' : ('CLscraper.serve', 'keep polling every search on an adaptive schedule'),
+          'email' : ('CLscraper.email', 'send alert emails for listings already in the database'),
+          'query' : ('CLscraper.query', 'search the listing database'),
+          'migrate' : ('CLscraper.migrate', 'import the old TSV database and pack post text files'),
+          'bench' : ('CLscraper.bench', 'run the offline benchmarks against a local stand-in server')}
 
-def main():
-    # parse command line
-    parser=argparse.ArgumentParser(description='CLscraper')
-    parser.add_argument('base_path', type=str, nargs=1, help='base output path for files')
-    parser.add_argument('api', type=str, nargs=1, help='path to file with Google maps API key')
-    parser.add_argument('mailto', type=str, nargs=1, help='email address to send alters to')
-    parser.add_argument('gmail_creds', type=str, nargs=1, help='path to Gmail token json file')
-    arguments=parser.parse_args()
-    base_path=arguments.base_path[0]
-    api=arguments.api[0]
-    mailto=arguments.mailto[0]
-    gmail_creds=arguments.gmail_creds[0]
+def command_help() -> str:
+    """
+    @returns: one line per subcommand, for the top level --help
+    """
+    return('commands:\n' + '\n'.join(['  %-10s%s' % (name, text) for name, (module, text) in COMMANDS.items()]))
 
-    # set api key as global variable
-    with open(api, 'r') as file:
-        api_key=file.read().rstrip()
+def main(argv: list=None):
+    argv=sys.argv[1:] if argv is None else list(argv)
+    # the original command line, CLscraper BASE_PATH API MAILTO GMAIL_CREDS [options], runs a scrape
+    if len(argv) > 0 and argv[0] not in COMMANDS and argv[0] not in ('-h', '--help'):
+        argv=['scrape'] + argv
+    parser=argparse.ArgumentParser(prog='CLscraper', description='CLscraper', epilog=command_help(),
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   usage='%(prog)s COMMAND [arguments], see %(prog)s COMMAND --help')
+    parser.add_argument('command', choices=list(COMMANDS), metavar='COMMAND', help='one of %s' % (', '.join(COMMANDS)))
+    arguments=parser.parse_args(argv[:1])
+    module=importlib.import_module(COMMANDS[arguments.command][0])
+    module.main(argv[1:])
 
-    # import craigslist search stem URLs from searches.py
-    portland_stem=SEARCH_STEMS['portland_house']
-    seattle_stem=SEARCH_STEMS['seattle_house']
-    
-    # first check if requires directories are present, if not, create
-    log_path, database_path, file_path=create_paths(base_path)
-    # set up logging
-    curr_time=datetime.datetime.today().strftime("%d%m%Y_%H:%M")
-    logging.basicConfig(filename=os.path.join(log_path, curr_time + '.log.txt'), format='%(message)s    %(asctime)s',
-                   level=logging.INFO, filemode='w')
-
-    # check for database file, if not present, create empty database list
-    database_file=os.path.join(database_path, 'CL_database.main.txt')
-    if not os.path.exists(database_file):
-        database=[]
-        DB=None
-    else:
-        DB, database=check_database(database_file)
-    
-    logging.info('Database currently contains %s listings' % (len(database)))
-    # get urls from all posts that match our critera, then subset to those that aren't in our database
-    portland_recent_urls=search_links(portland_stem, database)
-    seattle_recent_urls=search_links(seattle_stem, database)
-    
-    logging.info("scraping %s links" % (len(set(portland_recent_urls + seattle_recent_urls))))
-
-    # scrape data for these urls 
-    CL_dict=scrape_data(portland_recent_urls + seattle_recent_urls)
-    
-    # parse soup
-    outlist=[]
-    fails=0
-    for key, value in CL_dict.items():
-        try:
-            outlist.append(extract_soup(value, key, file_path, api_key))
-        except:
-            logging.info("Listing ID %s failed" % (key))
-            fails+=1
-        
-    # make dataframe, combine with current database
-    out=pd.concat(outlist).reset_index()
-    # filter spam and send email alert
-    clean=filter_spam(out)
-    print("%s non-spam postings" % (len(clean))) 
-    email_dict=make_email_dict(clean, CL_dict, api_key)
-    print(len(email_dict))
-    message=create_email('me', mailto, 'Housing Email Alert', email_dict)
-    send_message(gmail_creds, message)
-    try:
-        FIN=pd.concat([DB, out])
-        FIN.to_csv(database_file, sep='\t', index=False)
-    except:
-        logging.info('database outputs non-conformable, writing new data to %s' % (database_file.replace('main', str(datetime.date.today()))))
-        out.to_csv(database_file.replace('main', str(datetime.date.today())), sep='\t', index=False)  
-    logging.info("%s listings added to database, %s listings failed" % (len(out), fails))
-    return()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import datetime
+import logging
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+
+from CLscraper.geoindex import ensure_index, index_listings, parse_price
+from CLscraper.schema import LISTING_SCHEMA, SCHEMA_VERSION, normalize_listings, schema_columns
+
+# columns written by make_output(), in order, after the posting ID column 'index'. The store keeps them in
+# the typed layout of schema.LISTING_SCHEMA
+LISTING_COLUMNS=['url', 'price', 'date_available', 'bed_bath', 'sqft', 'num_images', 'dog', 'scam',
+                 'property_management', 'angry_score', 'emoji', 'word_length', 'address', 'snippet', 'zipcode',
+                 'neighborhood', 'locality', 'date_posted', 'date_updated', 'latitude', 'longitude']
+
+def open_store(store_path: str) -> sqlite3.Connection:
+    """
+    Function that opens the listing store, creating the listings table if needed. The store runs in WAL
+    mode so every append is an atomic, crash-safe commit. A store written with an older schema version is
+    migrated to the typed columns first
+
+    @param store_path: file path of the SQLite listing store
+    @returns: sqlite3.Connection
+    """
+    connection=sqlite3.connect(store_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    created=connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'listings'").fetchone() is None
+    connection.execute('CREATE TABLE IF NOT EXISTS listings (%s)' % (schema_columns()))
+    connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    if created:
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+    # search page details last seen per listing, and every change delta sync found
+    connection.execute('CREATE TABLE IF NOT EXISTS listing_sync (posting_id INTEGER PRIMARY KEY, price TEXT, updated TEXT)')
+    connection.execute('CREATE TABLE IF NOT EXISTS listing_history (posting_id INTEGER, observed TEXT, field TEXT, '
+                       'old TEXT, new TEXT)')
+    connection.execute('CREATE INDEX IF NOT EXISTS listing_history_posting_id ON listing_history (posting_id)')
+    connection.commit()
+    version=get_meta(connection, 'schema_version')
+    if version is None or int(version) < SCHEMA_VERSION:
+        migrate_schema(connection)
+    ensure_index(connection)
+    return(connection)
+
+def store_columns(connection: sqlite3.Connection) -> list:
+    """
+    @param connection: output of open_store()
+    @returns: list of column names of the listings table, in order
+    """
+    return([row[1] for row in connection.execute('PRAGMA table_info(listings)')])
+
+def sql_value(value):
+    """
+    Function that converts pandas/numpy values to types sqlite3 can bind. Datetimes are written as ISO 8601
+    text, just the date when there is no time of day
+
+    @param value: any cell of a pd.DataFrame
+    @returns: None, int, float, str or bytes
+    """
+    if value is None or (pd.api.types.is_scalar(value) and pd.isnull(value)):
+        return(None)
+    if isinstance(value, datetime.datetime):
+        value=pd.Timestamp(value)
+        return(value.strftime('%Y-%m-%d') if value == value.normalize() else value.strftime('%Y-%m-%dT%H:%M:%S'))
+    if isinstance(value, np.generic):
+        return(value.item())
+    if isinstance(value, (int, float, str, bytes)):
+        return(value)
+    return(str(value))
+
+def sql_rows(df: pd.DataFrame) -> list:
+    """
+    Function that converts the rows of a pd.DataFrame to tuples of sql_value(). float32 columns are written
+    as their shortest decimal form, so coordinates are stored as scraped (45.4651, not 45.4650993347168)
+
+    @param df: pd.DataFrame
+    @returns: list of tuples
+    """
+    df=df.assign(**{x : df[x].astype(str).astype('float64') for x in df.columns if df[x].dtype == np.float32})
+    return([tuple(sql_value(x) for x in row) for row in df.itertuples(index=False, name=None)])
+
+def append_listings(connection: sqlite3.Connection, df: pd.DataFrame) -> int:
+    """
+    Function that appends new listings to the store in a single transaction. Rows whose posting ID is
+    already stored are skipped, columns the table does not have yet are added. New listings are added to
+    the query index in the same transaction
+
+    @param connection: output of open_store()
+    @param df: pd.DataFrame of listings with the posting ID in column 'index', normalized first if needed
+    @returns: number of rows inserted
+    """
+    df=normalize_listings(df)
+    existing=store_columns(connection)
+    columns=list(df.columns)
+    rows=sql_rows(df)
+    with connection:
+        for column in columns:
+            if column not in existing:
+                connection.execute('ALTER TABLE listings ADD COLUMN "%s"' % (column))
+        before=connection.total_changes
+        connection.executemany('INSERT OR IGNORE INTO listings (%s) VALUES (%s)'
+                               % (', '.join(['"%s"' % (x) for x in columns]), ', '.join('?' * len(columns))), rows)
+        inserted=connection.total_changes - before
+        if inserted:
+            index_listings(connection, list(df['index']))
+    return(inserted)
+
+def count_listings(connection: sqlite3.Connection) -> int:
+    """
+    @param connection: output of open_store()
+    @returns: number of listings in the store, counted without loading their IDs
+    """
+    return(connection.execute('SELECT COUNT(*) FROM listings').fetchone()[0])
+
+def listings_stamp(connection: sqlite3.Connection) -> str:
+    """
+    @param connection: output of open_store()
+    @returns: number of listings and newest posting ID of the store, e.g. to tell whether a saved Bloom
+    filter of its IDs is still up to date
+    """
+    return('%s:%s' % connection.execute('SELECT COUNT(*), MAX("index") FROM listings').fetchone())
+
+def load_ids(connection: sqlite3.Connection) -> list:
+    """
+    Function that reads every posting ID in the store, using the primary key index
+
+    @param connection: output of open_store()
+    @returns: list of posting IDs
+    """
+    return([row[0] for row in connection.execute('SELECT "index" FROM listings')])
+
+def read_listings(connection: sqlite3.Connection) -> pd.DataFrame:
+    """
+    Function that reads the whole store into a pd.DataFrame
+
+    @param connection: output of open_store()
+    @returns: pd.DataFrame in the typed layout of normalize_listings()
+    """
+    return(normalize_listings(pd.read_sql_query('SELECT * FROM listings ORDER BY rowid', connection)))
+
+def get_meta(connection: sqlite3.Connection, key: str) -> str:
+    """
+    @param connection: output of open_store()
+    @param key: name of a value in the meta table
+    @returns: the stored value, or None
+    """
+    row=connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return(None if row is None else row[0])
+
+def set_meta(connection: sqlite3.Connection, key: str, value: str) -> None:
+    """
+    @param connection: output of open_store()
+    @param key: name of a value in the meta table
+    @param value: value to store
+    @returns: None
+    """
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+def migrate_schema(connection: sqlite3.Connection, chunk: int=50000) -> int:
+    """
+    Function that rewrites the listings table of a store written before its schema version, e.g. with every
+    column as scraped text, into the typed columns of the current version. The rewrite is one transaction,
+    rows are converted chunk by chunk, and the query index is rebuilt from the new values
+
+    @param connection: output of open_store()
+    @param chunk: number of rows converted at once
+    @returns: number of listings migrated
+    """
+    old=store_columns(connection)
+    extra=[x for x in old if x != 'index' and x != 'bed_bath' and x not in LISTING_SCHEMA]
+    migrated=0
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute('DROP TABLE IF EXISTS listings_typed')
+        connection.execute('CREATE TABLE listings_typed (%s)' % (', '.join([schema_columns()] + ['"%s"' % (x) for x in extra])))
+        for df in pd.read_sql_query('SELECT * FROM listings ORDER BY rowid', connection, chunksize=chunk):
+            df=normalize_listings(df)
+            columns=list(df.columns)
+            connection.executemany('INSERT OR IGNORE INTO listings_typed (%s) VALUES (%s)'
+                                   % (', '.join(['"%s"' % (x) for x in columns]), ', '.join('?' * len(columns))),
+                                   sql_rows(df))
+            migrated+=len(df)
+        connection.execute('DROP TABLE listings')
+        connection.execute('ALTER TABLE listings_typed RENAME TO listings')
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'listing_index'").fetchone() is not None:
+            connection.execute('DELETE FROM listing_index')
+            index_listings(connection)
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    logging.info('migrated %s listings to schema version %s' % (migrated, SCHEMA_VERSION))
+    return(migrated)
+
+def migrate_tsv(connection: sqlite3.Connection, tsv_path: str) -> int:
+    """
+    Function that imports the old CL_database.main.txt TSV database into the store. The migration runs
+    once, it is recorded in the meta table and the TSV file is left untouched
+
+    @param connection: output of open_store()
+    @param tsv_path: file path of the TSV database
+    @returns: number of listings imported
+    """
+    if get_meta(connection, 'migrated_tsv') is not None or not os.path.exists(tsv_path):
+        return(0)
+    DB=pd.read_csv(tsv_path, sep='\t')
+    inserted=append_listings(connection, DB)
+    set_meta(connection, 'migrated_tsv', tsv_path)
+    logging.info('migrated %s listings from %s' % (inserted, tsv_path))
+    return(inserted)
+
+def read_rows(connection: sqlite3.Connection, posting_ids: list, columns: list) -> dict:
+    """
+    @param connection: output of open_store()
+    @param posting_ids: posting IDs to read
+    @param columns: columns to read
+    @returns: dict with posting ID as key and tuple of the column values as value, for stored listings
+    """
+    ids=[int(x) for x in posting_ids]
+    rows={}
+    for i in range(0, len(ids), 500):
+        batch=ids[i:i + 500]
+        for row in connection.execute('SELECT "index", %s FROM listings WHERE "index" IN (%s)'
+                                      % (', '.join(['"%s"' % (x) for x in columns]), ', '.join('?' * len(batch))), batch):
+            rows[row[0]]=row[1:]
+    return(rows)
+
+def changed_listings(connection: sqlite3.Connection, metadata: dict) -> list:
+    """
+    Function that compares the listing details of search pages with what is known about stored listings.
+    A listing has changed when its price or result date differs from the last search page it was seen
+    on. A listing seen for the first time is compared on price against its stored row, and its details
+    are recorded as the baseline for the next comparison
+
+    @param connection: output of open_store()
+    @param metadata: dict with posting ID as key and page_metadata() values as value
+    @returns: list of posting IDs of stored listings that changed
+    """
+    metadata={int(k) : v for k, v in metadata.items()}
+    stored=read_rows(connection, list(metadata), ['price'])
+    synced={}
+    ids=list(stored)
+    for i in range(0, len(ids), 500):
+        batch=ids[i:i + 500]
+        for posting_id, price, updated in connection.execute('SELECT posting_id, price, updated FROM listing_sync '
+                                                             'WHERE posting_id IN (%s)' % (', '.join('?' * len(batch))), batch):
+            synced[posting_id]=(parse_price(price), updated)
+    changed, baseline=([], [])
+    for posting_id, (price,) in stored.items():
+        details=metadata[posting_id]
+        if posting_id in synced:
+            if (parse_price(details['price']), details['updated']) != synced[posting_id]:
+                changed.append(posting_id)
+        elif parse_price(details['price']) != parse_price(price):
+            changed.append(posting_id)
+        else:
+            baseline.append((posting_id, details['price'], details['updated']))
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO listing_sync VALUES (?, ?, ?)', baseline)
+    return(changed)
+
+def sync_baseline(connection: sqlite3.Connection, metadata: dict, posting_ids: list) -> None:
+    """
+    Function that records the search page details of listings as the baseline of the next delta sync,
+    without touching their stored rows, e.g. for changed listings whose post could not be re-parsed
+
+    @param connection: output of open_store()
+    @param metadata: dict with posting ID as key and page_metadata() values as value
+    @param posting_ids: posting IDs to record
+    @returns: None
+    """
+    metadata={int(k) : v for k, v in metadata.items()}
+    rows=[(int(x), metadata.get(int(x), {}).get('price'), metadata.get(int(x), {}).get('updated')) for x in posting_ids]
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO listing_sync VALUES (?, ?, ?)', rows)
+
+def same_value(stored, value) -> bool:
+    """
+    @param stored: value read back from the store
+    @param value: output of sql_value()
+    @returns: True if writing value would store the same thing, SQLite stores booleans as integers
+    """
+    if isinstance(value, bool):
+        value=int(value)
+    if stored is None or value is None:
+        return(stored is None and value is None)
+    return(str(stored) == str(value))
+
+def update_listings(connection: sqlite3.Connection, df: pd.DataFrame, metadata: dict) -> int:
+    """
+    Function that overwrites stored listings with a fresh parse of their post, in a single transaction.
+    Every column that changed is appended to the listing_history table with its old and new value, and
+    the search page details the change was spotted on become the new sync baseline
+
+    @param connection: output of open_store()
+    @param df: pd.DataFrame of re-parsed listings with the posting ID in column 'index', normalized first if needed
+    @param metadata: dict with posting ID as key and page_metadata() values as value
+    @returns: number of changed fields recorded
+    """
+    df=normalize_listings(df)
+    existing=store_columns(connection)
+    columns=[x for x in df.columns if x != 'index' and x in existing]
+    stored=read_rows(connection, list(df['index']), columns)
+    metadata={int(k) : v for k, v in metadata.items()}
+    observed=datetime.datetime.now().isoformat(timespec='seconds')
+    history, updates, synced=([], [], [])
+    for row in sql_rows(df[['index'] + columns]):
+        posting_id, values=(int(row[0]), list(row[1:]))
+        if posting_id not in stored:
+            continue
+        for column, old, new in zip(columns, stored[posting_id], values):
+            if not same_value(old, new):
+                history.append((posting_id, observed, column, old, new))
+        updates.append(values + [posting_id])
+        details=metadata.get(posting_id, {})
+        synced.append((posting_id, details.get('price'), details.get('updated')))
+    with connection:
+        connection.executemany('UPDATE listings SET %s WHERE "index" = ?' % (', '.join(['"%s" = ?' % (x) for x in columns])), updates)
+        connection.executemany('INSERT INTO listing_history VALUES (?, ?, ?, ?, ?)', history)
+        connection.executemany('INSERT OR REPLACE INTO listing_sync VALUES (?, ?, ?)', synced)
+        index_listings(connection, [x[0] for x in synced])
+    return(len(history))
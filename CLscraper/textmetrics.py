@@ -0,0 +1,99 @@
+import emoji
+import re
+
+# property management companies, when several appear in a post the last one in this list wins
+COMPANIES=['tindel', 'invitation', 'pathlight', 'management group', 'lgi homes', 'windermere', 'green keys']
+COMPANY_RANK={c : i for i, c in enumerate(COMPANIES)}
+
+# all patterns are compiled once, at import
+COMPANY_PATTERN=re.compile('|'.join([re.escape(c) for c in COMPANIES]))
+LINK_PATTERN=re.compile(r'(http|www)[s]?')
+# a space separated word without lowercase letters or digits, see count_caps_words()
+CAPS_PATTERN=re.compile(r'(?<![^ ])[^a-z0-9 ]+(?![^ ])')
+NO_PETS_PATTERN=re.compile(r'no (?:pet|dog|animal)s?')
+PETS_PATTERN=re.compile(r'(?:pet|dog|animal)s?')
+WORD_PATTERN=re.compile(r'\w+')
+DIGITS_PATTERN=re.compile(r'\d+')
+SCAM_PATTERN=re.compile(r'lease to own|rent to own|real estate agent|purchase program|realtor|loftium')
+# every single character emoji, so emoji can be counted with one regex scan instead of a lookup per character
+EMOJI_PATTERN=re.compile('[' + ''.join(sorted(re.escape(x) for x in emoji.EMOJI_DATA if len(x) == 1)) + ']')
+
+def property_management(body: str) -> str:
+    """
+    Function to look for specific property managment companies or web links in post body
+
+    @param body: post text stripped from HTML
+    @returns: property management name or a web address from the post
+    """
+    found=COMPANY_PATTERN.findall(body.lower())
+    if found:
+        return(max(found, key=COMPANY_RANK.get))
+    if LINK_PATTERN.search(body):
+        return("".join([x for x in body.split(" ") if LINK_PATTERN.search(x.lower())]))
+    return(None)
+
+def count_caps_words(body: str) -> int:
+    """
+    Function that counts the number of ALL CAPS WORDS
+
+    @param body: text of craigslist posting
+    @returns: the number of space separated words without lowercase letters or digits
+    """
+    return(len(CAPS_PATTERN.findall(body)))
+
+def dog_from_text(body: str) -> str:
+    """
+    Function to look for pet friendliness indicators in post body text
+
+    @param body: post text stripped from HTML
+    @returns: doggo an indicator of dog friendliness, can be: no, unknown, or a snippet of the post
+    """
+    lower=body.lower()
+    if NO_PETS_PATTERN.search(lower):
+        return('no')
+    if PETS_PATTERN.search(lower):
+        return(" ".join([x for x in body.split(".") if PETS_PATTERN.search(x.lower())]))
+    return('unknown')
+
+def sqft_from_text(body: str) -> str:
+    """
+    Function that estimates square footage from the post text
+
+    @param body: post text stripped from HTML
+    @returns: square footage with the caveat (estimated), or None
+    """
+    if 'ft' not in body:
+        return(None)
+    matches=[DIGITS_PATTERN.findall(x) for x in three_words_before_ft(body)]
+    if not matches or not max(matches):
+        return(None)
+    return(str(max(matches)[0]) + "(estimated)")
+
+def three_words_before_ft(body: str) -> list:
+    """
+    Function equivalent to re.findall(r'(( \w+){3}) ft', body)[i][0], without the regex backtracking at every
+    position of the post. A match can only end at a ' ft', and is then made of the three space separated
+    words just before it, so only those are checked
+
+    @param body: post text stripped from HTML
+    @returns: list of strings, each a space and three words
+    """
+    found=[]
+    start=0
+    end=body.find(' ft')
+    while end != -1:
+        parts=body[start:end].rsplit(' ', 3)
+        if len(parts) == 4 and all(WORD_PATTERN.fullmatch(x) for x in parts[1:]):
+            found.append(' ' + ' '.join(parts[1:]))
+            start=end + 3
+        end=body.find(' ft', end + 3)
+    return(found)
+
+def count_emoji(text: str) -> int:
+    """
+    Function that counts the number of emojis in a string
+
+    @param text: any string, e.g. a posting title
+    @returns: the number of emojis in the string
+    """
+    return(len(EMOJI_PATTERN.findall(text)))
@@ -4,5 +4,6 @@ setup(
     name='CLscraper Setup File',
     version='1.0',
     packages=find_packages(),
+    package_data={'CLscraper' : ['fixtures/*']},
     entry_points={'console_scripts' : ['CLscraper=CLscraper.start:main']}
 )